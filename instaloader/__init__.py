@@ -12,14 +12,30 @@ except ImportError:
 else:
     win_unicode_console.enable()
 
+from .adaptiveratecontroller import AdaptiveRateController as AdaptiveRateController
+from .asynccontext import AsyncInstaloaderContext as AsyncInstaloaderContext
+from .cassette import (Cassette as Cassette,
+                       ReplayRateController as ReplayRateController)
 from .exceptions import *
 from .instaloader import Instaloader as Instaloader
 from .instaloadercontext import (InstaloaderContext as InstaloaderContext,
-                                 RateController as RateController)
+                                 QueryPriority as QueryPriority,
+                                 QueryScheduler as QueryScheduler,
+                                 RateController as RateController,
+                                 RateControllerStatistics as RateControllerStatistics)
 from .lateststamps import LatestStamps as LatestStamps
+from .metadatacache import MetadataCache as MetadataCache
 from .nodeiterator import (NodeIterator as NodeIterator,
+                           AsyncNodeIterator as AsyncNodeIterator,
                            FrozenNodeIterator as FrozenNodeIterator,
                            resumable_iteration as resumable_iteration)
+from .pagelengths import PageLengths as PageLengths
+from .persistentratecontroller import PersistentRateController as PersistentRateController
+from .queryestimate import QueryEstimate as QueryEstimate
+from .sectioniterator import (SectionIterator as SectionIterator,
+                              AsyncSectionIterator as AsyncSectionIterator,
+                              FrozenSectionIterator as FrozenSectionIterator)
+from .sharedratecontroller import SharedRateController as SharedRateController
 from .structures import (Hashtag as Hashtag,
                          Highlight as Highlight,
                          Post as Post,
@@ -2,19 +2,26 @@
 
 import ast
 import datetime
+import json
+import math
 import os
 import re
+import signal
 import sys
 from argparse import ArgumentParser, ArgumentTypeError, SUPPRESS
 from enum import IntEnum
-from typing import List, Optional
-
-from . import (AbortDownloadException, BadCredentialsException, Instaloader, InstaloaderException,
-               InvalidArgumentException, LoginException, Post, Profile, ProfileNotExistsException, StoryItem,
-               TwoFactorAuthRequiredException, __version__, load_structure_from_file)
-from .instaloader import (get_default_session_filename, get_default_stamps_filename)
+from typing import Callable, List, Optional, Tuple
+
+from . import (AbortDownloadException, AdaptiveRateController, BadCredentialsException, Cassette, Hashtag,
+               Instaloader, InstaloaderContext, InstaloaderException, InvalidArgumentException, LoginException,
+               PersistentRateController, Post, Profile, ProfileNotExistsException, QueryEstimate, RateController,
+               ReplayRateController, SharedRateController, StoryItem, TwoFactorAuthRequiredException, __version__,
+               load_structure_from_file, structures)
+from .instaloader import (get_default_page_lengths_filename, get_default_rate_controller_state_filename,
+                          get_default_session_filename, get_default_stamps_filename)
 from .instaloadercontext import default_user_agent
 from .lateststamps import LatestStamps
+from .nodeiterator import NodeIterator
 try:
     import browser_cookie3
     bc3_library = True
@@ -132,6 +139,160 @@ def import_session(browser, instaloader, cookiefile):
         print(f"Next time use --login={username} to reuse the same session.")
 
 
+def _estimate(instaloader: Instaloader, targetlist: List[str],
+              download_profile_pic: bool = True, download_posts=True,
+              download_stories: bool = False,
+              download_highlights: bool = False,
+              download_tagged: bool = False,
+              download_reels: bool = False,
+              download_igtv: bool = False,
+              max_count: Optional[int] = None,
+              rate_controller: Optional[Callable[[InstaloaderContext], RateController]] = None) -> None:
+    """Print the expected number of queries per type for downloading the given targets, and the time they take.
+
+    The query types are the ones of the queries done when downloading, and the time is simulated with a rate controller
+    made by the given factory, as used when downloading."""
+    # pylint:disable=protected-access
+    context = instaloader.context
+    iphone = context.is_logged_in and context.iphone_support
+    estimate = QueryEstimate(sleep=context.sleep)
+    # targets of which the number of items is not known in advance
+    unknown = []
+
+    def page_length(query_type: str) -> int:
+        # the page length that NodeIterator queries with, see --adaptive-page-length
+        if context.page_lengths is not None:
+            return context.page_lengths.length(query_type)
+        return NodeIterator.page_length()
+
+    def add_post_queries(count: int, comments: Optional[int] = None):
+        if instaloader.download_comments and context.is_logged_in:
+            if comments is None:
+                # assume that the comments fit into one page
+                estimate.add(structures._COMMENTS_QUERY_HASH, count)
+            elif comments > 0:
+                estimate.add(Post._comments_query_type(comments),
+                             count * math.ceil(comments / NodeIterator.page_length()))
+        if instaloader.download_geotags and context.is_logged_in:
+            estimate.add('other', count)
+
+    def add_posts(query_type: str, count: Optional[int], target: str, length: Optional[int] = None):
+        # pages of posts, each followed by the queries per post
+        length = length or page_length(query_type)
+        if count is None:
+            unknown.append(target)
+            count = length
+        for first in range(0, max(count, 1), length):
+            estimate.add(query_type)
+            add_post_queries(min(length, count - first))
+
+    def limited(count: Optional[int]) -> Optional[int]:
+        return count if max_count is None or count is None else min(count, max_count)
+
+    # profiles to download, with None for followees, whose metadata is not queried for the estimate
+    profiles: List[Tuple[Optional[Profile], str]] = []
+    for target in targetlist:
+        if (target.endswith('.json') or target.endswith('.json.xz')) and os.path.isfile(target):
+            add_post_queries(1)
+            continue
+        target = target.rstrip('/')
+        with context.error_catcher(target):
+            if re.match(r"^@[A-Za-z0-9._]+$", target):
+                profile = Profile.from_username(context, target[1:])
+                estimate.add('iphone')
+                add_posts(structures._FOLLOWEES_QUERY_HASH, profile.followees, target)
+                profiles.extend([(None, target)] * profile.followees)
+            elif re.match(r"^#\w+$", target):
+                hashtag = Hashtag.from_name(context, target[1:])
+                estimate.add('iphone')
+                add_posts(structures._HASHTAG_POSTS_QUERY_HASH, limited(hashtag.mediacount), target)
+            elif re.match(r"^-[A-Za-z0-9-_]+$", target):
+                post = Post.from_shortcode(context, target[1:])
+                estimate.add(structures._POST_DOC_ID)
+                add_post_queries(1, post.comments)
+            elif re.match(r"^%[0-9]+$", target):
+                add_posts('other', max_count, target)
+            elif target == ":feed":
+                # get_feed_posts() queries pages of 12 posts, rather than with a NodeIterator
+                add_posts(structures._FEED_QUERY_HASH, max_count, target, 12)
+            elif target == ":stories":
+                estimate.add(structures._REELS_TRAY_QUERY_HASH)
+                estimate.add(structures._STORIES_QUERY_HASH)
+                unknown.append(target)
+            elif target == ":saved":
+                add_posts(structures._SAVED_POSTS_QUERY_HASH, max_count, target)
+            elif re.match(r"^[A-Za-z0-9._]+$", target):
+                profiles.append((Profile.from_username(context, target), target))
+                estimate.add('iphone')
+            else:
+                raise ProfileNotExistsException('Invalid target {}'.format(target))
+    for profile, target in profiles:
+        if download_profile_pic and iphone:
+            estimate.add('iphone')
+        if download_tagged:
+            add_posts(structures._TAGGED_POSTS_QUERY_HASH, None, target)
+        if download_reels:
+            add_posts(structures._REELS_DOC_ID, None, target)
+        if download_igtv:
+            add_posts(structures._IGTV_POSTS_QUERY_HASH, profile.igtvcount if profile else None, target)
+        if download_highlights:
+            estimate.add(structures._USER_REEL_QUERY_HASH)
+            estimate.add(structures._HIGHLIGHT_ITEMS_QUERY_HASH)
+            if iphone:
+                estimate.add('iphone')
+            unknown.append(target)
+        if download_posts:
+            add_posts(structures._PROFILE_POSTS_DOC_ID, profile.mediacount if profile else None, target)
+    if download_stories and profiles:
+        estimate.add(structures._STORIES_QUERY_HASH, math.ceil(len(profiles) / 50))
+        if iphone:
+            estimate.add('iphone', len(profiles))
+
+    simulated_rate_controller = rate_controller(context) if rate_controller is not None else RateController(context)
+    try:
+        seconds = estimate.simulate(simulated_rate_controller)
+    finally:
+        simulated_rate_controller.close()
+    print("Estimated queries per type:")
+    for query_type, count in sorted(estimate.counts.items(), key=lambda item: -item[1]):
+        print("{:>32}: {:8}".format(query_type, count))
+    print("{:>32}: {:8}".format("total", estimate.total))
+    print("Estimated time for these queries: {}".format(datetime.timedelta(seconds=round(seconds))))
+    if unknown:
+        print("Assumed one page or item for targets with unknown number of items: {}"
+              .format(' '.join(sorted(set(unknown)))))
+
+
+def _report_rate_statistics(instaloader: Instaloader, statistics_file: Optional[str] = None) -> None:
+    """Log a summary of the queries made and the time waited for the rate limits, and write them as JSON into
+    given file. Without a file, the summary is only logged if the rate limits made Instaloader wait."""
+    context = instaloader.context
+    statistics = context.rate_controller_statistics()
+    if statistics_file is None and round(statistics.wait_time + statistics.too_many_requests_wait_time) == 0:
+        return
+    if statistics.queries:
+        context.log("Queries: {}, {} of which were answered with 429 Too Many Requests.".format(
+            sum(statistics.queries.values()), sum(statistics.too_many_requests.values())))
+        for query_type, count in sorted(statistics.queries.items(), key=lambda item: -item[1]):
+            too_many_requests = statistics.too_many_requests.get(query_type, 0)
+            context.log("{:>32}: {:6}".format(query_type, count) +
+                        (" ({} with 429)".format(too_many_requests) if too_many_requests else ""))
+        context.log("Waited {} for rate limits (at most {} at once), and {} after 429 responses.".format(
+            datetime.timedelta(seconds=round(statistics.wait_time)),
+            datetime.timedelta(seconds=round(statistics.max_wait_time)),
+            datetime.timedelta(seconds=round(statistics.too_many_requests_wait_time))))
+    with context._statistics_lock:  # pylint:disable=protected-access
+        waittime, overlapped_waittime = context.rate_limit_waittime, context.rate_limit_overlapped_waittime
+    if waittime > 0:
+        context.log("Waited {} in total between queries, {} of which were used for downloading.".format(
+            datetime.timedelta(seconds=round(waittime)), datetime.timedelta(seconds=round(overlapped_waittime))))
+    if statistics_file is not None:
+        with open(statistics_file, 'w', encoding='utf-8') as file:
+            json.dump({**statistics._asdict(),
+                       'total_wait_time': waittime,
+                       'overlapped_wait_time': overlapped_waittime}, file, indent=4)
+
+
 def _main(instaloader: Instaloader, targetlist: List[str],
           username: Optional[str] = None, password: Optional[str] = None,
           sessionfile: Optional[str] = None,
@@ -146,7 +307,10 @@ def _main(instaloader: Instaloader, targetlist: List[str],
           max_count: Optional[int] = None, post_filter_str: Optional[str] = None,
           storyitem_filter_str: Optional[str] = None,
           browser: Optional[str] = None,
-          cookiefile: Optional[str] = None) -> ExitCode:
+          cookiefile: Optional[str] = None,
+          estimate: bool = False,
+          rate_statistics_file: Optional[str] = None,
+          rate_controller: Optional[Callable[[InstaloaderContext], RateController]] = None) -> ExitCode:
     """Download set of profiles, hashtags etc. and handle logging in and session files if desired."""
     # Parse and generate filter function
     post_filter = None
@@ -166,6 +330,16 @@ def _main(instaloader: Instaloader, targetlist: List[str],
         import_session(browser.lower(), instaloader, cookiefile)
     elif browser and not bc3_library:
         raise InvalidArgumentException("browser_cookie3 library is needed to load cookies from browsers")
+    if estimate:
+        # trust the session file, rather than querying Instagram to test it
+        if username is not None:
+            try:
+                instaloader.load_session_from_file(username, sessionfile)
+            except FileNotFoundError as err:
+                instaloader.context.error("Warning: {} Estimating for anonymous access.".format(err))
+        _estimate(instaloader, targetlist, download_profile_pic, download_posts, download_stories,
+                  download_highlights, download_tagged, download_reels, download_igtv, max_count, rate_controller)
+        return ExitCode.SUCCESS
     # Login, if desired
     if username is not None:
         if not re.match(r"^[A-Za-z0-9._]+$", username):
@@ -334,6 +508,7 @@ def _main(instaloader: Instaloader, targetlist: List[str],
     except AbortDownloadException as exc:
         print("\nDownload aborted: {}.".format(exc), file=sys.stderr)
         exit_code = ExitCode.DOWNLOAD_ABORTED
+    _report_rate_statistics(instaloader, rate_statistics_file)
     # Save session if it is useful
     if instaloader.context.is_logged_in:
         instaloader.save_session_to_file(sessionfile)
@@ -349,6 +524,11 @@ def _main(instaloader: Instaloader, targetlist: List[str],
     return exit_code
 
 
+def _abort_on_signal(signum, _frame):
+    # Abort like --abort-on does, which saves the resume information of the current download loop.
+    raise AbortDownloadException("Terminated by {}".format(signal.Signals(signum).name))
+
+
 def main():
     parser = ArgumentParser(description=__doc__, add_help=False, usage=usage_string(),
                             epilog="The complete documentation can be found at "
@@ -500,6 +680,11 @@ def main():
                        help='Do not resume a previously-aborted download iteration, and do not save such information '
                             'when interrupted.')
     g_how.add_argument('--use-aged-resume-files', action='store_true', help=SUPPRESS)
+    g_how.add_argument('--checkpoint-every', metavar='N', type=int,
+                       help='Also save the information to resume a download every N posts, so that it can be resumed '
+                            'after the process has been killed.')
+    g_how.add_argument('--checkpoint-interval', metavar='SECONDS', type=float,
+                       help='Also save the information to resume a download about every SECONDS seconds.')
     g_how.add_argument('--user-agent',
                        help='User Agent to use for HTTP requests. Defaults to \'{}\'.'.format(default_user_agent()))
     g_how.add_argument('-S', '--no-sleep', action='store_true', help=SUPPRESS)
@@ -510,6 +695,36 @@ def main():
     g_how.add_argument('--commit-mode', action='store_true', help=SUPPRESS)
     g_how.add_argument('--request-timeout', metavar='N', type=float, default=300.0,
                        help='Seconds to wait before timing out a connection request. Defaults to 300.')
+    g_how.add_argument('--download-workers', metavar='N', type=int, default=1,
+                       help='Number of threads to download pictures and videos of posts with, while the metadata of '
+                            'the following posts is already being obtained. Defaults to 1.')
+    g_how.add_argument('--target-workers', metavar='N', type=int, default=1,
+                       help='Number of profiles to download concurrently, so that one profile proceeds while '
+                            'another one waits for the rate limit of its query type. Defaults to 1.')
+    g_how.add_argument('--download-backlog', metavar='N', type=int, default=0,
+                       help='Defer downloading the pictures and videos of up to N posts, to download them while '
+                            'waiting for the rate limits rather than sleeping idly.')
+    g_how.add_argument('--prefetch-pages', action='store_true',
+                       help='Query the next page of posts in the background while the current page is being '
+                            'downloaded, if the rate limits allow it right away.')
+    g_how.add_argument('--adaptive-page-length', nargs='?', metavar='FILE',
+                       const=get_default_page_lengths_filename(),
+                       help='Query longer pages of posts, comments etc. as far as Instagram serves them, saving '
+                            'queries, and keep the learned page lengths in given file.')
+    g_how.add_argument('--metadata-cache', metavar='DIR',
+                       help='Cache the responses of profile, post and hashtag metadata lookups in given directory '
+                            'and reuse them in later runs for up to an hour, saving requests to Instagram.')
+    g_how.add_argument('--shared-rate-limit', nargs='?', const='', metavar='FILE',
+                       help='Share the rate limit budget with other Instaloader instances on this machine that use '
+                            'the same login, by recording the queries in given database file (by default in the '
+                            'configuration directory).')
+    g_how.add_argument('--rate-controller-state', nargs='?', metavar='FILE',
+                       const=get_default_rate_controller_state_filename(),
+                       help='Save the state of the rate controller into given file when exiting and load it when '
+                            'starting, so that a restarted Instaloader considers the queries done before.')
+    g_how.add_argument('--adaptive-rate-limit', nargs='?', const='', metavar='FILE',
+                       help='Learn the rate limits from "429 Too Many Requests" responses, and optionally keep the '
+                            'learned limits in given file.')
     g_how.add_argument('--abort-on', type=http_status_code_list, metavar="STATUS_CODES",
                        help='Comma-separated list of HTTP status codes that cause Instaloader to abort, bypassing all '
                             'retry logic.')
@@ -521,11 +736,24 @@ def main():
                         help='Disable user interaction, i.e. do not print messages (except errors) and fail '
                              'if login credentials are needed but not given. This makes Instaloader suitable as a '
                              'cron job.')
+    g_misc.add_argument('--estimate', action='store_true',
+                        help='Rather than downloading, print the expected number of queries per type and the time '
+                             'they take considering the rate limits.')
+    g_misc.add_argument('--rate-statistics', metavar='FILE',
+                        help='Write statistics of the queries made and the time waited for the rate limits as JSON '
+                             'into given file when finished.')
+    g_misc.add_argument('--record-cassette', metavar='FILE',
+                        help='Record all HTTP exchanges into given cassette file, to replay them later with '
+                             '--replay-cassette.')
+    g_misc.add_argument('--replay-cassette', metavar='FILE',
+                        help='Replay the HTTP exchanges recorded into given cassette file with --record-cassette '
+                             'rather than accessing the network, without any delays.')
     g_misc.add_argument('-h', '--help', action='help', help='Show this help message and exit.')
     g_misc.add_argument('--version', action='version', help='Show version number and exit.',
                         version=__version__)
 
     args = parser.parse_args()
+    signal.signal(signal.SIGTERM, _abort_on_signal)
     try:
         if (args.login is None and args.load_cookies is None) and (args.stories or args.stories_only):
             print("Login is required to download stories.", file=sys.stderr)
@@ -558,12 +786,38 @@ def main():
         if args.login and args.load_cookies:
             raise InvalidArgumentException('--load-cookies and --login cannot be used together.')
 
+        if args.record_cassette and args.replay_cassette:
+            raise InvalidArgumentException('--record-cassette and --replay-cassette cannot be used together.')
+        transport = None
+        if args.record_cassette:
+            transport = Cassette(args.record_cassette, record=True)
+        elif args.replay_cassette:
+            transport = Cassette(args.replay_cassette)
+
+        if sum((args.shared_rate_limit is not None, args.rate_controller_state is not None,
+                args.adaptive_rate_limit is not None)) > 1:
+            raise InvalidArgumentException('Only one of --shared-rate-limit, --rate-controller-state and '
+                                           '--adaptive-rate-limit can be used.')
+        rate_controller = None
+        if args.replay_cassette:
+            rate_controller = ReplayRateController
+        elif args.shared_rate_limit is not None:
+            shared_rate_limit_file = args.shared_rate_limit or None
+            rate_controller = lambda ctx: SharedRateController(ctx, shared_rate_limit_file)
+        elif args.rate_controller_state:
+            rate_controller_state_file = args.rate_controller_state
+            rate_controller = lambda ctx: PersistentRateController(ctx, rate_controller_state_file)
+        elif args.adaptive_rate_limit is not None:
+            adaptive_rate_limit_file = args.adaptive_rate_limit or None
+            rate_controller = lambda ctx: AdaptiveRateController(ctx, adaptive_rate_limit_file)
+
         # Determine what to download
         download_profile_pic = not args.no_profile_pic or args.profile_pic_only
         download_posts = not (args.no_posts or args.stories_only or args.profile_pic_only)
         download_stories = args.stories or args.stories_only
 
-        loader = Instaloader(sleep=not args.no_sleep, quiet=args.quiet, user_agent=args.user_agent,
+        loader = Instaloader(sleep=not args.no_sleep and not args.replay_cassette, quiet=args.quiet,
+                             user_agent=args.user_agent,
                              dirname_pattern=args.dirname_pattern, filename_pattern=args.filename_pattern,
                              download_pictures=not args.no_pictures,
                              download_videos=not args.no_videos, download_video_thumbnails=not args.no_video_thumbnails,
@@ -576,11 +830,21 @@ def main():
                              request_timeout=args.request_timeout,
                              resume_prefix=resume_prefix,
                              check_resume_bbd=not args.use_aged_resume_files,
+                             checkpoint_every=args.checkpoint_every,
+                             checkpoint_interval=args.checkpoint_interval,
                              slide=args.slide,
                              fatal_status_codes=args.abort_on,
                              iphone_support=not args.no_iphone,
                              title_pattern=args.title_pattern,
-                             sanitize_paths=args.sanitize_paths)
+                             sanitize_paths=args.sanitize_paths,
+                             download_workers=args.download_workers,
+                             download_backlog=args.download_backlog,
+                             target_workers=args.target_workers,
+                             prefetch_pages=args.prefetch_pages,
+                             page_lengths=args.adaptive_page_length,
+                             metadata_cache=args.metadata_cache,
+                             transport=transport,
+                             rate_controller=rate_controller)
         exit_code = _main(loader,
                           args.profile,
                           username=args.login.lower() if args.login is not None else None,
@@ -599,7 +863,10 @@ def main():
                           post_filter_str=args.post_filter,
                           storyitem_filter_str=args.storyitem_filter,
                           browser=args.load_cookies,
-                          cookiefile=args.cookiefile)
+                          cookiefile=args.cookiefile,
+                          estimate=args.estimate,
+                          rate_statistics_file=args.rate_statistics,
+                          rate_controller=rate_controller)
         loader.close()
         if loader.has_stored_errors:
             exit_code = ExitCode.NON_FATAL_ERROR
@@ -0,0 +1,130 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from .instaloadercontext import InstaloaderContext, RateController
+
+
+class AdaptiveRateController(RateController):
+    """
+    :class:`RateController` that learns the rate limits from 429 Too Many Requests responses, rather than relying on
+    fixed limits.
+
+    It keeps a budget, i.e. a number of queries per sliding window, per query type, and for all GraphQL queries
+    together (as ``'graphql'``). Initially, the budgets are the limits of :class:`RateController`. After a 429
+    response, the budgets of the query type (and of all GraphQL queries, if it is one) are multiplied by *decrease*.
+    With each query, they grow by *increase* divided by the budget, i.e. by *increase* per budget's worth of queries,
+    up to *max_factor* times the initial budget (additive increase, multiplicative decrease).
+
+    By default, *max_factor* is 1, i.e. the budgets only fall below the limits of :class:`RateController` after 429
+    responses and recover up to them, but never exceed them. These limits are known to be tolerated, whereas Instagram
+    does not tell the actual ones, and probing above them risks not only 429 responses, but also the account being
+    flagged or logged out. A *max_factor* above 1 lets the budgets grow beyond the known limits until a 429 response;
+    use it only with accounts that may take this risk.
+
+    The budgets are kept per logged-in account and can be observed with :attr:`budgets`. If *path* is given, they are
+    loaded from this JSON file, if it exists and is valid, and saved to it after each 429 response and, if they have
+    grown, when the context is closed::
+
+       L = instaloader.Instaloader(rate_controller=lambda ctx: instaloader.AdaptiveRateController(ctx, 'budgets.json'))
+
+    :param context: The :class:`InstaloaderContext` whose queries to control.
+    :param path: Path of the file to persist the budgets in, or None.
+    :param decrease: Factor that the budgets are multiplied by after a 429 response.
+    :param increase: Number of queries the budgets grow by per budget's worth of queries.
+    :param max_factor: Upper limit of the budgets, relative to the limits of :class:`RateController`.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, context: InstaloaderContext, path: Optional[str] = None, decrease: float = 0.5,
+                 increase: float = 1.0, max_factor: float = 1.0):
+        super().__init__(context)
+        self.path = path
+        self.decrease = decrease
+        self.increase = increase
+        self.max_factor = max_factor
+        self._budgets: Dict[str, Dict[str, float]] = dict()
+        # whether the budgets have changed since they were saved
+        self._unsaved = False
+        if path is not None:
+            try:
+                with open(path, encoding='utf-8') as file:
+                    accounts = json.load(file)['accounts']
+                self._budgets = {str(account): {str(key): float(budget) for key, budget in budgets.items()}
+                                 for account, budgets in accounts.items()}
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self._budgets = dict()
+
+    @property
+    def budgets(self) -> Dict[str, float]:
+        """Learned budgets of the logged-in account (or of anonymous queries), i.e. number of queries per sliding
+        window, by query type or ``'graphql'`` for all GraphQL queries. Budgets that have not been adapted yet are
+        omitted."""
+        return dict(self._account_budgets())
+
+    def _account_budgets(self) -> Dict[str, float]:
+        return self._budgets.setdefault(self._context.username or '', dict())
+
+    def _initial_budget(self, key: str) -> int:
+        if key == 'graphql':
+            return super()._graphql_count_per_sliding_window()
+        return super().count_per_sliding_window(key)
+
+    def _budget(self, key: str) -> float:
+        return self._account_budgets().get(key, float(self._initial_budget(key)))
+
+    def count_per_sliding_window(self, query_type: str) -> int:
+        return max(1, int(self._budget(query_type)))
+
+    def _graphql_count_per_sliding_window(self) -> int:
+        return max(1, int(self._budget('graphql')))
+
+    def _iphone_count_per_long_sliding_window(self) -> int:
+        # scale the limit of the 30 minutes window like the one of the 11 minutes window
+        return max(1, int(super()._iphone_count_per_long_sliding_window() * self._budget('iphone') /
+                          self._initial_budget('iphone')))
+
+    def _adapted_keys(self, query_type: str) -> List[str]:
+        return [query_type] if query_type in ['iphone', 'other'] else [query_type, 'graphql']
+
+    def _track_query(self, query_type: str, timestamp: float) -> None:
+        with self._lock:
+            super()._track_query(query_type, timestamp)
+            budgets = self._account_budgets()
+            for key in self._adapted_keys(query_type):
+                budget = self._budget(key)
+                max_budget = self.max_factor * self._initial_budget(key)
+                if budget < max_budget:
+                    budgets[key] = min(max_budget, budget + self.increase / budget)
+                    self._unsaved = True
+
+    def _report_429(self, query_type: str) -> float:
+        with self._lock:
+            budgets = self._account_budgets()
+            for key in self._adapted_keys(query_type):
+                budgets[key] = max(1.0, self._budget(key) * self.decrease)
+                self._context.log("Reduced budget of {} queries to {} per sliding window."
+                                  .format(key, int(budgets[key])))
+        self.save()
+        return super()._report_429(query_type)
+
+    def save(self) -> None:
+        """Save the budgets to the file given as *path*, if any."""
+        if self.path is None:
+            return
+        with self._lock:
+            # write atomically, so that the file is complete even if the process is killed meanwhile
+            temp_path = self.path + '.temp'
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'accounts': self._budgets}, file)
+            os.replace(temp_path, self.path)
+            self._unsaved = False
+
+    def close(self) -> None:
+        """Save the budgets, if they have changed since they were saved."""
+        with self._lock:
+            if self._unsaved:
+                self.save()
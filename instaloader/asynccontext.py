@@ -0,0 +1,160 @@
+import asyncio
+import json
+import random
+import urllib.parse
+from typing import Any, Dict, Optional
+
+import requests
+
+from .exceptions import *
+from .instaloadercontext import InstaloaderContext
+
+
+class AsyncInstaloaderContext:
+    """
+    Asynchronous counterpart of :class:`InstaloaderContext`, to be used within an :mod:`asyncio` event loop.
+
+    It wraps an :class:`InstaloaderContext`, which holds the session and the login state and which is still used for
+    logging. Its coroutines :meth:`get_json`, :meth:`graphql_query`, :meth:`doc_id_graphql_query`,
+    :meth:`get_iphone_json`, :meth:`get_raw`, :meth:`get_and_write_raw` and :meth:`head` run the HTTP requests in
+    worker threads, so many concurrent queries can share one event loop. The queries are rate controlled by the
+    :class:`QueryScheduler` and the :class:`RateController` of the wrapped context, so they are accounted for
+    together with the queries of the synchronous :attr:`context`, e.g. of the structures. While waiting for the rate
+    limits, a query occupies a thread of the event loop's default executor.
+
+    ::
+
+       L = instaloader.Instaloader()
+       L.load_session_from_file(USER)
+       actx = instaloader.AsyncInstaloaderContext(L.context)
+
+       async def print_posts(userid):
+           posts = instaloader.AsyncNodeIterator(
+               actx, None,
+               lambda d: d['data']['xdt_api__v1__feed__user_timeline_graphql_connection'],
+               lambda n: instaloader.Post.from_iphone_struct(L.context, n),
+               {'data': {'count': 12, 'include_relationship_info': True,
+                         'latest_besties_reel_media': True, 'latest_reel_media': True},
+                'username': USER},
+               doc_id='7898261790222653',
+           )
+           async for post in posts:
+               print(post)
+
+    Note that the structures, such as :class:`Post`, still use the synchronous :attr:`context`.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, context: Optional[InstaloaderContext] = None):
+        self.context = context if context is not None else InstaloaderContext()
+
+    @property
+    def username(self) -> Optional[str]:
+        """Username of the logged-in user, or None."""
+        return self.context.username
+
+    @property
+    def is_logged_in(self) -> bool:
+        """True, if the wrapped context is logged in."""
+        return self.context.is_logged_in
+
+    async def do_sleep(self):
+        """Sleep a short time if sleeping is enabled for the wrapped context. Awaited before each request to
+        instagram.com."""
+        if self.context.sleep:
+            await asyncio.sleep(min(random.expovariate(0.6), 15.0))
+
+    async def get_json(self, path: str, params: Dict[str, Any], host: str = 'www.instagram.com',
+                       session: Optional[requests.Session] = None, _attempt=1,
+                       response_headers: Optional[Dict[str, Any]] = None,
+                       use_post: bool = False, headers: Optional[Dict[str, str]] = None,
+                       cookies: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """Coroutine equivalent of :meth:`InstaloaderContext.get_json`."""
+        # pylint:disable=protected-access
+        query_type = self.context._query_type(path, params, host)
+        cached_response = self.context._get_cached_response(path, params, host, query_type)
+        if cached_response is not None:
+            return cached_response
+        sess = session if session else self.context._session
+        try:
+            await self.do_sleep()
+            if query_type is not None:
+                await asyncio.to_thread(self.context.query_scheduler.wait_before_query, query_type,
+                                        self.context.query_scheduler.priority(query_type))
+            response = await asyncio.to_thread(self.context._get_json_response, path, params, host, sess,
+                                               response_headers, use_post, headers, cookies)
+            self.context._cache_response(path, params, host, query_type, response)
+            return response
+        except (ConnectionException, json.decoder.JSONDecodeError, requests.exceptions.RequestException) as err:
+            error_string = "JSON Query to {}: {}".format(path, err)
+            if _attempt == self.context.max_connection_attempts:
+                if isinstance(err, QueryReturnedNotFoundException):
+                    raise QueryReturnedNotFoundException(error_string) from err
+                else:
+                    raise ConnectionException(error_string) from err
+            self.context.error(error_string + " [retrying]", repeat_at_end=False)
+            if isinstance(err, TooManyRequestsException) and query_type is not None:
+                await asyncio.to_thread(self.context._rate_controller.handle_429, query_type)
+            return await self.get_json(path=path, params=params, host=host, session=sess, _attempt=_attempt + 1,
+                                       response_headers=response_headers, use_post=use_post, headers=headers,
+                                       cookies=cookies)
+
+    async def graphql_query(self, query_hash: str, variables: Dict[str, Any],
+                            referer: Optional[str] = None) -> Dict[str, Any]:
+        """Coroutine equivalent of :meth:`InstaloaderContext.graphql_query`."""
+        # pylint:disable=protected-access
+        headers = {'referer': urllib.parse.quote(referer)} if referer is not None else None
+        variables_json = json.dumps(variables, separators=(',', ':'))
+
+        resp_json = await self.get_json('graphql/query',
+                                        params={'query_hash': query_hash,
+                                                'variables': variables_json},
+                                        session=self.context._get_query_session('graphql'),
+                                        headers=headers)
+        if 'status' not in resp_json:
+            self.context.error("GraphQL response did not contain a \"status\" field.")
+        return resp_json
+
+    async def doc_id_graphql_query(self, doc_id: str, variables: Dict[str, Any],
+                                   referer: Optional[str] = None) -> Dict[str, Any]:
+        """Coroutine equivalent of :meth:`InstaloaderContext.doc_id_graphql_query`."""
+        # pylint:disable=protected-access
+        headers = {'referer': urllib.parse.quote(referer)} if referer is not None else None
+        variables_json = json.dumps(variables, separators=(',', ':'))
+
+        resp_json = await self.get_json('graphql/query',
+                                        params={'variables': variables_json,
+                                                'doc_id': doc_id,
+                                                'server_timestamps': 'true'},
+                                        session=self.context._get_query_session('doc_id'),
+                                        use_post=True,
+                                        headers=headers)
+        if 'status' not in resp_json:
+            self.context.error("GraphQL response did not contain a \"status\" field.")
+        return resp_json
+
+    async def get_iphone_json(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Coroutine equivalent of :meth:`InstaloaderContext.get_iphone_json`."""
+        # pylint:disable=protected-access
+        session, headers, cookies = self.context._iphone_request_arguments()
+        response_headers = dict()    # type: Dict[str, Any]
+        response = await self.get_json(path, params, 'i.instagram.com', session,
+                                       response_headers=response_headers, headers=headers, cookies=cookies)
+        self.context._update_iphone_headers(response_headers)
+        return response
+
+    async def get_raw(self, url: str, offset: int = 0, if_range: Optional[str] = None) -> requests.Response:
+        """Coroutine equivalent of :meth:`InstaloaderContext.get_raw`.
+
+        Note that reading the returned streamed response blocks. Use :meth:`get_and_write_raw` to download into a
+        file without blocking the event loop."""
+        return await asyncio.to_thread(self.context.get_raw, url, offset=offset, if_range=if_range)
+
+    async def get_and_write_raw(self, url: str, filename: str) -> None:
+        """Coroutine equivalent of :meth:`InstaloaderContext.get_and_write_raw`."""
+        await asyncio.to_thread(self.context.get_and_write_raw, url, filename)
+
+    async def head(self, url: str, allow_redirects: bool = False) -> requests.Response:
+        """Coroutine equivalent of :meth:`InstaloaderContext.head`."""
+        return await asyncio.to_thread(self.context.head, url, allow_redirects)
@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import http.client
+import io
+import json
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import requests
+import requests.adapters
+import urllib3  # type: ignore
+from urllib3._collections import HTTPHeaderDict  # type: ignore
+
+from .instaloadercontext import RateController
+
+
+class Cassette(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that records HTTP exchanges into a cassette file, or replays them from it.
+
+    When passed as `transport` to :class:`Instaloader` or :class:`InstaloaderContext`, it is mounted on all sessions,
+    so it covers :meth:`InstaloaderContext.get_json`, :meth:`InstaloaderContext.get_raw` and
+    :meth:`InstaloaderContext.head` and everything built upon them. This allows running the download pipeline
+    without network access, e.g. to reproducibly profile it::
+
+       with instaloader.Instaloader(transport=instaloader.Cassette('profile.cassette', record=True)) as L:
+           L.download_profile('instagram')
+
+       with instaloader.Instaloader(sleep=False, transport=instaloader.Cassette('profile.cassette'),
+                                    rate_controller=instaloader.ReplayRateController) as L:
+           L.download_profile('instagram')
+
+    Requests are matched by method, URL and body. Equal requests are answered with the recorded responses in the
+    recorded order, repeating the last one when they are exhausted. A request that has not been recorded fails with
+    a :class:`requests.exceptions.ConnectionError`.
+
+    The cassette file has one JSON object per exchange and line. Response bodies are stored decoded, i.e. without
+    ``Content-Encoding``. Request bodies are only stored as hash, but responses are stored with their headers, so a
+    cassette recorded while logged in may contain session cookies and should be kept private like a session file.
+
+    :param path: Path of the cassette file.
+    :param record: Whether to do the requests and record them into the cassette file (which is overwritten), rather
+       than replaying them.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, path: str, record: bool = False):
+        super().__init__()
+        self.path = path
+        self.record = record
+        self._lock = threading.Lock()
+        self._exchanges: Dict[Tuple[str, str, Optional[str]], Deque[Dict[str, Any]]] = dict()
+        if record:
+            with open(path, 'w', encoding='utf-8'):
+                pass
+        else:
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        exchange = json.loads(line)
+                        key = (exchange['method'], exchange['url'], exchange['body'])
+                        self._exchanges.setdefault(key, deque()).append(exchange)
+
+    @staticmethod
+    def _request_key(request: requests.PreparedRequest) -> Tuple[str, str, Optional[str]]:
+        body = request.body.encode() if isinstance(request.body, str) else request.body
+        return (str(request.method), str(request.url),
+                hashlib.sha256(body).hexdigest() if body is not None else None)
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout: Any = None,
+             verify: Any = True, cert: Any = None, proxies: Any = None) -> requests.Response:
+        key = self._request_key(request)
+        if self.record:
+            resp = super().send(request, stream=False, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+            headers = [(name, value) for name, value in resp.raw.headers.iteritems()
+                       if name.lower() not in ('content-encoding', 'transfer-encoding', 'content-length')]
+            headers.append(('Content-Length', str(len(resp.content))))
+            exchange = {'method': key[0], 'url': key[1], 'body': key[2],
+                        'status': resp.status_code, 'reason': resp.reason, 'headers': headers,
+                        'content': base64.b64encode(resp.content).decode()}
+            with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(exchange) + '\n')
+        else:
+            with self._lock:
+                exchanges = self._exchanges.get(key)
+                if not exchanges:
+                    raise requests.exceptions.ConnectionError("No recorded response for {} {}.".format(*key[:2]),
+                                                              request=request)
+                exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+        return self._build_recorded_response(request, exchange)
+
+    def _build_recorded_response(self, request: requests.PreparedRequest,
+                                 exchange: Dict[str, Any]) -> requests.Response:
+        # Let http.client parse the recorded response, as if it was received, so that urllib3 and requests (e.g. for
+        # extracting cookies) treat it like a real response.
+        head = 'HTTP/1.1 {} {}\r\n'.format(exchange['status'], exchange['reason'])
+        head += ''.join('{}: {}\r\n'.format(name, value) for name, value in exchange['headers']) + '\r\n'
+        original = http.client.HTTPResponse(_RecordedSocket(head.encode('latin-1') +  # type: ignore
+                                                            base64.b64decode(exchange['content'])),
+                                            method=request.method)
+        original.begin()
+        raw = urllib3.HTTPResponse(body=original, headers=HTTPHeaderDict(original.msg.items()),
+                                   status=original.status, reason=original.reason, preload_content=False,
+                                   decode_content=False, original_response=original)
+        return self.build_response(request, raw)
+
+
+class _RecordedSocket:  # pylint:disable=too-few-public-methods
+    # Socket-like object that http.client.HTTPResponse reads a recorded response from.
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def makefile(self, _mode: str) -> io.BytesIO:
+        return io.BytesIO(self._data)
+
+
+class ReplayRateController(RateController):
+    """
+    :class:`RateController` that never waits, for replaying a :class:`Cassette`.
+
+    .. versionadded:: 4.15
+    """
+
+    def sleep(self, secs: float):
+        pass
+
+    def query_waittime(self, query_type: str, current_time: float, untracked_queries: bool = False) -> float:
+        return 0.0
@@ -1,4 +1,5 @@
 import getpass
+import glob
 import json
 import os
 import platform
@@ -7,24 +8,34 @@ import shutil
 import string
 import sys
 import tempfile
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager, suppress
 from datetime import datetime, timezone
 from functools import wraps
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Callable, IO, Iterator, List, Optional, Set, Union, cast
+from typing import Any, Callable, Deque, IO, Iterator, List, Optional, Set, Tuple, Union, cast
 from urllib.parse import urlparse
 
 import requests
+import requests.adapters
 import urllib3  # type: ignore
 
+from . import jsoncodec
 from .exceptions import *
 from .instaloadercontext import InstaloaderContext, RateController
 from .lateststamps import LatestStamps
+from .metadatacache import MetadataCache
 from .nodeiterator import NodeIterator, resumable_iteration
+from .pagelengths import PageLengths
 from .sectioniterator import SectionIterator
 from .structures import (Hashtag, Highlight, JsonExportable, Post, PostLocation, Profile, Story, StoryItem,
-                         load_structure_from_file, save_structure_to_file, PostSidecarNode, TitlePic)
+                         load_structure_from_file, save_structure_to_file, PostSidecarNode, TitlePic,
+                         _FEED_QUERY_HASH, _REELS_TRAY_QUERY_HASH, _STORIES_QUERY_HASH, _USER_REEL_QUERY_HASH)
 
 
 def _get_config_dir() -> str:
@@ -64,6 +75,39 @@ def get_default_stamps_filename() -> str:
     return os.path.join(configdir, "latest-stamps.ini")
 
 
+def get_default_rate_limits_filename() -> str:
+    """
+    Returns default filename for the database of :class:`SharedRateController`.
+
+    .. versionadded:: 4.15
+
+    """
+    configdir = _get_config_dir()
+    return os.path.join(configdir, "rate-limits.sqlite3")
+
+
+def get_default_rate_controller_state_filename() -> str:
+    """
+    Returns default filename for the state file of :class:`PersistentRateController`.
+
+    .. versionadded:: 4.15
+
+    """
+    configdir = _get_config_dir()
+    return os.path.join(configdir, "rate-controller-state.json")
+
+
+def get_default_page_lengths_filename() -> str:
+    """
+    Returns default filename for the page lengths learned by :class:`PageLengths`.
+
+    .. versionadded:: 4.15
+
+    """
+    configdir = _get_config_dir()
+    return os.path.join(configdir, "page-lengths.json")
+
+
 def format_string_contains_key(format_string: str, key: str) -> bool:
     # pylint:disable=unused-variable
     for literal_text, field_name, format_spec, conversion in string.Formatter().parse(format_string):
@@ -172,6 +216,188 @@ class _PostPathFormatter(_ArbitraryItemFormatter):
         return ret
 
 
+class _PendingPost:
+    """Media download jobs and buffered log output of a post within :meth:`Instaloader.posts_download_loop`."""
+
+    def __init__(self, label: str, executor: Optional[Union[ThreadPoolExecutor, '_DeferredExecutor']]):
+        self.label = label
+        self.executor = executor
+        self.log_buffer: List[Union[str, List[str]]] = []
+        self.jobs: List[Future] = []
+        # result of Instaloader.download_post(), not yet taking the jobs into account
+        self.downloaded: Optional[bool] = None
+        # whether the loop should stop if nothing was downloaded for this post (--fast-update)
+        self.stop_if_not_downloaded = False
+
+    def submit(self, context: InstaloaderContext, job: Callable[[], bool]) -> bool:
+        assert self.executor is not None
+        job_log: List[str] = []
+        self.log_buffer.append(job_log)
+
+        def run() -> bool:
+            # pylint:disable=protected-access
+            with context._capture_log(job_log):
+                return job()
+
+        self.jobs.append(self.executor.submit(run))
+        return True
+
+    def done(self) -> bool:
+        return all(job.done() for job in self.jobs)
+
+    def result(self) -> Optional[bool]:
+        """Result of :meth:`Instaloader.download_post` taking the jobs into account, which must be done. None if
+        unknown, e.g. as a job failed."""
+        downloaded = self.downloaded
+        for job in self.jobs:
+            job_downloaded = None if job.cancelled() or job.exception() is not None else job.result()
+            if downloaded is not None:
+                downloaded = None if job_downloaded is None else downloaded and job_downloaded
+        return downloaded
+
+    def output(self) -> str:
+        return ''.join(entry if isinstance(entry, str) else ''.join(entry) for entry in self.log_buffer)
+
+
+class _DeferredExecutor:
+    """Executor that runs the submitted jobs in the calling thread, only when asked to, with :meth:`run_next` or
+    :meth:`complete`. Used to defer media downloads until the rate controller lets the metadata queries wait."""
+
+    def __init__(self) -> None:
+        self._jobs: Deque[Tuple[Future, Callable[[], Any]]] = deque()
+
+    def submit(self, job: Callable[[], Any]) -> Future:
+        future: Future = Future()
+        self._jobs.append((future, job))
+        return future
+
+    def run_next(self) -> bool:
+        """Run the job that was submitted first, if any. Returns whether there was one."""
+        if not self._jobs:
+            return False
+        future, job = self._jobs.popleft()
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(job())
+            except BaseException as err:  # pylint:disable=broad-exception-caught
+                # the job's errors are raised by the future, except for e.g. KeyboardInterrupt
+                future.set_exception(err)
+                if not isinstance(err, Exception):
+                    raise
+        return True
+
+    def complete(self, jobs: List[Future]) -> None:
+        """Run the submitted jobs until the given ones are done."""
+        while not all(job.done() for job in jobs) and self.run_next():
+            pass
+
+    def shutdown(self) -> None:
+        while self.run_next():
+            pass
+
+
+class _PostDownloadQueue:
+    """Posts of :meth:`Instaloader.posts_download_loop` whose media files are still being downloaded.
+
+    With an executor, :meth:`Instaloader.download_pic` submits the downloads of the post that is currently processed
+    (see `current_post`) to the worker threads, while the loop continues with obtaining the metadata of the next
+    posts. The log output of each post, including the output of its download jobs, is buffered and printed in order
+    once all of its jobs are done. At most `backlog` posts are kept pending. Without an executor, posts are finished
+    right away.
+
+    With a :class:`_DeferredExecutor`, the downloads are done by the loop's thread, either when the rate controller
+    lets it wait (see :meth:`drain`) or when the post leaves the backlog."""
+
+    def __init__(self, context: InstaloaderContext, executor: Optional[Union[ThreadPoolExecutor, _DeferredExecutor]],
+                 backlog: int, current_post: threading.local):
+        self._context = context
+        self._executor = executor
+        self._backlog = backlog
+        self._current_post = current_post
+        self._queue: Deque[_PendingPost] = deque()
+        # thread of the loop, which the deferred downloads are done in
+        self._thread = threading.get_ident()
+        # Set when a finished post indicates that the loop should stop (--fast-update)
+        self._stop = False
+
+    @property
+    def stop(self) -> bool:
+        """Whether the loop should stop, as a post has not been downloaded (--fast-update). Posts are checked as soon
+        as their downloads are done, rather than when their output is printed, so that the loop does not go on with
+        the next posts while an earlier one waits for its downloads."""
+        if not self._stop:
+            self._stop = any(pending.stop_if_not_downloaded and pending.done() and pending.result() is False
+                             for pending in self._queue)
+        return self._stop
+
+    @contextmanager
+    def post(self, label: str) -> Iterator[_PendingPost]:
+        """Context for processing a post. Downloads started therein belong to this post."""
+        pending = _PendingPost(label, self._executor)
+        try:
+            if self._executor is None:
+                yield pending
+            else:
+                self._current_post.post = pending
+                try:
+                    # pylint:disable=protected-access
+                    with self._context._capture_log(pending.log_buffer):
+                        yield pending
+                finally:
+                    self._current_post.post = None
+        finally:
+            self._queue.append(pending)
+        if pending.stop_if_not_downloaded and isinstance(self._executor, _DeferredExecutor):
+            # --fast-update needs to know right away whether the post has been downloaded
+            self._run_deferred(lambda executor: executor.complete(pending.jobs))
+        if pending.downloaded is False and not pending.jobs and pending.stop_if_not_downloaded:
+            # No need to wait for the previous posts, the loop stops here at the latest
+            self._stop = True
+        self._finish(wait=False)
+
+    def finish(self) -> None:
+        """Wait for all downloads to finish."""
+        self._finish(wait=True)
+
+    def drain(self, seconds: float) -> None:
+        """Do deferred downloads for about the given time. Used as :attr:`InstaloaderContext.wait_hook`."""
+        if threading.get_ident() != self._thread:
+            # waiting in another thread, e.g. of another loop
+            return
+        deadline = time.monotonic() + seconds
+
+        def run(executor: _DeferredExecutor) -> None:
+            while time.monotonic() < deadline and executor.run_next():
+                pass
+
+        self._run_deferred(run)
+
+    def _run_deferred(self, run: Callable[[_DeferredExecutor], None]) -> None:
+        assert isinstance(self._executor, _DeferredExecutor)
+        # the jobs call download_pic(), which must not defer them again
+        current_post = getattr(self._current_post, 'post', None)
+        self._current_post.post = None
+        try:
+            run(self._executor)
+        finally:
+            self._current_post.post = current_post
+
+    def _finish(self, wait: bool) -> None:
+        while self._queue and (wait or len(self._queue) > self._backlog or self._queue[0].done()):
+            pending = self._queue.popleft()
+            if isinstance(self._executor, _DeferredExecutor):
+                self._run_deferred(lambda executor: executor.complete(pending.jobs))
+            futures.wait(pending.jobs)
+            output = pending.output()
+            if output:
+                self._context.log(output, end='', flush=True)
+            for job in pending.jobs:
+                with self._context.error_catcher(pending.label):
+                    job.result()
+            if pending.result() is False and pending.stop_if_not_downloaded:
+                self._stop = True
+
+
 class Instaloader:
     """Instaloader Class.
 
@@ -202,6 +428,24 @@ class Instaloader:
     :param fatal_status_codes: :option:`--abort-on`
     :param iphone_support: not :option:`--no-iphone`
     :param sanitize_paths: :option:`--sanitize-paths`
+    :param media_pool_size: Number of connections kept open for downloading media files from the CDN.
+    :param media_keep_alive: Whether to keep connections for downloading media files alive between requests.
+    :param download_workers: :option:`--download-workers`
+    :param metadata_cache: :option:`--metadata-cache`
+    :param transport: Transport adapter to mount on all sessions, such as a :class:`Cassette`
+       (:option:`--record-cassette`, :option:`--replay-cassette`).
+    :param media_buffer_size: Size in bytes of the buffer that media files are downloaded in chunks of.
+    :param download_backlog: :option:`--download-backlog`
+    :param prefetch_pages: :option:`--prefetch-pages`
+    :param checkpoint_every: :option:`--checkpoint-every`
+    :param checkpoint_interval: :option:`--checkpoint-interval`
+    :param page_lengths: :option:`--adaptive-page-length`
+    :param target_workers: :option:`--target-workers`
+
+    .. versionchanged:: 4.15
+       Added `media_pool_size`, `media_keep_alive`, `download_workers`, `metadata_cache`, `transport`,
+       `media_buffer_size`, `download_backlog`, `prefetch_pages`, `checkpoint_every`, `checkpoint_interval`,
+       `page_lengths` and `target_workers`.
 
     .. attribute:: context
 
@@ -232,11 +476,28 @@ class Instaloader:
                  fatal_status_codes: Optional[List[int]] = None,
                  iphone_support: bool = True,
                  title_pattern: Optional[str] = None,
-                 sanitize_paths: bool = False):
-
+                 sanitize_paths: bool = False,
+                 media_pool_size: int = 10,
+                 media_keep_alive: bool = True,
+                 download_workers: int = 1,
+                 metadata_cache: Optional[str] = None,
+                 transport: Optional[requests.adapters.BaseAdapter] = None,
+                 media_buffer_size: int = 1024 * 1024,
+                 download_backlog: int = 0,
+                 prefetch_pages: bool = False,
+                 checkpoint_every: Optional[int] = None,
+                 checkpoint_interval: Optional[float] = None,
+                 page_lengths: Optional[str] = None,
+                 target_workers: int = 1):
+
+        self.metadata_cache = metadata_cache
+        self.page_lengths = page_lengths
         self.context = InstaloaderContext(sleep, quiet, user_agent, max_connection_attempts,
                                           request_timeout, rate_controller, fatal_status_codes,
-                                          iphone_support)
+                                          iphone_support, media_pool_size, media_keep_alive,
+                                          MetadataCache(metadata_cache) if metadata_cache is not None else None,
+                                          transport, media_buffer_size, prefetch_pages,
+                                          PageLengths(page_lengths) if page_lengths is not None else None)
 
         # configuration parameters
         self.dirname_pattern = dirname_pattern or "{target}"
@@ -263,6 +524,27 @@ class Instaloader:
             else storyitem_metadata_txt_pattern
         self.resume_prefix = resume_prefix
         self.check_resume_bbd = check_resume_bbd
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+
+        self.download_workers = download_workers
+        self.download_backlog = download_backlog
+        self._download_executor: Optional[ThreadPoolExecutor] = None
+        if download_workers > 1:
+            self._download_executor = ThreadPoolExecutor(max_workers=download_workers,
+                                                         thread_name_prefix='instaloader-download')
+        elif download_backlog > 0:
+            # the deferred downloads of each posts_download_loop() are done by its own thread when it has to wait
+            self.context.wait_hook = self._drain_deferred_downloads
+        # post of posts_download_loop() that download_pic() submits its downloads for, per thread
+        self._current_post = threading.local()
+        # _PostDownloadQueue of the posts_download_loop() running in the current thread
+        self._loop_downloads = threading.local()
+
+        self.target_workers = target_workers
+        # set to stop the posts_download_loop()s of all targets downloaded concurrently by download_profiles(), and
+        # to interrupt their waiting for the rate limits
+        self._abort_targets = self.context._abort_waiting  # pylint:disable=protected-access
 
         self.slide = slide or ""
         self.slide_start = 0
@@ -314,7 +596,19 @@ class Instaloader:
             slide=self.slide,
             fatal_status_codes=self.context.fatal_status_codes,
             iphone_support=self.context.iphone_support,
-            sanitize_paths=self.sanitize_paths)
+            sanitize_paths=self.sanitize_paths,
+            media_pool_size=self.context.media_pool_size,
+            media_keep_alive=self.context.media_keep_alive,
+            download_workers=self.download_workers,
+            metadata_cache=self.metadata_cache,
+            transport=self.context.transport,
+            media_buffer_size=self.context.media_buffer_size,
+            download_backlog=self.download_backlog,
+            prefetch_pages=self.context.prefetch_pages,
+            checkpoint_every=self.checkpoint_every,
+            checkpoint_interval=self.checkpoint_interval,
+            page_lengths=self.page_lengths,
+            target_workers=self.target_workers)
         yield new_loader
         self.context.error_log.extend(new_loader.context.error_log)
         new_loader.context.error_log = []  # avoid double-printing of errors
@@ -322,6 +616,8 @@ class Instaloader:
 
     def close(self):
         """Close associated session objects and repeat error log."""
+        if self._download_executor is not None:
+            self._download_executor.shutdown()
         self.context.close()
 
     def __enter__(self):
@@ -334,7 +630,14 @@ class Instaloader:
     def download_pic(self, filename: str, url: str, mtime: datetime,
                      filename_suffix: Optional[str] = None, _attempt: int = 1) -> bool:
         """Downloads and saves picture with given url under given directory with given timestamp.
-        Returns true, if file was actually downloaded, i.e. updated."""
+        Returns true, if file was actually downloaded, i.e. updated.
+
+        Within :meth:`posts_download_loop` with :option:`--download-workers` greater than 1, the download is done
+        by a worker thread and true is returned right away. Likewise with :option:`--download-backlog`, where the
+        download is deferred.
+
+        .. versionchanged:: 4.15
+           Resume an interrupted download from its temporary file."""
         if filename_suffix is not None:
             filename += '_' + filename_suffix
         urlmatch = re.search('\\.[a-z0-9]*\\?', url)
@@ -343,7 +646,15 @@ class Instaloader:
         if os.path.isfile(nominal_filename):
             self.context.log(nominal_filename + ' exists', end=' ', flush=True)
             return False
-        resp = self.context.get_raw(url)
+        pending_post = getattr(self._current_post, 'post', None)
+        if pending_post is not None:
+            return pending_post.submit(self.context, lambda: self.download_pic(filename, url, mtime))
+        partial_filename = self._partial_download(filename, nominal_filename)
+        if partial_filename is not None:
+            resp = self.context.get_raw(url, offset=os.path.getsize(partial_filename),
+                                        if_range=self.context.temp_validator(partial_filename))
+        else:
+            resp = self.context.get_raw(url)
         if 'Content-Type' in resp.headers and resp.headers['Content-Type']:
             header_extension = '.' + resp.headers['Content-Type'].split(';')[0].split('/')[-1]
             header_extension = header_extension.lower().replace('jpeg', 'jpg')
@@ -352,11 +663,25 @@ class Instaloader:
             filename = nominal_filename
         if filename != nominal_filename and os.path.isfile(filename):
             self.context.log(filename + ' exists', end=' ', flush=True)
+            resp.close()
             return False
+        if resp.status_code == 206 and partial_filename != filename + '.temp':
+            # the partial file belongs to a different file extension
+            resp.close()
+            resp = self.context.get_raw(url)
         self.context.write_raw(resp, filename)
         os.utime(filename, (datetime.now().timestamp(), mtime.timestamp()))
         return True
 
+    @staticmethod
+    def _partial_download(filename: str, nominal_filename: str) -> Optional[str]:
+        """Returns the temporary file of an interrupted download of given file, if any."""
+        candidates = [nominal_filename + '.temp'] + sorted(glob.glob(glob.escape(filename) + '.*.temp'))
+        for candidate in candidates:
+            if os.path.isfile(candidate) and os.path.getsize(candidate) > 0:
+                return candidate
+        return None
+
     def save_metadata_json(self, filename: str, structure: JsonExportable) -> None:
         """Saves metadata JSON file of a structure."""
         if self.compress_json:
@@ -417,8 +742,8 @@ class Instaloader:
         base_filename = filename
         filename += '_comments.json'
         try:
-            with open(filename) as fp:
-                comments = json.load(fp)
+            with open(filename, 'rb') as fp:
+                comments = jsoncodec.loads(fp.read())
         except (FileNotFoundError, json.decoder.JSONDecodeError):
             comments = list()
 
@@ -543,6 +868,7 @@ class Instaloader:
                                          (content_length is not None and
                                           os.path.getsize(filename) >= int(content_length))):
             self.context.log(filename + ' already exists')
+            http_response.close()
             return
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         self.context.write_raw(pic_bytes if pic_bytes else http_response, filename)
@@ -803,7 +1129,7 @@ class Instaloader:
         """
 
         if not userids:
-            data = self.context.graphql_query("d15efd8c0c5b23f0ef71f18bf363c704",
+            data = self.context.graphql_query(_REELS_TRAY_QUERY_HASH,
                                               {"only_stories": True})["data"]["user"]
             if data is None:
                 raise BadResponseException('Bad stories reel JSON.')
@@ -816,7 +1142,7 @@ class Instaloader:
                 yield userids[i:i + userids_per_query]
 
         for userid_chunk in _userid_chunks():
-            stories = self.context.graphql_query("303a4ae99711322310f25250d988f3b7",
+            stories = self.context.graphql_query(_STORIES_QUERY_HASH,
                                                  {"reel_ids": userid_chunk, "precomposed_overlay": False})["data"]
             yield from (Story(self.context, media) for media in stories['reels_media'])
 
@@ -935,7 +1261,7 @@ class Instaloader:
         """
 
         userid = user if isinstance(user, int) else user.userid
-        data = self.context.graphql_query("7c16654f22c819fb63d1183034a5162f",
+        data = self.context.graphql_query(_USER_REEL_QUERY_HASH,
                                           {"user_id": userid, "include_chaining": False, "include_reel": False,
                                            "include_suggested_users": False, "include_logged_out_extras": False,
                                            "include_highlight_reels": True})["data"]["user"]['edge_highlight_reels']
@@ -1013,6 +1339,9 @@ class Instaloader:
         .. versionchanged:: 4.10.3
            Add `possibly_pinned` parameter.
 
+        .. versionchanged:: 4.15
+           Download media files with :option:`--download-workers` threads, while already obtaining the next posts.
+
         :param posts: Post Iterator to loop through.
         :param target: Target name.
         :param fast_update: :option:`--fast-update`.
@@ -1031,6 +1360,11 @@ class Instaloader:
             sanitized_target = _PostPathFormatter.sanitize_path(target, self.sanitize_paths)
         if takewhile is None:
             takewhile = lambda _: True
+
+        def complete_downloads():
+            # the resume information must not cover posts that are not downloaded yet
+            downloads.finish()
+
         with resumable_iteration(
                 context=self.context,
                 iterator=posts,
@@ -1040,48 +1374,79 @@ class Instaloader:
                     sanitized_target, owner_profile, self.resume_prefix or '', magic, 'json.xz'
                 ),
                 check_bbd=self.check_resume_bbd,
-                enabled=self.resume_prefix is not None
-        ) as (is_resuming, start_index):
+                enabled=self.resume_prefix is not None,
+                checkpoint_every=self.checkpoint_every,
+                checkpoint_interval=self.checkpoint_interval,
+                before_checkpoint=complete_downloads
+        ) as (is_resuming, start_index), self._post_download_queue() as downloads:
             for number, post in enumerate(posts, start=start_index + 1):
+                if downloads.stop:
+                    break
+                if self._abort_targets.is_set():
+                    raise AbortDownloadException("Interrupted while downloading other targets")
                 should_stop = not takewhile(post)
                 if should_stop and number <= possibly_pinned:
                     continue
                 if (max_count is not None and number > max_count) or should_stop:
                     break
-                if displayed_count is not None:
-                    self.context.log("[{0:{w}d}/{1:{w}d}] ".format(number, displayed_count,
-                                                                   w=len(str(displayed_count))),
-                                     end="", flush=True)
-                else:
-                    self.context.log("[{:3d}] ".format(number), end="", flush=True)
-                if post_filter is not None:
-                    try:
-                        if not post_filter(post):
-                            self.context.log("{} skipped".format(post))
-                            continue
-                    except (InstaloaderException, KeyError, TypeError) as err:
-                        self.context.error("{} skipped. Filter evaluation failed: {}".format(post, err))
-                        continue
-                with self.context.error_catcher("Download {} of {}".format(post, target)):
-                    # The PostChangedException gets raised if the Post's id/shortcode changed while obtaining
-                    # additional metadata. This is most likely the case if a HTTP redirect takes place while
-                    # resolving the shortcode URL.
-                    # The `post_changed` variable keeps the fast-update functionality alive: A Post which is
-                    # obained after a redirect has probably already been downloaded as a previous Post of the
-                    # same Profile.
-                    # Observed in issue #225: https://github.com/instaloader/instaloader/issues/225
-                    post_changed = False
-                    while True:
+                with downloads.post("Download {} of {}".format(post, target)) as pending:
+                    if displayed_count is not None:
+                        self.context.log("[{0:{w}d}/{1:{w}d}] ".format(number, displayed_count,
+                                                                       w=len(str(displayed_count))),
+                                         end="", flush=True)
+                    else:
+                        self.context.log("[{:3d}] ".format(number), end="", flush=True)
+                    if post_filter is not None:
                         try:
-                            downloaded = self.download_post(post, target=target)
-                            break
-                        except PostChangedException:
-                            post_changed = True
+                            if not post_filter(post):
+                                self.context.log("{} skipped".format(post))
+                                continue
+                        except (InstaloaderException, KeyError, TypeError) as err:
+                            self.context.error("{} skipped. Filter evaluation failed: {}".format(post, err))
                             continue
-                    if fast_update and not downloaded and not post_changed and number > possibly_pinned:
+                    with self.context.error_catcher(pending.label):
+                        # The PostChangedException gets raised if the Post's id/shortcode changed while obtaining
+                        # additional metadata. This is most likely the case if a HTTP redirect takes place while
+                        # resolving the shortcode URL.
+                        # The `post_changed` variable keeps the fast-update functionality alive: A Post which is
+                        # obained after a redirect has probably already been downloaded as a previous Post of the
+                        # same Profile.
+                        # Observed in issue #225: https://github.com/instaloader/instaloader/issues/225
+                        post_changed = False
+                        while True:
+                            try:
+                                pending.downloaded = self.download_post(post, target=target)
+                                break
+                            except PostChangedException:
+                                post_changed = True
+                                continue
                         # disengage fast_update for first post when resuming
-                        if not is_resuming or number > 0:
-                            break
+                        pending.stop_if_not_downloaded = (fast_update and not post_changed and
+                                                          number > possibly_pinned and
+                                                          (not is_resuming or number > 0))
+                if downloads.stop:
+                    break
+
+    @contextmanager
+    def _post_download_queue(self) -> Iterator[_PostDownloadQueue]:
+        executor: Optional[Union[ThreadPoolExecutor, _DeferredExecutor]] = self._download_executor
+        if executor is None and self.download_backlog > 0:
+            executor = _DeferredExecutor()
+        downloads = _PostDownloadQueue(self.context, executor,
+                                       max(2 * self.download_workers, self.download_backlog), self._current_post)
+        outer_downloads = getattr(self._loop_downloads, 'queue', None)
+        self._loop_downloads.queue = downloads
+        try:
+            yield downloads
+        finally:
+            self._loop_downloads.queue = outer_downloads
+            downloads.finish()
+
+    def _drain_deferred_downloads(self, seconds: float) -> None:
+        # InstaloaderContext.wait_hook with --download-backlog
+        downloads = getattr(self._loop_downloads, 'queue', None)
+        if downloads is not None:
+            downloads.drain(seconds)
 
     @_requires_login
     def get_feed_posts(self) -> Iterator[Post]:
@@ -1091,7 +1456,7 @@ class Instaloader:
         :raises LoginRequiredException: If called without being logged in.
         """
 
-        data = self.context.graphql_query("d6f4427fbe92d846298cf93df0b937d3", {})["data"]
+        data = self.context.graphql_query(_FEED_QUERY_HASH, {})["data"]
 
         while True:
             feed = data["user"]["edge_web_feed_timeline"]
@@ -1101,7 +1466,7 @@ class Instaloader:
                     yield Post(self.context, node)
             if not feed["page_info"]["has_next_page"]:
                 break
-            data = self.context.graphql_query("d6f4427fbe92d846298cf93df0b937d3",
+            data = self.context.graphql_query(_FEED_QUERY_HASH,
                                               {'fetch_media_item_count': 12,
                                                'fetch_media_item_cursor': feed["page_info"]["end_cursor"],
                                                'fetch_comment_count': 4,
@@ -1147,18 +1512,22 @@ class Instaloader:
                                  max_count=max_count, total_count=node_iterator.count)
 
     @_requires_login
-    def get_location_posts(self, location: str) -> Iterator[Post]:
+    def get_location_posts(self, location: str) -> SectionIterator[Post]:
         """Get Posts which are listed by Instagram for a given Location.
 
         :return:  Iterator over Posts of a location's posts
+        :rtype: SectionIterator[Post]
         :raises LoginRequiredException: If called without being logged in.
 
         .. versionadded:: 4.2
 
         .. versionchanged:: 4.2.9
            Require being logged in (as required by Instagram)
+
+        .. versionchanged:: 4.15
+           Return a resumable :class:`SectionIterator`, which queries the first page right away.
         """
-        yield from SectionIterator(
+        return SectionIterator(
             self.context,
             lambda d: d["native_location_data"]["recent"],
             lambda m: Post.from_iphone_struct(self.context, m),
@@ -1471,6 +1840,9 @@ class Instaloader:
 
         .. versionchanged:: 4.14
            Add `reels` parameter.
+
+        .. versionchanged:: 4.15
+           Download several profiles concurrently with :option:`--target-workers`.
         """
 
         @contextmanager
@@ -1480,7 +1852,7 @@ class Instaloader:
         # error_handler type is Callable[[Optional[str]], ContextManager[None]] (not supported with Python 3.5.0..3.5.3)
         error_handler = _error_raiser if raise_errors else self.context.error_catcher
 
-        for i, profile in enumerate(profiles, start=1):
+        def download_profile(i: int, profile: Profile) -> None:
             self.context.log("[{0:{w}d}/{1:{w}d}] Downloading profile {2}".format(i, len(profiles), profile.username,
                                                                                   w=len(str(len(profiles)))))
             with error_handler(profile.username):  # type: ignore # (ignore type for Python 3.5 support)
@@ -1532,13 +1904,19 @@ class Instaloader:
                         self.download_highlights(profile, fast_update=fast_update, storyitem_filter=storyitem_filter)
 
                 # Iterate over pictures and download them
-                if posts:
+                if posts and latest_stamps is not None and self._posts_unchanged(profile, latest_stamps):
+                    self.context.log("No new posts of profile {}.".format(profile_name))
+                elif posts:
                     self.context.log("Retrieving posts from profile {}.".format(profile_name))
                     posts_takewhile: Optional[Callable[[Post], bool]] = None
                     if latest_stamps is not None:
-                        # pylint:disable=cell-var-from-loop
+                        last_post_id = latest_stamps.get_last_post_id(profile_name)
                         last_scraped = latest_stamps.get_last_post_timestamp(profile_name)
-                        posts_takewhile = lambda p: p.date_local > last_scraped
+                        if last_post_id is not None:
+                            # media IDs increase with the time of posting
+                            posts_takewhile = lambda p: p.mediaid > last_post_id
+                        else:
+                            posts_takewhile = lambda p: p.date_local > last_scraped
                     posts_to_download = profile.get_posts()
                     self.posts_download_loop(posts_to_download, profile_name, fast_update, post_filter,
                                              total_count=profile.mediacount, owner_profile=profile,
@@ -1546,6 +1924,15 @@ class Instaloader:
                     if latest_stamps is not None and posts_to_download.first_item is not None:
                         latest_stamps.set_last_post_timestamp(profile_name,
                                                               posts_to_download.first_item.date_local)
+                        latest_stamps.set_last_post(profile_name, posts_to_download.first_item.mediaid,
+                                                    profile.mediacount)
+
+        targets = list(enumerate(profiles, start=1))
+        if self.target_workers > 1 and len(targets) > 1:
+            self._download_targets_concurrently(targets, download_profile)
+        else:
+            for i, profile in targets:
+                download_profile(i, profile)
 
         if stories and profiles:
             with self.context.error_catcher("Download stories"):
@@ -1553,6 +1940,43 @@ class Instaloader:
                 self.download_stories(userids=list(profiles), fast_update=fast_update, filename_target=None,
                                       storyitem_filter=storyitem_filter, latest_stamps=latest_stamps)
 
+    @staticmethod
+    def _posts_unchanged(profile: Profile, latest_stamps: LatestStamps) -> bool:
+        """Whether the posts of the profile are the same as at its last download, i.e. the number of posts and the
+        newest of the posts that come with the profile metadata match the stored ones. This needs no query."""
+        last_post_id = latest_stamps.get_last_post_id(profile.username)
+        if last_post_id is None or latest_stamps.get_last_post_mediacount(profile.username) != profile.mediacount:
+            return False
+        first_post_ids = profile._first_post_ids()  # pylint:disable=protected-access
+        return first_post_ids is not None and max(first_post_ids) == last_post_id
+
+    def _download_targets_concurrently(self, targets: List[Tuple[int, Profile]],
+                                       download: Callable[[int, Profile], None]) -> None:
+        """Calls ``download(i, profile)`` for the given targets in up to `target_workers` threads at once. Their
+        queries are ordered by the :class:`QueryScheduler`, so a target whose query type has budget goes ahead while
+        another one waits for the rate limits. Each line of output, including errors, is printed as soon as it is
+        complete, prefixed with the username of its target.
+
+        If interrupted, e.g. with Ctrl+C, the remaining targets are not started, and the running ones abort before
+        their next post or while waiting for the rate limits, saving their resume information."""
+        print_lock = threading.Lock()
+
+        def run(i: int, profile: Profile) -> None:
+            # pylint:disable=protected-access
+            with self.context._tag_output('[{}] '.format(profile.username), print_lock):
+                download(i, profile)
+
+        executor = ThreadPoolExecutor(max_workers=self.target_workers, thread_name_prefix='instaloader-target')
+        try:
+            for job in futures.as_completed([executor.submit(run, i, profile) for i, profile in targets]):
+                job.result()
+        except BaseException:
+            self._abort_targets.set()
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+            self._abort_targets.clear()
+
     def download_profile(self, profile_name: Union[str, Profile],
                          profile_pic: bool = True, profile_pic_only: bool = False,
                          fast_update: bool = False,
@@ -1,22 +1,37 @@
+import bisect
+import itertools
 import json
 import os
 import pickle
 import random
-import shutil
+import re
 import sys
 import textwrap
+import threading
 import time
 import urllib.parse
 import uuid
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager, suppress
 from datetime import datetime, timedelta
+from enum import IntEnum
 from functools import partial
-from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+from http.cookiejar import DefaultCookiePolicy
+from typing import IO, TYPE_CHECKING, Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import requests
+import requests.adapters
+import requests.cookies
+import requests.structures
 import requests.utils
 
+from . import jsoncodec
 from .exceptions import *
+from .metadatacache import MetadataCache
+
+if TYPE_CHECKING:
+    from .pagelengths import PageLengths
 
 
 def copy_session(session: requests.Session, request_timeout: Optional[float] = None) -> requests.Session:
@@ -63,6 +78,31 @@ def default_iphone_headers() -> Dict[str, Any]:
             'x-whatsapp': '0'}
 
 
+class _TaggedOutput:
+    """Output of a thread within :meth:`InstaloaderContext._tag_output`. Each complete line is printed right away,
+    prefixed with the tag, so that the output of concurrent threads can be interleaved."""
+
+    def __init__(self, tag: str, lock: threading.Lock):
+        self.tag = tag
+        self._lock = lock
+        # incomplete last line of stdout and stderr
+        self._partial = ['', '']
+
+    def append(self, text: str, error: bool = False) -> None:
+        lines = (self._partial[error] + text).split('\n')
+        self._partial[error] = lines.pop()
+        if lines:
+            with self._lock:
+                print(''.join(self.tag + line + '\n' for line in lines), end='',
+                      file=sys.stderr if error else sys.stdout, flush=True)
+
+    def flush(self) -> None:
+        """Print the incomplete last lines."""
+        for error in [False, True]:
+            if self._partial[error]:
+                self.append('\n', error)
+
+
 class InstaloaderContext:
     """Class providing methods for (error) logging and low-level communication with Instagram.
 
@@ -76,17 +116,69 @@ class InstaloaderContext:
 
     Further, it provides methods for logging in and general session handles, which are used by that routines in
     class :class:`Instaloader`.
+
+    .. attribute:: transport
+
+       Transport adapter mounted on all sessions, such as a :class:`Cassette`, or None to use the default adapter of
+       :mod:`requests`. Set it when constructing the context, as it is mounted when sessions are created.
+
+       .. versionadded:: 4.15
+
+    .. attribute:: download_stats_hook
+
+       Callable that is called by :meth:`write_raw` with the filename, the number of bytes written and the seconds
+       taken after each successfully written file, or None.
+
+       .. versionadded:: 4.15
+
+    .. attribute:: prefetch_pages
+
+       Whether a :class:`NodeIterator` queries its next page in a background thread as soon as it hands out the
+       first item of the current page, if the rate controller allows that query without waiting.
+
+       .. versionadded:: 4.15
+
+    .. attribute:: metadata_cache
+
+       The :class:`MetadataCache` that :meth:`get_json` responses are cached in, or None. It is closed with
+       :meth:`close`.
+
+       .. versionadded:: 4.15
+
+    .. attribute:: page_lengths
+
+       The :class:`PageLengths` that a :class:`NodeIterator` adapts the length of its pages with, or None to always
+       query pages of 12 items. It is closed with :meth:`close`.
+
+       .. versionadded:: 4.15
     """
 
     def __init__(self, sleep: bool = True, quiet: bool = False, user_agent: Optional[str] = None,
                  max_connection_attempts: int = 3, request_timeout: float = 300.0,
                  rate_controller: Optional[Callable[["InstaloaderContext"], "RateController"]] = None,
                  fatal_status_codes: Optional[List[int]] = None,
-                 iphone_support: bool = True):
+                 iphone_support: bool = True,
+                 media_pool_size: int = 10,
+                 media_keep_alive: bool = True,
+                 metadata_cache: Optional[MetadataCache] = None,
+                 transport: Optional[requests.adapters.BaseAdapter] = None,
+                 media_buffer_size: int = 1024 * 1024,
+                 prefetch_pages: bool = False,
+                 page_lengths: Optional['PageLengths'] = None):
 
         self.user_agent = user_agent if user_agent is not None else default_user_agent()
         self.request_timeout = request_timeout
+        self.transport = transport
         self._session = self.get_anonymous_session()
+        self.media_pool_size = media_pool_size
+        self.media_keep_alive = media_keep_alive
+        self._media_session = self._get_media_session()
+        self.media_buffer_size = media_buffer_size
+        # per-thread buffer that write_raw() reads responses into
+        self._media_buffers = threading.local()
+        # persistent sessions per endpoint family, derived from self._session, see _get_query_session()
+        self._query_sessions: Dict[str, requests.Session] = dict()
+        self._query_sessions_origin: Optional[requests.Session] = None
         self.username = None
         self.user_id = None
         self.sleep = sleep
@@ -100,7 +192,13 @@ class InstaloaderContext:
         # error log, filled with error() and printed at the end of Instaloader.main()
         self.error_log: List[str] = []
 
+        # per-thread buffer that log() writes into instead of stdout, see _capture_log()
+        self._log_capture = threading.local()
+
         self._rate_controller = rate_controller(self) if rate_controller is not None else RateController(self)
+        self.query_scheduler = QueryScheduler(self._rate_controller)
+        # per-thread priority of queries, see query_priority()
+        self._query_priority = threading.local()
 
         # Can be set to True for testing, disables suppression of InstaloaderContext._error_catcher
         self.raise_all_errors = False
@@ -111,6 +209,37 @@ class InstaloaderContext:
         # Cache profile from id (mapping from id to Profile)
         self.profile_id_cache: Dict[int, Any] = dict()
 
+        # Persistent cache of get_json() responses, or None
+        self.metadata_cache = metadata_cache
+
+        # Called by do_sleep() and the RateController with the number of seconds they are about to wait, to do other
+        # work meanwhile
+        self.wait_hook: Optional[Callable[[float], None]] = None
+        # Seconds waited by do_sleep() and the RateController in total, and how many thereof were spent in wait_hook
+        self.rate_limit_waittime = 0.0
+        self.rate_limit_overlapped_waittime = 0.0
+        self._statistics_lock = threading.Lock()
+        # Set to interrupt waiting for the rate limits in all threads, see RateController.sleep()
+        self._abort_waiting = threading.Event()
+
+        # Called by write_raw() with filename, bytes written and seconds taken per file
+        self.download_stats_hook: Optional[Callable[[str, int, float], None]] = None
+
+        # Whether NodeIterators query their next page in the background, see _prefetch()
+        self.prefetch_pages = prefetch_pages
+        self._prefetch_executor: Optional[ThreadPoolExecutor] = None
+        self._prefetch_executor_lock = threading.Lock()
+
+        # Adaptive page lengths of NodeIterators, or None
+        self.page_lengths = page_lengths
+
+        # Cache of Content-Length per media URL, filled by get_content_lengths()
+        self._content_length_cache: Dict[str, int] = dict()
+        self._content_length_cache_lock = threading.Lock()
+
+        # Guards merging the cookies set in iPhone API responses into the main session, see _get_query_session()
+        self._cookies_lock = threading.Lock()
+
     @contextmanager
     def anonymous_copy(self):
         session = self._session
@@ -138,14 +267,72 @@ class InstaloaderContext:
     def log(self, *msg, sep='', end='\n', flush=False):
         """Log a message to stdout that can be suppressed with --quiet."""
         if not self.quiet:
-            print(*msg, sep=sep, end=end, flush=flush)
+            buffer = getattr(self._log_capture, 'buffer', None)
+            if buffer is not None:
+                buffer.append(sep.join(str(m) for m in msg) + end)
+            else:
+                print(*msg, sep=sep, end=end, flush=flush)
+
+    @contextmanager
+    def _capture_log(self, buffer: Union[List[Any], _TaggedOutput]) -> Iterator[None]:
+        """Within this context, messages logged by the current thread with :meth:`log` are appended to `buffer`
+        rather than printed. Used to keep the output of concurrent downloads in order."""
+        previous_buffer = getattr(self._log_capture, 'buffer', None)
+        self._log_capture.buffer = buffer
+        try:
+            yield
+        finally:
+            self._log_capture.buffer = previous_buffer
+
+    @contextmanager
+    def _tag_output(self, tag: str, lock: threading.Lock) -> Iterator[None]:
+        """Within this context, the lines logged by the current thread with :meth:`log` and :meth:`error` are
+        prefixed with `tag` and printed under `lock`. Used for the output of concurrently downloaded targets."""
+        output = _TaggedOutput(tag, lock)
+        previous_output = getattr(self._log_capture, 'tagged', None)
+        self._log_capture.tagged = output
+        try:
+            with self._capture_log(output):
+                yield
+        finally:
+            self._log_capture.tagged = previous_output
+            output.flush()
+
+    @contextmanager
+    def query_priority(self, priority: int) -> Iterator[None]:
+        """Within this context, queries of the current thread have the given priority, see :class:`QueryScheduler`.
+
+        .. versionadded:: 4.15"""
+        previous_priority = getattr(self._query_priority, 'priority', None)
+        self._query_priority.priority = priority
+        try:
+            yield
+        finally:
+            self._query_priority.priority = previous_priority
+
+    def queue_depths(self) -> Dict[int, int]:
+        """Number of queries waiting for their turn per priority, see :class:`QueryScheduler`.
+
+        .. versionadded:: 4.15"""
+        return self.query_scheduler.queue_depths()
+
+    def rate_controller_statistics(self) -> "RateControllerStatistics":
+        """Statistics of the queries made and the time waited for the rate limits, see
+        :meth:`RateController.statistics`.
+
+        .. versionadded:: 4.15"""
+        return self._rate_controller.statistics()
 
     def error(self, msg, repeat_at_end=True):
         """Log a non-fatal error message to stderr, which is repeated at program termination.
 
         :param msg: Message to be printed.
         :param repeat_at_end: Set to false if the message should be printed, but not repeated at program termination."""
-        print(msg, file=sys.stderr)
+        tagged = getattr(self._log_capture, 'tagged', None)
+        if tagged is not None:
+            tagged.append(str(msg) + '\n', error=True)
+        else:
+            print(msg, file=sys.stderr)
         if repeat_at_end:
             self.error_log.append(msg)
 
@@ -162,7 +349,17 @@ class InstaloaderContext:
             print("\nErrors or warnings occurred:", file=sys.stderr)
             for err in self.error_log:
                 print(err, file=sys.stderr)
+        if self._prefetch_executor is not None:
+            # prefetched pages that are being queried are awaited, the others are not queried anymore
+            self._prefetch_executor.shutdown(wait=True, cancel_futures=True)
+        self._close_query_sessions()
+        self._rate_controller.close()
+        if self.metadata_cache is not None:
+            self.metadata_cache.close()
+        if self.page_lengths is not None:
+            self.page_lengths.close()
         self._session.close()
+        self._media_session.close()
 
     @contextmanager
     def error_catcher(self, extra_info: Optional[str] = None):
@@ -209,8 +406,66 @@ class InstaloaderContext:
         # Override default timeout behavior.
         # Need to silence mypy bug for this. See: https://github.com/python/mypy/issues/2427
         session.request = partial(session.request, timeout=self.request_timeout) # type: ignore
+        return self._mount_transport(session)
+
+    def _mount_transport(self, session: requests.Session) -> requests.Session:
+        """Mounts the :attr:`transport` on the given session, if set."""
+        if self.transport is not None:
+            session.mount('https://', self.transport)
+            session.mount('http://', self.transport)
         return session
 
+    def _get_media_session(self) -> requests.Session:
+        """Returns the long-lived anonymous session used by :meth:`get_raw` and :meth:`head`.
+
+        Its connection pool is kept between requests, so downloading many files from the same CDN host does not
+        require a new TCP and TLS handshake per file."""
+        session = self.get_anonymous_session()
+        if self.transport is None:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.media_pool_size,
+                                                    pool_maxsize=self.media_pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        if not self.media_keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def _close_query_sessions(self):
+        for session in self._query_sessions.values():
+            session.close()
+        self._query_sessions = dict()
+
+    def _get_query_session(self, family: str) -> requests.Session:
+        """Returns the persistent session for the given endpoint family, ``'graphql'``, ``'doc_id'`` or
+        ``'iphone'``.
+
+        The sessions are derived from the main session once, with the family-specific headers already set, and are
+        recreated whenever the main session is replaced, e.g. after logging in. The GraphQL sessions share the cookie
+        jar with the main session. The iPhone session gets its cookies per request, see :meth:`get_iphone_json`, and
+        does not keep the cookies set in its responses, which are merged into the main session instead."""
+        if self._query_sessions_origin is not self._session:
+            self._close_query_sessions()
+            self._query_sessions_origin = self._session
+        if family not in self._query_sessions:
+            session = self._mount_transport(copy_session(self._session, self.request_timeout))
+            if family == 'iphone':
+                session.cookies = requests.cookies.RequestsCookieJar(
+                    policy=DefaultCookiePolicy(allowed_domains=[]))
+                session.hooks['response'].append(self._merge_response_cookies)
+                # Remove headers specific to Desktop version
+                for header in ['Host', 'Origin', 'X-Instagram-AJAX', 'X-Requested-With', 'Referer']:
+                    session.headers.pop(header, None)
+            else:
+                session.cookies = self._session.cookies
+                session.headers.update(self._default_http_header(empty_session_only=True))
+                del session.headers['Connection']
+                del session.headers['Content-Length']
+                session.headers['authority'] = 'www.instagram.com'
+                session.headers['scheme'] = 'https'
+                session.headers['accept'] = '*/*'
+            self._query_sessions[family] = session
+        return self._query_sessions[family]
+
     def save_session(self):
         """Not meant to be used directly, use :meth:`Instaloader.save_session`."""
         return requests.utils.dict_from_cookiejar(self._session.cookies)
@@ -228,7 +483,7 @@ class InstaloaderContext:
         # Override default timeout behavior.
         # Need to silence mypy bug for this. See: https://github.com/python/mypy/issues/2427
         session.request = partial(session.request, timeout=self.request_timeout)  # type: ignore
-        self._session = session
+        self._session = self._mount_transport(session)
         self.username = username
 
     def save_session_to_file(self, sessionfile):
@@ -273,6 +528,7 @@ class InstaloaderContext:
         # Override default timeout behavior.
         # Need to silence mypy bug for this. See: https://github.com/python/mypy/issues/2427
         session.request = partial(session.request, timeout=self.request_timeout) # type: ignore
+        self._mount_transport(session)
 
         # Make a request to Instagram's root URL, which will set the session's csrftoken cookie
         # Not using self.get_json() here, because we need to access the cookie
@@ -295,7 +551,7 @@ class InstaloaderContext:
                 "Login error: JSON decode fail, {} - {}.".format(login.status_code, login.reason)
             ) from err
         if resp_json.get('two_factor_required'):
-            two_factor_session = copy_session(session, self.request_timeout)
+            two_factor_session = self._mount_transport(copy_session(session, self.request_timeout))
             two_factor_session.headers.update({'X-CSRFToken': csrf_token})
             two_factor_session.cookies.update({'csrftoken': csrf_token})
             self.two_factor_auth_pending = (two_factor_session,
@@ -361,10 +617,50 @@ class InstaloaderContext:
         self.username = user
         self.two_factor_auth_pending = None
 
+    def _prefetch(self, query_type: str, query: Callable[[], Any]) -> Optional[Future]:
+        """Runs the given query of given type in a background thread and returns its future, if
+        :attr:`prefetch_pages` is enabled, no other queries are waiting for their turn and the query does not have to
+        wait for the rate controller currently. Otherwise, returns None.
+
+        The query is done with the priority of the current thread, and like any other query waits for its turn in the
+        :attr:`query_scheduler`."""
+        # pylint:disable=protected-access
+        if not self.prefetch_pages or self.query_scheduler.queue_depths() or \
+                self._rate_controller.query_waittime(query_type, self._rate_controller._clock()) > 0:
+            return None
+        priority = getattr(self._query_priority, 'priority', None)
+
+        def prefetch() -> Any:
+            if priority is None:
+                return query()
+            with self.query_priority(priority):
+                return query()
+
+        with self._prefetch_executor_lock:
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='instaloader-prefetch')
+            return self._prefetch_executor.submit(prefetch)
+
     def do_sleep(self):
         """Sleep a short time if self.sleep is set. Called before each request to instagram.com."""
         if self.sleep:
-            time.sleep(min(random.expovariate(0.6), 15.0))
+            waittime = self._use_waittime(min(random.expovariate(0.6), 15.0))
+            if waittime > 0:
+                time.sleep(waittime)
+
+    def _use_waittime(self, waittime: float) -> float:
+        """Let the :attr:`wait_hook` do other work, such as deferred downloads, within the given time that is to be
+        waited. Returns the remaining time to wait."""
+        with self._statistics_lock:
+            self.rate_limit_waittime += waittime
+        if self.wait_hook is None:
+            return waittime
+        start = time.monotonic()
+        self.wait_hook(waittime)
+        used = time.monotonic() - start
+        with self._statistics_lock:
+            self.rate_limit_overlapped_waittime += min(used, waittime)
+        return waittime - used
 
     @staticmethod
     def _response_error(resp: requests.Response) -> str:
@@ -386,7 +682,8 @@ class InstaloaderContext:
     def get_json(self, path: str, params: Dict[str, Any], host: str = 'www.instagram.com',
                  session: Optional[requests.Session] = None, _attempt=1,
                  response_headers: Optional[Dict[str, Any]] = None,
-                 use_post: bool = False) -> Dict[str, Any]:
+                 use_post: bool = False, headers: Optional[Dict[str, str]] = None,
+                 cookies: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
         """JSON request to Instagram.
 
         :param path: URL, relative to the given domain which defaults to www.instagram.com/
@@ -394,6 +691,8 @@ class InstaloaderContext:
         :param host: Domain part of the URL from where to download the requested JSON; defaults to www.instagram.com
         :param session: Session to use, or None to use self.session
         :param use_post: Use POST instead of GET to make the request
+        :param headers: Additional HTTP headers for this request
+        :param cookies: Additional cookies for this request
         :return: Decoded response dictionary
         :raises QueryReturnedBadRequestException: When the server responds with a 400.
         :raises QueryReturnedNotFoundException: When the server responds with a 404.
@@ -401,64 +700,25 @@ class InstaloaderContext:
 
         .. versionchanged:: 4.13
            Added `use_post` parameter.
+
+        .. versionchanged:: 4.15
+           Added `headers` and `cookies` parameters. Responses are taken from and stored in the
+           :attr:`metadata_cache`, if set.
         """
-        is_graphql_query = 'query_hash' in params and 'graphql/query' in path
-        is_doc_id_query = 'doc_id' in params and 'graphql/query' in path
-        is_iphone_query = host == 'i.instagram.com'
-        is_other_query = not is_graphql_query and not is_doc_id_query and host == "www.instagram.com"
+        query_type = self._query_type(path, params, host)
+        cached_response = self._get_cached_response(path, params, host, query_type)
+        if cached_response is not None:
+            return cached_response
         sess = session if session else self._session
         try:
             self.do_sleep()
-            if is_graphql_query:
-                self._rate_controller.wait_before_query(params['query_hash'])
-            if is_doc_id_query:
-                self._rate_controller.wait_before_query(params['doc_id'])
-            if is_iphone_query:
-                self._rate_controller.wait_before_query('iphone')
-            if is_other_query:
-                self._rate_controller.wait_before_query('other')
-            if use_post:
-                resp = sess.post('https://{0}/{1}'.format(host, path), data=params, allow_redirects=False)
-            else:
-                resp = sess.get('https://{0}/{1}'.format(host, path), params=params, allow_redirects=False)
-            if resp.status_code in self.fatal_status_codes:
-                redirect = " redirect to {}".format(resp.headers['location']) if 'location' in resp.headers else ""
-                body = ""
-                if resp.headers['Content-Type'].startswith('application/json'):
-                    body = ': ' + resp.text[:500] + ('…' if len(resp.text) > 501 else '')
-                raise AbortDownloadException("Query to https://{}/{} responded with \"{} {}\"{}{}".format(
-                    host, path, resp.status_code, resp.reason, redirect, body
-                ))
-            while resp.is_redirect:
-                redirect_url = resp.headers['location']
-                self.log('\nHTTP redirect from https://{0}/{1} to {2}'.format(host, path, redirect_url))
-                if (redirect_url.startswith('https://www.instagram.com/accounts/login') or
-                    redirect_url.startswith('https://i.instagram.com/accounts/login')):
-                    if not self.is_logged_in:
-                        raise LoginRequiredException("Redirected to login page. Use --login or --load-cookies.")
-                    raise AbortDownloadException("Redirected to login page. You've been logged out, please wait " +
-                                                 "some time, recreate the session and try again")
-                if redirect_url.startswith('https://{}/'.format(host)):
-                    resp = sess.get(redirect_url if redirect_url.endswith('/') else redirect_url + '/',
-                                    params=params, allow_redirects=False)
-                else:
-                    break
-            if response_headers is not None:
-                response_headers.clear()
-                response_headers.update(resp.headers)
-            if resp.status_code == 400:
-                raise QueryReturnedBadRequestException(self._response_error(resp))
-            if resp.status_code == 404:
-                raise QueryReturnedNotFoundException(self._response_error(resp))
-            if resp.status_code == 429:
-                raise TooManyRequestsException(self._response_error(resp))
-            if resp.status_code != 200:
-                raise ConnectionException(self._response_error(resp))
-            else:
-                resp_json = resp.json()
-            if 'status' in resp_json and resp_json['status'] != "ok":
-                raise ConnectionException(self._response_error(resp))
-            return resp_json
+            if query_type is not None:
+                priority = getattr(self._query_priority, 'priority', None)
+                self.query_scheduler.wait_before_query(query_type, priority if priority is not None
+                                                       else self.query_scheduler.priority(query_type))
+            response = self._get_json_response(path, params, host, sess, response_headers, use_post, headers, cookies)
+            self._cache_response(path, params, host, query_type, response)
+            return response
         except (ConnectionException, json.decoder.JSONDecodeError, requests.exceptions.RequestException) as err:
             error_string = "JSON Query to {}: {}".format(path, err)
             if _attempt == self.max_connection_attempts:
@@ -468,21 +728,94 @@ class InstaloaderContext:
                     raise ConnectionException(error_string) from err
             self.error(error_string + " [retrying; skip with ^C]", repeat_at_end=False)
             try:
-                if isinstance(err, TooManyRequestsException):
-                    if is_graphql_query:
-                        self._rate_controller.handle_429(params['query_hash'])
-                    if is_doc_id_query:
-                        self._rate_controller.handle_429(params['doc_id'])
-                    if is_iphone_query:
-                        self._rate_controller.handle_429('iphone')
-                    if is_other_query:
-                        self._rate_controller.handle_429('other')
+                if isinstance(err, TooManyRequestsException) and query_type is not None:
+                    self._rate_controller.handle_429(query_type)
                 return self.get_json(path=path, params=params, host=host, session=sess, _attempt=_attempt + 1,
-                                     response_headers=response_headers)
+                                     response_headers=response_headers, use_post=use_post, headers=headers,
+                                     cookies=cookies)
             except KeyboardInterrupt:
                 self.error("[skipped by user]", repeat_at_end=False)
                 raise ConnectionException(error_string) from err
 
+    @staticmethod
+    def _query_type(path: str, params: Dict[str, Any], host: str) -> Optional[str]:
+        """Query type of a :meth:`get_json` request as tracked by the :class:`RateController`, or None if the request
+        is not rate controlled."""
+        if 'graphql/query' in path:
+            if 'query_hash' in params:
+                return params['query_hash']
+            if 'doc_id' in params:
+                return params['doc_id']
+        if host == 'i.instagram.com':
+            return 'iphone'
+        if host == 'www.instagram.com':
+            return 'other'
+        return None
+
+    def _get_cached_response(self, path: str, params: Dict[str, Any], host: str,
+                             query_type: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Returns the response of a :meth:`get_json` request from the :attr:`metadata_cache`, if available."""
+        if self.metadata_cache is None or query_type is None:
+            return None
+        return self.metadata_cache.get(self.metadata_cache.key(self.username, host, path, params))
+
+    def _cache_response(self, path: str, params: Dict[str, Any], host: str, query_type: Optional[str],
+                        response: Dict[str, Any]) -> None:
+        """Stores the response of a :meth:`get_json` request in the :attr:`metadata_cache`, if set."""
+        if self.metadata_cache is None or query_type is None:
+            return
+        self.metadata_cache.put(self.metadata_cache.key(self.username, host, path, params), query_type, response,
+                                path)
+
+    def _get_json_response(self, path: str, params: Dict[str, Any], host: str, sess: requests.Session,
+                           response_headers: Optional[Dict[str, Any]], use_post: bool,
+                           headers: Optional[Dict[str, str]], cookies: Optional[Dict[str, str]]) -> Dict[str, Any]:
+        """Does the request of :meth:`get_json`, without rate controlling and retrying."""
+        if use_post:
+            resp = sess.post('https://{0}/{1}'.format(host, path), data=params, headers=headers, cookies=cookies,
+                             allow_redirects=False)
+        else:
+            resp = sess.get('https://{0}/{1}'.format(host, path), params=params, headers=headers, cookies=cookies,
+                            allow_redirects=False)
+        if resp.status_code in self.fatal_status_codes:
+            redirect = " redirect to {}".format(resp.headers['location']) if 'location' in resp.headers else ""
+            body = ""
+            if resp.headers['Content-Type'].startswith('application/json'):
+                body = ': ' + resp.text[:500] + ('…' if len(resp.text) > 501 else '')
+            raise AbortDownloadException("Query to https://{}/{} responded with \"{} {}\"{}{}".format(
+                host, path, resp.status_code, resp.reason, redirect, body
+            ))
+        while resp.is_redirect:
+            redirect_url = resp.headers['location']
+            self.log('\nHTTP redirect from https://{0}/{1} to {2}'.format(host, path, redirect_url))
+            if (redirect_url.startswith('https://www.instagram.com/accounts/login') or
+                redirect_url.startswith('https://i.instagram.com/accounts/login')):
+                if not self.is_logged_in:
+                    raise LoginRequiredException("Redirected to login page. Use --login or --load-cookies.")
+                raise AbortDownloadException("Redirected to login page. You've been logged out, please wait " +
+                                             "some time, recreate the session and try again")
+            if redirect_url.startswith('https://{}/'.format(host)):
+                resp = sess.get(redirect_url if redirect_url.endswith('/') else redirect_url + '/',
+                                params=params, headers=headers, cookies=cookies, allow_redirects=False)
+            else:
+                break
+        if response_headers is not None:
+            response_headers.clear()
+            response_headers.update(resp.headers)
+        if resp.status_code == 400:
+            raise QueryReturnedBadRequestException(self._response_error(resp))
+        if resp.status_code == 404:
+            raise QueryReturnedNotFoundException(self._response_error(resp))
+        if resp.status_code == 429:
+            raise TooManyRequestsException(self._response_error(resp))
+        if resp.status_code != 200:
+            raise ConnectionException(self._response_error(resp))
+        else:
+            resp_json = jsoncodec.loads(resp.content)
+        if 'status' in resp_json and resp_json['status'] != "ok":
+            raise ConnectionException(self._response_error(resp))
+        return resp_json
+
     def graphql_query(self, query_hash: str, variables: Dict[str, Any],
                       referer: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -496,22 +829,14 @@ class InstaloaderContext:
         .. versionchanged:: 4.13.1
            Removed the `rhx_gis` parameter.
         """
-        with copy_session(self._session, self.request_timeout) as tmpsession:
-            tmpsession.headers.update(self._default_http_header(empty_session_only=True))
-            del tmpsession.headers['Connection']
-            del tmpsession.headers['Content-Length']
-            tmpsession.headers['authority'] = 'www.instagram.com'
-            tmpsession.headers['scheme'] = 'https'
-            tmpsession.headers['accept'] = '*/*'
-            if referer is not None:
-                tmpsession.headers['referer'] = urllib.parse.quote(referer)
-
-            variables_json = json.dumps(variables, separators=(',', ':'))
-
-            resp_json = self.get_json('graphql/query',
-                                      params={'query_hash': query_hash,
-                                              'variables': variables_json},
-                                      session=tmpsession)
+        headers = {'referer': urllib.parse.quote(referer)} if referer is not None else None
+        variables_json = json.dumps(variables, separators=(',', ':'))
+
+        resp_json = self.get_json('graphql/query',
+                                  params={'query_hash': query_hash,
+                                          'variables': variables_json},
+                                  session=self._get_query_session('graphql'),
+                                  headers=headers)
         if 'status' not in resp_json:
             self.error("GraphQL response did not contain a \"status\" field.")
         return resp_json
@@ -528,24 +853,16 @@ class InstaloaderContext:
         :param referer: HTTP Referer, or None.
         :return: The server's response dictionary.
         """
-        with copy_session(self._session, self.request_timeout) as tmpsession:
-            tmpsession.headers.update(self._default_http_header(empty_session_only=True))
-            del tmpsession.headers['Connection']
-            del tmpsession.headers['Content-Length']
-            tmpsession.headers['authority'] = 'www.instagram.com'
-            tmpsession.headers['scheme'] = 'https'
-            tmpsession.headers['accept'] = '*/*'
-            if referer is not None:
-                tmpsession.headers['referer'] = urllib.parse.quote(referer)
-
-            variables_json = json.dumps(variables, separators=(',', ':'))
-
-            resp_json = self.get_json('graphql/query',
-                                      params={'variables': variables_json,
-                                              'doc_id': doc_id,
-                                              'server_timestamps': 'true'},
-                                      session=tmpsession,
-                                      use_post=True)
+        headers = {'referer': urllib.parse.quote(referer)} if referer is not None else None
+        variables_json = json.dumps(variables, separators=(',', ':'))
+
+        resp_json = self.get_json('graphql/query',
+                                  params={'variables': variables_json,
+                                          'doc_id': doc_id,
+                                          'server_timestamps': 'true'},
+                                  session=self._get_query_session('doc_id'),
+                                  use_post=True,
+                                  headers=headers)
         if 'status' not in resp_json:
             self.error("GraphQL response did not contain a \"status\" field.")
         return resp_json
@@ -597,81 +914,205 @@ class InstaloaderContext:
         :raises ConnectionException: When query repeatedly failed.
 
         .. versionadded:: 4.2.1"""
-        with copy_session(self._session, self.request_timeout) as tempsession:
-            # Set headers to simulate an API request from iPad
-            tempsession.headers['ig-intended-user-id'] = str(self.user_id)
-            tempsession.headers['x-pigeon-rawclienttime'] = '{:.6f}'.format(time.time())
-
-            # Add headers obtained from previous iPad request
-            tempsession.headers.update(self.iphone_headers)
-
-            # Extract key information from cookies if we haven't got it already from a previous request
-            header_cookies_mapping = {'x-mid': 'mid',
-                                     'ig-u-ds-user-id': 'ds_user_id',
-                                     'x-ig-device-id': 'ig_did',
-                                     'x-ig-family-device-id': 'ig_did',
-                                     'family_device_id': 'ig_did'}
-
-            # Map the cookie value to the matching HTTP request header
-            cookies = tempsession.cookies.get_dict().copy()
-            for key, value in header_cookies_mapping.items():
-                if value in cookies:
-                    if key not in tempsession.headers:
-                        tempsession.headers[key] = cookies[value]
-                    else:
-                        # Remove the cookie value if it's already specified as a header
-                        tempsession.cookies.pop(value, None)
-
-            # Edge case for ig-u-rur header due to special string encoding in cookie
-            if 'rur' in cookies:
-                if 'ig-u-rur' not in tempsession.headers:
-                    tempsession.headers['ig-u-rur'] = cookies['rur'].strip('\"').encode('utf-8') \
-                                                                    .decode('unicode_escape')
+        session, headers, cookies = self._iphone_request_arguments()
+        response_headers = dict()    # type: Dict[str, Any]
+        response = self.get_json(path, params, 'i.instagram.com', session, response_headers=response_headers,
+                                 headers=headers, cookies=cookies)
+        self._update_iphone_headers(response_headers)
+        return response
+
+    def _iphone_request_arguments(self) -> Tuple[requests.Session, Dict[str, str], Dict[str, str]]:
+        """Session, headers and cookies for a request to the iPhone API."""
+        session = self._get_query_session('iphone')
+
+        # Set headers to simulate an API request from iPad
+        headers = requests.structures.CaseInsensitiveDict({
+            'ig-intended-user-id': str(self.user_id),
+            'x-pigeon-rawclienttime': '{:.6f}'.format(time.time()),
+        })
+
+        # Add headers obtained from previous iPad request
+        headers.update(self.iphone_headers)
+
+        # Extract key information from cookies if we haven't got it already from a previous request
+        header_cookies_mapping = {'x-mid': 'mid',
+                                  'ig-u-ds-user-id': 'ds_user_id',
+                                  'x-ig-device-id': 'ig_did',
+                                  'x-ig-family-device-id': 'ig_did',
+                                  'family_device_id': 'ig_did'}
+
+        # Map the cookie value to the matching HTTP request header
+        with self._cookies_lock:
+            all_cookies = self._session.cookies.get_dict()
+        cookies = all_cookies.copy()
+        for key, value in header_cookies_mapping.items():
+            if value in all_cookies:
+                if key not in headers and key not in session.headers:
+                    headers[key] = all_cookies[value]
                 else:
-                    tempsession.cookies.pop('rur', None)
+                    # Remove the cookie value if it's already specified as a header
+                    cookies.pop(value, None)
 
-            # Remove headers specific to Desktop version
-            for header in ['Host', 'Origin', 'X-Instagram-AJAX', 'X-Requested-With', 'Referer']:
-                tempsession.headers.pop(header, None)
+        # Edge case for ig-u-rur header due to special string encoding in cookie
+        if 'rur' in all_cookies:
+            if 'ig-u-rur' not in headers and 'ig-u-rur' not in session.headers:
+                headers['ig-u-rur'] = all_cookies['rur'].strip('\"').encode('utf-8').decode('unicode_escape')
+            else:
+                cookies.pop('rur', None)
 
-            # No need for cookies if we have a bearer token
-            if 'authorization' in tempsession.headers:
-                tempsession.cookies.clear()
+        # No need for cookies if we have a bearer token
+        if 'authorization' in headers or 'authorization' in session.headers:
+            cookies.clear()
 
-            response_headers = dict()    # type: Dict[str, Any]
-            response = self.get_json(path, params, 'i.instagram.com', tempsession, response_headers=response_headers)
+        return session, dict(headers), cookies
 
-            # Extract the ig-set-* headers and use them in the next request
-            for key, value in response_headers.items():
-                if key.startswith('ig-set-'):
-                    self.iphone_headers[key.replace('ig-set-', '')] = value
-                elif key.startswith('x-ig-set-'):
-                    self.iphone_headers[key.replace('x-ig-set-', 'x-ig-')] = value
+    def _merge_response_cookies(self, resp: requests.Response, **_kwargs) -> None:
+        """Response hook of the iPhone session that merges the cookies set by the server into the main session."""
+        with self._cookies_lock:
+            self._session.cookies.update(resp.cookies)
 
-            return response
+    def _update_iphone_headers(self, response_headers: Dict[str, Any]) -> None:
+        """Extract the ig-set-* headers of an iPhone API response and use them in the next request."""
+        for key, value in response_headers.items():
+            if key.startswith('ig-set-'):
+                self.iphone_headers[key.replace('ig-set-', '')] = value
+            elif key.startswith('x-ig-set-'):
+                self.iphone_headers[key.replace('x-ig-set-', 'x-ig-')] = value
+
+    @staticmethod
+    def _content_range(resp: requests.Response) -> Tuple[int, Optional[int]]:
+        """Returns first byte position and complete length from the Content-Range header of a 206 response."""
+        match = re.fullmatch(r'bytes (\d+)-\d+/(\d+|\*)', resp.headers.get('Content-Range', '').strip())
+        if match is None:
+            raise ConnectionException("Invalid Content-Range in partial response: {!r}."
+                                      .format(resp.headers.get('Content-Range')))
+        return int(match.group(1)), int(match.group(2)) if match.group(2) != '*' else None
 
     def write_raw(self, resp: Union[bytes, requests.Response], filename: str) -> None:
         """Write raw response data into a file.
 
-        .. versionadded:: 4.2.1"""
+        If *resp* is a partial response (206), as returned by :meth:`get_raw` with an *offset*, its data is appended
+        to the existing ``filename + '.temp'``. The temporary file is only moved to *filename* after its size has been
+        checked against the announced length, otherwise it is kept for resuming later, together with the ETag or
+        Last-Modified date of the response, see :meth:`temp_validator`.
+
+        :raises ConnectionException: When the partial response does not fit to the temporary file or the written file
+           is incomplete.
+
+        .. versionadded:: 4.2.1
+
+        .. versionchanged:: 4.15
+           Append partial responses and check length of written file. Read the response in chunks of
+           :attr:`media_buffer_size` and report to :attr:`download_stats_hook`."""
         self.log(filename, end=' ', flush=True)
-        with open(filename + '.temp', 'wb') as file:
+        temp_filename = filename + '.temp'
+        expected_size = None
+        mode = 'wb'
+        if isinstance(resp, requests.Response):
+            if resp.status_code == 206:
+                offset, expected_size = self._content_range(resp)
+                temp_size = os.path.getsize(temp_filename) if os.path.isfile(temp_filename) else 0
+                if offset != temp_size:
+                    resp.close()
+                    raise ConnectionException("Cannot resume {} at byte {}, have {} bytes."
+                                              .format(temp_filename, offset, temp_size))
+                mode = 'ab'
+            elif 'Content-Length' in resp.headers and resp.headers.get('Content-Encoding', 'identity') == 'identity':
+                expected_size = int(resp.headers['Content-Length'])
+        validator_filename = temp_filename + '.validator'
+        if mode == 'wb':
+            validator = self._response_validator(resp) if isinstance(resp, requests.Response) else None
+            if validator is not None:
+                with open(validator_filename, 'w') as validator_file:
+                    validator_file.write(validator)
+            else:
+                with suppress(FileNotFoundError):
+                    os.remove(validator_filename)
+        start_time = time.monotonic()
+        with open(temp_filename, mode) as file:
+            start_size = file.seek(0, os.SEEK_END)
             if isinstance(resp, requests.Response):
-                shutil.copyfileobj(resp.raw, file)
+                self._copy_response(resp, file)
             else:
                 file.write(resp)
-        os.replace(filename + '.temp', filename)
+            written_size = file.tell()
+        if expected_size is not None and written_size != expected_size:
+            raise ConnectionException("Incomplete download of {}: {} of {} bytes."
+                                      .format(filename, written_size, expected_size))
+        os.replace(temp_filename, filename)
+        with suppress(FileNotFoundError):
+            os.remove(validator_filename)
+        if self.download_stats_hook is not None:
+            self.download_stats_hook(filename, written_size - start_size, time.monotonic() - start_time)
 
-    def get_raw(self, url: str, _attempt=1) -> requests.Response:
+    @staticmethod
+    def _response_validator(resp: requests.Response) -> Optional[str]:
+        """Strong ETag or else Last-Modified date of a response, usable as If-Range header, or None."""
+        etag = resp.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            return etag
+        return resp.headers.get('Last-Modified')
+
+    @staticmethod
+    def temp_validator(temp_filename: str) -> Optional[str]:
+        """The ETag or Last-Modified date of the response that the given temporary file of :meth:`write_raw` has
+        been started with, or None if the response had none. Pass it as *if_range* to :meth:`get_raw` to resume the
+        download only if the file has not changed since.
+
+        .. versionadded:: 4.15"""
+        try:
+            with open(temp_filename + '.validator') as validator_file:
+                return validator_file.read() or None
+        except FileNotFoundError:
+            return None
+
+    def _copy_response(self, resp: requests.Response, file: IO[bytes]) -> None:
+        """Copies the body of a streamed response to the current position of the given file.
+
+        The file is not preallocated, as its size is the offset to resume an interrupted download at, even if the
+        process has been killed."""
+        buffer = getattr(self._media_buffers, 'buffer', None)
+        if buffer is None or len(buffer) != self.media_buffer_size:
+            buffer = self._media_buffers.buffer = bytearray(self.media_buffer_size)
+        view = memoryview(buffer)
+        while True:
+            length = resp.raw.readinto(buffer)
+            if not length:
+                break
+            file.write(view[:length])
+
+    def get_raw(self, url: str, _attempt=1, offset: int = 0, if_range: Optional[str] = None) -> requests.Response:
         """Downloads a file anonymously.
 
+        With an *offset* greater than 0, only the data from that position on is requested. The returned response
+        then is a partial response (status 206) starting at *offset*, or, if the server does not support ranges, a
+        complete response (status 200). Pass it to :meth:`write_raw` to resume a download into an existing temporary
+        file. With *if_range*, the ETag or Last-Modified date from :meth:`temp_validator`, the server responds with
+        the complete file if it has changed since the temporary file was started.
+
         :raises QueryReturnedNotFoundException: When the server responds with a 404.
         :raises QueryReturnedForbiddenException: When the server responds with a 403.
         :raises ConnectionException: When download failed.
 
-        .. versionadded:: 4.2.1"""
-        with self.get_anonymous_session() as anonymous_session:
-            resp = anonymous_session.get(url, stream=True)
+        .. versionadded:: 4.2.1
+
+        .. versionchanged:: 4.15
+           Uses a persistent, connection-pooled session rather than a new session per file. Parameters *offset* and
+           *if_range*."""
+        headers = {'Range': 'bytes={}-'.format(offset), 'Accept-Encoding': 'identity'} if offset > 0 else None
+        if headers is not None and if_range is not None:
+            headers['If-Range'] = if_range
+        resp = self._media_session.get(url, stream=True, headers=headers)
+        if resp.status_code == 206 and offset > 0:
+            if self._content_range(resp)[0] == offset:
+                return resp
+            # Server responded with a different range than requested, fall back to complete download
+            resp.close()
+            return self.get_raw(url, _attempt)
+        if resp.status_code == 416 and offset > 0:
+            # Requested range not satisfiable, i.e. the partial file does not fit
+            resp.close()
+            return self.get_raw(url, _attempt)
         if resp.status_code == 200:
             resp.raw.decode_content = True
             return resp
@@ -700,9 +1141,11 @@ class InstaloaderContext:
         :raises ConnectionException: When request failed.
 
         .. versionadded:: 4.7.6
+
+        .. versionchanged:: 4.15
+           Uses a persistent, connection-pooled session rather than a new session per request.
         """
-        with self.get_anonymous_session() as anonymous_session:
-            resp = anonymous_session.head(url, allow_redirects=allow_redirects)
+        resp = self._media_session.head(url, allow_redirects=allow_redirects)
         if resp.status_code == 200:
             return resp
         else:
@@ -714,6 +1157,127 @@ class InstaloaderContext:
                 raise QueryReturnedNotFoundException(self._response_error(resp))
             raise ConnectionException(self._response_error(resp))
 
+    def get_content_lengths(self, urls: List[str],
+                            timeout: float = 10.0) -> List[Union[int, InstaloaderException]]:
+        """Get the Content-Length of given media URLs, following redirects.
+
+        The URLs are HEADed concurrently on the media session, each with the given *timeout*. The results are
+        cached per URL, so the same URL is not probed again.
+
+        :return: For each URL, either its Content-Length (0 if the header is missing), or the
+           :class:`InstaloaderException` describing why it could not be determined.
+
+        .. versionadded:: 4.15
+        """
+        def probe(url: str) -> Union[int, InstaloaderException]:
+            try:
+                resp = self._media_session.head(url, allow_redirects=True, timeout=timeout)
+            except requests.exceptions.RequestException as err:
+                return ConnectionException("HEAD {}: {}".format(url, err))
+            if resp.status_code != 200:
+                if resp.status_code == 403:
+                    return QueryReturnedForbiddenException(self._response_error(resp))
+                if resp.status_code == 404:
+                    return QueryReturnedNotFoundException(self._response_error(resp))
+                return ConnectionException(self._response_error(resp))
+            try:
+                content_length = int(resp.headers.get('Content-Length', 0))
+            except ValueError as err:
+                return ConnectionException("HEAD {}: Invalid Content-Length: {}".format(url, err))
+            with self._content_length_cache_lock:
+                if len(self._content_length_cache) >= 1024:
+                    del self._content_length_cache[next(iter(self._content_length_cache))]
+                self._content_length_cache[url] = content_length
+            return content_length
+
+        with self._content_length_cache_lock:
+            results: Dict[str, Union[int, InstaloaderException]] = {url: self._content_length_cache[url] for url in urls
+                                                                   if url in self._content_length_cache}
+        unknown_urls = [url for url in dict.fromkeys(urls) if url not in results]
+        if len(unknown_urls) == 1:
+            results[unknown_urls[0]] = probe(unknown_urls[0])
+        elif unknown_urls:
+            with ThreadPoolExecutor(max_workers=min(len(unknown_urls), self.media_pool_size)) as executor:
+                results.update(zip(unknown_urls, executor.map(probe, unknown_urls)))
+        return [results[url] for url in urls]
+
+
+
+class _SlidingWindows:
+    # Timestamps of queries in ascending order. For each window length that has been asked for, the position of the
+    # first timestamp within that window is kept and only advanced as time passes, so that counting the timestamps
+    # within a window is O(1) amortized.
+
+    def __init__(self) -> None:
+        self._times: List[float] = []
+        self._offset = 0  # number of timestamps that have been removed from the front
+        self._starts: Dict[float, int] = dict()  # window length -> absolute position of its first timestamp
+        self._now = float('-inf')
+
+    def append(self, timestamp: float) -> None:
+        if self._times and timestamp < self._times[-1]:
+            # concurrent queries might be tracked slightly out of order
+            bisect.insort(self._times, timestamp)
+            self._starts.clear()
+        else:
+            self._times.append(timestamp)
+
+    def _start(self, window: float, current_time: float) -> int:
+        """Index of the first timestamp within the given window, i.e. later than current_time - window."""
+        if current_time < self._now:
+            self._starts.clear()
+        self._now = current_time
+        cutoff = current_time - window
+        start = self._starts.get(window)
+        if start is None:
+            index = bisect.bisect_right(self._times, cutoff)
+        else:
+            index = max(start - self._offset, 0)
+            while index < len(self._times) and self._times[index] <= cutoff:
+                index += 1
+        self._starts[window] = index + self._offset
+        return index
+
+    def count(self, window: float, current_time: float) -> int:
+        """Number of timestamps within the given window."""
+        return len(self._times) - self._start(window, current_time)
+
+    def earliest(self, window: float, current_time: float) -> float:
+        """Earliest timestamp within the given window, which must not be empty."""
+        return self._times[self._start(window, current_time)]
+
+    def timestamps(self, window: float, current_time: float) -> List[float]:
+        """Timestamps within the given window."""
+        return self._times[self._start(window, current_time):]
+
+    def expire(self, window: float, current_time: float) -> None:
+        """Forget the timestamps that are not within the given window."""
+        index = self._start(window, current_time)
+        # compact only occasionally, to keep it O(1) amortized
+        if index > 64 and 2 * index > len(self._times):
+            del self._times[:index]
+            self._offset += index
+
+
+class RateControllerStatistics(NamedTuple):
+    """Statistics of the queries controlled by a :class:`RateController`, as returned by
+    :meth:`RateController.statistics`.
+
+    .. versionadded:: 4.15"""
+    queries: Dict[str, int]
+    too_many_requests: Dict[str, int]
+    wait_time: float
+    max_wait_time: float
+    too_many_requests_wait_time: float
+
+
+RateControllerStatistics.queries.__doc__ = "Number of queries per query type."
+RateControllerStatistics.too_many_requests.__doc__ = "Number of 429 Too Many Requests responses per query type."
+RateControllerStatistics.wait_time.__doc__ = "Seconds spent in :meth:`RateController.wait_before_query` in total."
+RateControllerStatistics.max_wait_time.__doc__ = "Longest time spent in one :meth:`RateController.wait_before_query`."
+RateControllerStatistics.too_many_requests_wait_time.__doc__ = \
+    "Seconds spent in :meth:`RateController.handle_429` in total."
+
 
 class RateController:
     """
@@ -733,29 +1297,69 @@ class RateController:
 
     def __init__(self, context: InstaloaderContext):
         self._context = context
-        self._query_timestamps: Dict[str, List[float]] = dict()
+        self._query_timestamps: Dict[str, _SlidingWindows] = dict()
+        # timestamps of all GraphQL queries, i.e. not 'iphone' or 'other'
+        self._graphql_query_timestamps = _SlidingWindows()
         self._earliest_next_request_time = 0.0
         self._iphone_earliest_next_request_time = 0.0
+        # Guards the timestamps of the queries, as concurrent threads track queries and compute waiting times, e.g.
+        # the QueryScheduler for the queries it chooses between. Reentrant, as subclasses extend the methods holding it.
+        self._lock = threading.RLock()
+        self._statistics_lock = threading.Lock()
+        self._query_counts: Dict[str, int] = dict()
+        self._429_counts: Dict[str, int] = dict()
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._429_wait_time = 0.0
 
     def sleep(self, secs: float):
-        """Wait given number of seconds."""
+        """Wait given number of seconds.
+
+        Raises :exc:`AbortDownloadException` if the wait is interrupted because the download is aborted, e.g. by
+        Ctrl+C while downloading several profiles concurrently."""
         # Not static, to allow for the behavior of this method to depend on context-inherent properties, such as
         # whether we are logged in.
-        time.sleep(secs)
+        if self._context._abort_waiting.wait(secs):  # pylint:disable=protected-access
+            raise AbortDownloadException("Interrupted while waiting for the rate limit")
+
+    def _clock(self) -> float:
+        # Clock that the timestamps of the queries refer to.
+        return time.monotonic()
 
     def _dump_query_timestamps(self, current_time: float, failed_query_type: str):
         windows = [10, 11, 20, 22, 30, 60]
         self._context.error("Number of requests within last {} minutes grouped by type:"
                             .format('/'.join(str(w) for w in windows)),
                             repeat_at_end=False)
-        for query_type, times in self._query_timestamps.items():
-            reqs_in_sliding_window = [sum(t > current_time - w * 60 for t in times) for w in windows]
+        with self._lock:
+            counts = {query_type: [times.count(w * 60, current_time) for w in windows]
+                      for query_type, times in self._query_timestamps.items()}
+        for query_type, reqs_in_sliding_window in counts.items():
             self._context.error(" {} {:>32}: {}".format(
                 "*" if query_type == failed_query_type else " ",
                 query_type,
                 " ".join("{:4}".format(reqs) for reqs in reqs_in_sliding_window)
             ), repeat_at_end=False)
 
+    def statistics(self) -> RateControllerStatistics:
+        """Statistics of the queries that have been made and the time spent waiting for them.
+
+        .. versionadded:: 4.15"""
+        with self._statistics_lock:
+            return RateControllerStatistics(dict(self._query_counts), dict(self._429_counts), self._wait_time,
+                                            self._max_wait_time, self._429_wait_time)
+
+    def _record_query(self, query_type: str, wait_time: float) -> None:
+        # Count a query that has been allowed after waiting the given time in total.
+        with self._statistics_lock:
+            self._query_counts[query_type] = self._query_counts.get(query_type, 0) + 1
+            self._wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+
+    def _record_429_wait(self, wait_time: float) -> None:
+        with self._statistics_lock:
+            self._429_wait_time += wait_time
+
     def count_per_sliding_window(self, query_type: str) -> int:
         """Return how many requests of the given type can be done within a sliding window of 11 minutes.
 
@@ -766,43 +1370,58 @@ class RateController:
         # whether we are logged in.
         return 75 if query_type == 'other' else 200
 
-    def _reqs_in_sliding_window(self, query_type: Optional[str], current_time: float, window: float) -> List[float]:
+    def _graphql_count_per_sliding_window(self) -> int:
+        # How many GraphQL queries of all types can be done within a sliding window of 10 minutes.
+        return 275
+
+    def _iphone_count_per_long_sliding_window(self) -> int:
+        # How many iPhone API queries can be done within a sliding window of 30 minutes.
+        return 199
+
+    def _sliding_windows(self, query_type: Optional[str]) -> _SlidingWindows:
         if query_type is not None:
             # timestamps of type query_type
-            relevant_timestamps = self._query_timestamps[query_type]
+            if query_type not in self._query_timestamps:
+                self._query_timestamps[query_type] = _SlidingWindows()
+            return self._query_timestamps[query_type]
         else:
             # all GraphQL queries, i.e. not 'iphone' or 'other'
-            graphql_query_timestamps = filter(lambda tp: tp[0] not in ['iphone', 'other'],
-                                              self._query_timestamps.items())
-            relevant_timestamps = [t for times in (tp[1] for tp in graphql_query_timestamps) for t in times]
-        return list(filter(lambda t: t > current_time - window, relevant_timestamps))
+            return self._graphql_query_timestamps
+
+    def _reqs_in_sliding_window(self, query_type: Optional[str], current_time: float, window: float) -> List[float]:
+        with self._lock:
+            return self._sliding_windows(query_type).timestamps(window, current_time)
 
     def query_waittime(self, query_type: str, current_time: float, untracked_queries: bool = False) -> float:
         """Calculate time needed to wait before query can be executed."""
+        with self._lock:
+            return self._query_waittime(query_type, current_time, untracked_queries)
+
+    def _query_waittime(self, query_type: str, current_time: float, untracked_queries: bool) -> float:
         per_type_sliding_window = 660
         iphone_sliding_window = 1800
-        if query_type not in self._query_timestamps:
-            self._query_timestamps[query_type] = []
-        self._query_timestamps[query_type] = list(filter(lambda t: t > current_time - 60 * 60,
-                                                         self._query_timestamps[query_type]))
+        query_timestamps = self._sliding_windows(query_type)
+        query_timestamps.expire(60 * 60, current_time)
 
         def per_type_next_request_time():
-            reqs_in_sliding_window = self._reqs_in_sliding_window(query_type, current_time, per_type_sliding_window)
-            if len(reqs_in_sliding_window) < self.count_per_sliding_window(query_type):
+            count = query_timestamps.count(per_type_sliding_window, current_time)
+            if count < self.count_per_sliding_window(query_type):
                 return 0.0
             else:
-                return min(reqs_in_sliding_window) + per_type_sliding_window + 6
+                return query_timestamps.earliest(per_type_sliding_window, current_time) + per_type_sliding_window + 6
 
         def gql_accumulated_next_request_time():
             if query_type in ['iphone', 'other']:
                 return 0.0
             gql_accumulated_sliding_window = 600
-            gql_accumulated_max_count = 275
-            reqs_in_sliding_window = self._reqs_in_sliding_window(None, current_time, gql_accumulated_sliding_window)
-            if len(reqs_in_sliding_window) < gql_accumulated_max_count:
+            gql_accumulated_max_count = self._graphql_count_per_sliding_window()
+            graphql_query_timestamps = self._sliding_windows(None)
+            graphql_query_timestamps.expire(gql_accumulated_sliding_window, current_time)
+            if graphql_query_timestamps.count(gql_accumulated_sliding_window, current_time) < gql_accumulated_max_count:
                 return 0.0
             else:
-                return min(reqs_in_sliding_window) + gql_accumulated_sliding_window
+                return graphql_query_timestamps.earliest(gql_accumulated_sliding_window, current_time) + \
+                       gql_accumulated_sliding_window
 
         def untracked_next_request_time():
             if untracked_queries:
@@ -818,9 +1437,9 @@ class RateController:
 
         def iphone_next_request():
             if query_type == "iphone":
-                reqs_in_sliding_window = self._reqs_in_sliding_window(query_type, current_time, iphone_sliding_window)
-                if len(reqs_in_sliding_window) >= 199:
-                    return min(reqs_in_sliding_window) + iphone_sliding_window + 18
+                if query_timestamps.count(iphone_sliding_window, current_time) >= \
+                        self._iphone_count_per_long_sliding_window():
+                    return query_timestamps.earliest(iphone_sliding_window, current_time) + iphone_sliding_window + 18
             return 0.0
 
         return max(0.0,
@@ -836,26 +1455,59 @@ class RateController:
 
         It calls :meth:`RateController.query_waittime` to determine the time needed to wait and then calls
         :meth:`RateController.sleep` to wait until the request can be made."""
-        waittime = self.query_waittime(query_type, time.monotonic(), False)
+        start = time.monotonic()
+        waittime = self.query_waittime(query_type, self._clock(), False)
         assert waittime >= 0
+        self._log_waittime(waittime)
+        if waittime > 0:
+            self._wait(waittime)
+        self._track_query(query_type, self._clock())
+        self._record_query(query_type, time.monotonic() - start)
+
+    def _wait(self, waittime: float) -> None:
+        # Let the context's wait_hook do other work meanwhile, and sleep the rest.
+        waittime = self._context._use_waittime(waittime)  # pylint:disable=protected-access
+        if waittime > 0:
+            self.sleep(waittime)
+
+    def _log_waittime(self, waittime: float) -> None:
         if waittime > 15:
             formatted_waittime = ("{} seconds".format(round(waittime)) if waittime <= 666 else
                                   "{} minutes".format(round(waittime / 60)))
             self._context.log("\nToo many queries in the last time. Need to wait {}, until {:%H:%M}."
                               .format(formatted_waittime, datetime.now() + timedelta(seconds=waittime)))
-        if waittime > 0:
-            self.sleep(waittime)
-        if query_type not in self._query_timestamps:
-            self._query_timestamps[query_type] = [time.monotonic()]
-        else:
-            self._query_timestamps[query_type].append(time.monotonic())
+
+    def _load_state(self, current_time: float) -> None:
+        """Catch up with the state of the rate limits that is kept elsewhere, e.g. in a file, without recording
+        anything. Called by :meth:`QueryEstimate.simulate` before simulating queries."""
+
+    def _track_query(self, query_type: str, timestamp: float) -> None:
+        with self._lock:
+            self._sliding_windows(query_type).append(timestamp)
+            if query_type not in ['iphone', 'other']:
+                self._sliding_windows(None).append(timestamp)
 
     def handle_429(self, query_type: str) -> None:
         """This method is called to handle a 429 Too Many Requests response.
 
         It calls :meth:`RateController.query_waittime` to determine the time needed to wait and then calls
         :meth:`RateController.sleep` to wait until we can repeat the same request."""
-        current_time = time.monotonic()
+        start = time.monotonic()
+        waittime = self._report_429(query_type)
+        if waittime > 0:
+            self._wait(waittime)
+        self._record_429_wait(time.monotonic() - start)
+
+    def close(self) -> None:
+        """This method is called when the context is closed.
+
+        .. versionadded:: 4.15"""
+
+    def _report_429(self, query_type: str) -> float:
+        """Reports a 429 Too Many Requests response and returns the time to wait until the request can be repeated."""
+        with self._statistics_lock:
+            self._429_counts[query_type] = self._429_counts.get(query_type, 0) + 1
+        current_time = self._clock()
         waittime = self.query_waittime(query_type, current_time, True)
         assert waittime >= 0
         self._dump_query_timestamps(current_time, query_type)
@@ -869,5 +1521,111 @@ class RateController:
             self._context.error("The request will be retried in {}, at {:%H:%M}."
                                 .format(formatted_waittime, datetime.now() + timedelta(seconds=waittime)),
                                 repeat_at_end=False)
-        if waittime > 0:
-            self.sleep(waittime)
+        return waittime
+
+
+class QueryPriority(IntEnum):
+    """Priorities of queries, used by :class:`QueryScheduler`; lower values are more urgent.
+
+    .. versionadded:: 4.15"""
+    STORY = 0
+    """Stories and highlights, which expire."""
+    METADATA = 1
+    """Metadata of profiles and posts."""
+    POSTS = 2
+    """Pages of posts and other lists, and all queries not classified otherwise."""
+    COMMENTS = 3
+    """Comments, their answers and likes."""
+
+
+DEFAULT_QUERY_PRIORITIES: Dict[str, int] = {
+    # stories and highlights
+    'd15efd8c0c5b23f0ef71f18bf363c704': QueryPriority.STORY,
+    '303a4ae99711322310f25250d988f3b7': QueryPriority.STORY,
+    '45246d3fe16ccc6577e0bd297a5db1ab': QueryPriority.STORY,
+    # profile and post metadata
+    'iphone': QueryPriority.METADATA,
+    '8845758582119845': QueryPriority.METADATA,
+    # comments, answers to comments and likes
+    '97b41c52301f77ce508f55e66d17620e': QueryPriority.COMMENTS,
+    '51fdd02b67508306ad4484ff574a0b62': QueryPriority.COMMENTS,
+    '1cb6ec562846122743b61e492c85999f': QueryPriority.COMMENTS,
+}
+"""Priorities of query types, i.e. ``query_hash`` or ``doc_id`` of GraphQL queries, ``'iphone'`` or ``'other'``, that
+are not :attr:`QueryPriority.POSTS`."""
+
+
+class QueryScheduler:
+    """
+    Decides the order of concurrent queries of an :class:`InstaloaderContext`, e.g. of multiple threads, when the rate
+    limit budget is tight.
+
+    Of the waiting queries, the one with the highest priority (lowest value) among those that the
+    :class:`RateController` allows to be done now goes first, so that e.g. a page of comments does not delay fetching a
+    story that is about to expire. Queries of equal priority are done in the order they arrived. If no query may be done
+    now, the one that may be done first waits in :meth:`RateController.wait_before_query`, while the others wait for
+    the rate controller to allow them.
+
+    The priority of a query is the one set with :meth:`InstaloaderContext.query_priority`, or otherwise the one of its
+    query type in *priorities*, defaulting to :attr:`QueryPriority.POSTS`.
+
+    :param rate_controller: The :class:`RateController` that limits the queries.
+    :param priorities: Priorities per query type, overriding :data:`DEFAULT_QUERY_PRIORITIES`.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, rate_controller: RateController, priorities: Optional[Dict[str, int]] = None):
+        self._rate_controller = rate_controller
+        self.priorities = {**DEFAULT_QUERY_PRIORITIES, **(priorities or {})}
+        self._condition = threading.Condition()
+        self._waiting: List[Tuple[int, int, str]] = []
+        self._counter = itertools.count()
+        # number of queries waiting within RateController.wait_before_query()
+        self._waiting_for_rate_controller = 0
+
+    def priority(self, query_type: str) -> int:
+        """Priority of queries of given type."""
+        return self.priorities.get(query_type, QueryPriority.POSTS)
+
+    def queue_depths(self) -> Dict[int, int]:
+        """Number of waiting queries per priority."""
+        with self._condition:
+            return dict(Counter(priority for priority, _, _ in self._waiting))
+
+    def _choose(self) -> Tuple[Optional[Tuple[int, int, str]], Optional[float]]:
+        # Returns the waiting query to go next, or None, and how long to wait at most before choosing again.
+        if len(self._waiting) == 1 and not self._waiting_for_rate_controller:
+            # no need to ask the rate controller if there is no competition
+            return self._waiting[0], None
+        current_time = self._rate_controller._clock()  # pylint:disable=protected-access
+        waittimes = [(self._rate_controller.query_waittime(entry[2], current_time), entry) for entry in self._waiting]
+        ready = [entry for waittime, entry in waittimes if waittime == 0]
+        if ready:
+            return min(ready), None
+        if not self._waiting_for_rate_controller:
+            return min(waittimes)[1], None
+        return None, min(waittime for waittime, _ in waittimes)
+
+    def wait_before_query(self, query_type: str, priority: int) -> None:
+        """Waits until it is the turn of the query with given type and priority, then calls
+        :meth:`RateController.wait_before_query`."""
+        entry = (priority, next(self._counter), query_type)
+        with self._condition:
+            self._waiting.append(entry)
+            try:
+                while True:
+                    chosen, timeout = self._choose()
+                    if chosen == entry:
+                        break
+                    self._condition.wait(timeout)
+            finally:
+                self._waiting.remove(entry)
+                self._condition.notify_all()
+            self._waiting_for_rate_controller += 1
+        try:
+            self._rate_controller.wait_before_query(query_type)
+        finally:
+            with self._condition:
+                self._waiting_for_rate_controller -= 1
+                self._condition.notify_all()
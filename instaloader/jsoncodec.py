@@ -0,0 +1,46 @@
+# Compact JSON encoding and decoding with the fastest available library: orjson or ujson if installed, otherwise the
+# standard library's json. Decoding errors are always raised as json.JSONDecodeError.
+
+import json
+from typing import Any, Union
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None  # type: ignore
+try:
+    import ujson  # type: ignore
+except ImportError:
+    ujson = None  # type: ignore
+
+backend = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+"""Name of the library that is used: ``'orjson'``, ``'ujson'`` or ``'json'``."""
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Decode JSON given as UTF-8 encoded bytes or as str."""
+    # pylint:disable=no-member
+    try:
+        if orjson is not None:
+            return orjson.loads(data)
+        if ujson is not None:
+            return ujson.loads(data)
+    except ValueError:
+        # e.g. escaped lone surrogates, as in some captions and comments, which only the standard library accepts;
+        # it raises json.JSONDecodeError if the data is invalid indeed
+        pass
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode to compact, UTF-8 encoded JSON."""
+    # pylint:disable=no-member
+    try:
+        if orjson is not None:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        if ujson is not None:
+            return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode()
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode()
+    except (TypeError, ValueError):
+        # strings with lone surrogates are not valid UTF-8, but can be written as \udXXX escapes
+        return json.dumps(obj, separators=(',', ':')).encode()
@@ -1,4 +1,5 @@
 import configparser
+import threading
 from datetime import datetime, timezone
 from typing import Optional
 from os.path import dirname
@@ -8,7 +9,8 @@ from os import makedirs
 class LatestStamps:
     """LatestStamps class.
 
-    Convenience class for retrieving and storing data from the :option:`--latest-stamps` file.
+    Convenience class for retrieving and storing data from the :option:`--latest-stamps` file. It may be used by
+    concurrent threads.
 
     :param latest_stamps_file: path to file.
 
@@ -16,6 +18,8 @@ class LatestStamps:
     PROFILE_ID = 'profile-id'
     PROFILE_PIC = 'profile-pic'
     POST_TIMESTAMP = 'post-timestamp'
+    POST_ID = 'post-id'
+    POST_MEDIACOUNT = 'post-mediacount'
     TAGGED_TIMESTAMP = 'tagged-timestamp'
     IGTV_TIMESTAMP = 'igtv-timestamp'
     REELS_TIMESTAMP = 'reels-timestamp'
@@ -26,6 +30,8 @@ class LatestStamps:
         self.file = latest_stamps_file
         self.data = configparser.ConfigParser()
         self.data.read(latest_stamps_file)
+        # held while changing and saving the data, e.g. by profiles downloaded concurrently
+        self._lock = threading.RLock()
 
     def _save(self):
         if dn := dirname(self.file):
@@ -46,20 +52,22 @@ class LatestStamps:
 
     def save_profile_id(self, profile_name: str, profile_id: int):
         """Stores ID of profile."""
-        self._ensure_section(profile_name)
-        self.data.set(profile_name, self.PROFILE_ID, str(profile_id))
-        self._save()
+        with self._lock:
+            self._ensure_section(profile_name)
+            self.data.set(profile_name, self.PROFILE_ID, str(profile_id))
+            self._save()
 
     def rename_profile(self, old_profile: str, new_profile: str):
         """Renames a profile."""
-        self._ensure_section(new_profile)
-        for option in [self.PROFILE_ID, self.PROFILE_PIC, self.POST_TIMESTAMP,
-                       self.TAGGED_TIMESTAMP, self.IGTV_TIMESTAMP, self.STORY_TIMESTAMP]:
-            if self.data.has_option(old_profile, option):
-                value = self.data.get(old_profile, option)
-                self.data.set(new_profile, option, value)
-        self.data.remove_section(old_profile)
-        self._save()
+        with self._lock:
+            self._ensure_section(new_profile)
+            for option in [self.PROFILE_ID, self.PROFILE_PIC, self.POST_TIMESTAMP, self.POST_ID, self.POST_MEDIACOUNT,
+                           self.TAGGED_TIMESTAMP, self.IGTV_TIMESTAMP, self.STORY_TIMESTAMP]:
+                if self.data.has_option(old_profile, option):
+                    value = self.data.get(old_profile, option)
+                    self.data.set(new_profile, option, value)
+            self.data.remove_section(old_profile)
+            self._save()
 
     def _get_timestamp(self, section: str, key: str) -> datetime:
         try:
@@ -68,9 +76,10 @@ class LatestStamps:
             return datetime.fromtimestamp(0, timezone.utc)
 
     def _set_timestamp(self, section: str, key: str, timestamp: datetime):
-        self._ensure_section(section)
-        self.data.set(section, key, timestamp.strftime(self.ISO_FORMAT))
-        self._save()
+        with self._lock:
+            self._ensure_section(section)
+            self.data.set(section, key, timestamp.strftime(self.ISO_FORMAT))
+            self._save()
 
     def get_last_post_timestamp(self, profile_name: str) -> datetime:
         """Returns timestamp of last download of a profile's posts."""
@@ -80,6 +89,34 @@ class LatestStamps:
         """Sets timestamp of last download of a profile's posts."""
         self._set_timestamp(profile_name, self.POST_TIMESTAMP, timestamp)
 
+    def get_last_post_id(self, profile_name: str) -> Optional[int]:
+        """Returns the media ID of the newest post of a profile at its last download, or None.
+
+        .. versionadded:: 4.15"""
+        try:
+            return self.data.getint(profile_name, self.POST_ID)
+        except (configparser.Error, ValueError):
+            return None
+
+    def get_last_post_mediacount(self, profile_name: str) -> Optional[int]:
+        """Returns the number of posts of a profile at its last download, or None.
+
+        .. versionadded:: 4.15"""
+        try:
+            return self.data.getint(profile_name, self.POST_MEDIACOUNT)
+        except (configparser.Error, ValueError):
+            return None
+
+    def set_last_post(self, profile_name: str, post_id: int, mediacount: int):
+        """Stores the media ID of the newest post and the number of posts of a profile at its last download.
+
+        .. versionadded:: 4.15"""
+        with self._lock:
+            self._ensure_section(profile_name)
+            self.data.set(profile_name, self.POST_ID, str(post_id))
+            self.data.set(profile_name, self.POST_MEDIACOUNT, str(mediacount))
+            self._save()
+
     def get_last_tagged_timestamp(self, profile_name: str) -> datetime:
         """Returns timestamp of last download of a profile's tagged posts."""
         return self._get_timestamp(profile_name, self.TAGGED_TIMESTAMP)
@@ -121,6 +158,7 @@ class LatestStamps:
 
     def set_profile_pic(self, profile_name: str, profile_pic: str):
         """Sets filename of profile's last downloaded profile pic."""
-        self._ensure_section(profile_name)
-        self.data.set(profile_name, self.PROFILE_PIC, profile_pic)
-        self._save()
+        with self._lock:
+            self._ensure_section(profile_name)
+            self.data.set(profile_name, self.PROFILE_PIC, profile_pic)
+            self._save()
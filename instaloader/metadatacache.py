@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from . import jsoncodec
+
+DEFAULT_TTL = 0.0
+"""Default time in seconds that a cached response is used for. Pages of posts, comments, stories etc. change between
+runs, so only the queries in :data:`DEFAULT_TTLS` are cached by default."""
+
+DEFAULT_TTLS: Dict[str, float] = {
+    # post metadata by shortcode
+    '8845758582119845': 3600.0,
+    'api/v1/media/{}/info/': 3600.0,
+    # profile metadata by username or userid
+    'api/v1/users/web_profile_info/': 3600.0,
+    'api/v1/users/{}/info/': 3600.0,
+    # hashtag metadata
+    'api/v1/tags/web_info/': 3600.0,
+}
+"""Default times in seconds that cached responses are used for, per query type or path, overriding
+:data:`DEFAULT_TTL`."""
+
+
+class MetadataCache:
+    """
+    Persistent cache of JSON responses of :meth:`InstaloaderContext.get_json`, stored in an SQLite database within
+    the given directory.
+
+    Responses are cached per host, path, parameters and logged-in user. A response is used for a time-to-live that
+    depends on its path, without query string and with numeric path segments replaced by ``{}``, e.g.
+    ``'api/v1/users/{}/info/'``, or else on its query type, i.e. on the ``query_hash`` or ``doc_id`` of GraphQL
+    queries, ``'iphone'`` for queries to the iPhone API, or ``'other'`` for other queries to www.instagram.com.
+    Queries with a TTL of 0 are never cached, which by default are all but the profile, post and hashtag metadata
+    lookups listed in :data:`DEFAULT_TTLS`. When the cached responses exceed *max_size* bytes, the
+    least-recently-used ones are evicted.
+
+    Queries that are answered from the cache are neither delayed nor counted by the :class:`RateController`.
+
+    To use it, assign it to :attr:`InstaloaderContext.metadata_cache`, or pass the directory as `metadata_cache` to
+    :class:`Instaloader`::
+
+       L = instaloader.Instaloader(metadata_cache='.instaloader-cache')
+
+    :param directory: Directory to store the cache database in; it is created if it does not exist.
+    :param ttls: Time-to-live in seconds per query type or path, overriding :data:`DEFAULT_TTLS`.
+    :param default_ttl: Time-to-live in seconds for queries that are not in *ttls*.
+    :param max_size: Maximum total size of the (compressed) cached responses, in bytes.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, directory: str, ttls: Optional[Dict[str, float]] = None, default_ttl: float = DEFAULT_TTL,
+                 max_size: int = 256 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.default_ttl = default_ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'metadata-cache.sqlite3'), check_same_thread=False)
+        # the cache can be rebuilt anytime, so trade durability for fewer syncs
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses "
+                             "(key TEXT PRIMARY KEY, expires REAL, accessed REAL, size INTEGER, data BLOB)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+            self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(username: Optional[str], host: str, path: str, params: Dict[str, Any]) -> str:
+        """Cache key of a query by the given user (or None if not logged in)."""
+        return hashlib.sha256(json.dumps([username, host, path, sorted(params.items())],
+                                         default=str).encode()).hexdigest()
+
+    def ttl(self, query_type: str, path: str = '') -> float:
+        """Time-to-live in seconds of responses of given query type and path."""
+        path = re.sub(r'(?<=/)\d+(?=/)', '{}', path.split('?', 1)[0])
+        return self.ttls.get(path, self.ttls.get(query_type, self.default_ttl))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached, unexpired response with given key, or None."""
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT data FROM responses WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return jsoncodec.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, query_type: str, response: Dict[str, Any], path: str = '') -> None:
+        """Cache the given response, unless its query type and path have a TTL of 0."""
+        ttl = self.ttl(query_type, path)
+        if ttl <= 0:
+            return
+        data = zlib.compress(jsoncodec.dumps(response), 1)
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._size += len(data) - (row[0] if row is not None else 0)
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                             (key, now + ttl, now, len(data), data))
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        evicted = []
+        for old_key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if self._size <= self.max_size:
+                break
+            evicted.append((old_key,))
+            self._size -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self) -> None:
+        """Close the cache database."""
+        with self._lock:
+            self._db.close()
@@ -2,13 +2,20 @@ import base64
 import hashlib
 import json
 import os
+import time
+from concurrent.futures import Future
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from lzma import LZMAError
-from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, TypeVar
+from typing import (TYPE_CHECKING, Any, AsyncIterable, AsyncIterator, Callable, Dict, Generic, Iterable, Iterator,
+                    List, NamedTuple, Optional, Tuple, TypeVar, Union, cast)
 
-from .exceptions import AbortDownloadException, InvalidArgumentException
+from .exceptions import AbortDownloadException, InvalidArgumentException, QueryReturnedBadRequestException
 from .instaloadercontext import InstaloaderContext
+from .sectioniterator import FrozenSectionIterator, _BaseSectionIterator
+
+if TYPE_CHECKING:
+    from .asynccontext import AsyncInstaloaderContext
 
 class FrozenNodeIterator(NamedTuple):
     query_hash: Optional[str]
@@ -20,6 +27,9 @@ class FrozenNodeIterator(NamedTuple):
     remaining_data: Optional[Dict]
     first_node: Optional[Dict]
     doc_id: Optional[str]
+    remaining_ids: Optional[List[Any]] = None
+    page_cursor: Optional[str] = None
+    page_length: Optional[int] = None
 FrozenNodeIterator.query_hash.__doc__ = """The GraphQL ``query_hash`` parameter."""
 FrozenNodeIterator.query_variables.__doc__ = """The GraphQL ``query_variables`` parameter."""
 FrozenNodeIterator.query_referer.__doc__ = """The HTTP referer used for the GraphQL query."""
@@ -27,49 +37,30 @@ FrozenNodeIterator.context_username.__doc__ = """The username who created the it
 FrozenNodeIterator.total_index.__doc__ = """Number of items that have already been returned."""
 FrozenNodeIterator.best_before.__doc__ = """Date when parts of the stored nodes might have expired."""
 FrozenNodeIterator.remaining_data.__doc__ = \
-    """The already-retrieved, yet-unprocessed ``edges`` and the ``page_info`` at time of freezing."""
-FrozenNodeIterator.first_node.__doc__ = """Node data of the first item, if an item has been produced."""
+    """The already-retrieved, yet-unprocessed ``edges`` and the ``page_info`` at time of freezing, or ``None`` if
+    :attr:`remaining_ids` is given instead."""
+FrozenNodeIterator.first_node.__doc__ = """Node data of the first item, if an item has been produced. Possibly only
+its scalar fields."""
 FrozenNodeIterator.doc_id.__doc__ = """The GraphQL ``doc_id`` parameter."""
+FrozenNodeIterator.remaining_ids.__doc__ = """The ``id`` of the yet-unprocessed nodes of the page at time of freezing,
+whose data is queried again when resuming, or ``None`` if :attr:`remaining_data` is given instead.
 
-T = TypeVar('T')
-
-
-class NodeIterator(Iterator[T]):
-    """
-    Iterate the nodes within edges in a GraphQL pagination. Instances of this class are returned by many (but not all)
-    of Instaloader's :class:`Post`-returning functions (such as :meth:`Profile.get_posts` etc.).
-
-    What makes this iterator special is its ability to freeze/store its current state, e.g. to interrupt an iteration,
-    and later thaw/resume from where it left off.
-
-    You can freeze a NodeIterator with :meth:`NodeIterator.freeze`::
-
-       post_iterator = profile.get_posts()
-       try:
-           for post in post_iterator:
-               do_something_with(post)
-       except KeyboardInterrupt:
-           save("resume_information.json", post_iterator.freeze())
-
-    and later reuse it with :meth:`NodeIterator.thaw` on an equally-constructed NodeIterator::
+.. versionadded:: 4.15"""
+FrozenNodeIterator.page_cursor.__doc__ = """The cursor that the page of :attr:`remaining_ids` has been queried with,
+or ``None`` for the first page.
 
-       post_iterator = profile.get_posts()
-       post_iterator.thaw(load("resume_information.json"))
+.. versionadded:: 4.15"""
+FrozenNodeIterator.page_length.__doc__ = """The page length that the page of :attr:`remaining_ids` has been queried
+with, to query it again with the same length, or ``None`` for the default length.
 
-    (an appropriate method to load and save the :class:`FrozenNodeIterator` is e.g.
-    :func:`load_structure_from_file` and :func:`save_structure_to_file`.)
+.. versionadded:: 4.15"""
 
-    A :class:`FrozenNodeIterator` can only be thawn with a matching NodeIterator, i.e. a NodeIterator instance that has
-    been constructed with the same parameters as the instance that is represented by the :class:`FrozenNodeIterator` in
-    question. This is to ensure that an iteration cannot be resumed in a wrong, unmatching loop. As a quick way to
-    distinguish iterators that are saved e.g. in files, there is the :attr:`NodeIterator.magic` string: Two
-    NodeIterators are matching if and only if they have the same magic.
+T = TypeVar('T')
 
-    See also :func:`resumable_iteration` for a high-level context manager that handles a resumable iteration.
 
-    .. versionchanged: 4.13
-       Included support for `doc_id`-based queries (using POST method).
-    """
+class _BaseNodeIterator(Generic[T]):
+    # State, pagination and freezing shared by NodeIterator and AsyncNodeIterator, which only differ in how they
+    # query the next page.
 
     _graphql_page_length = 12
     _shelf_life = timedelta(days=29)
@@ -93,59 +84,98 @@ class NodeIterator(Iterator[T]):
         self._query_referer = query_referer
         self._page_index = 0
         self._total_index = 0
+        self._data: Optional[Dict] = None
+        # cursor that the current page has been queried with, unknown after thawing a FrozenNodeIterator that only has
+        # the remaining_data
+        self._page_cursor: Optional[str] = None
+        self._page_cursor_known = True
+        # page length that the current page has been queried with, or None if the query had no page length
+        self._current_page_length: Optional[int] = None
+        # page cursor, ids of the remaining nodes and page length of a thawn compact FrozenNodeIterator, until the
+        # page is queried again
+        self._thawn_page: Optional[Tuple[Optional[str], List[Any], Optional[int]]] = None
+        self._best_before: Optional[datetime] = None
         if first_data is not None:
             self._data = first_data
-            self._best_before = datetime.now() + NodeIterator._shelf_life
-        else:
-            self._data = self._query()
+            self._best_before = datetime.now() + _BaseNodeIterator._shelf_life
         self._first_node: Optional[Dict] = None
         self._is_first = is_first
+        # called before producing each item, e.g. to save a checkpoint, see resumable_iteration()
+        self._checkpoint_hook: Optional[Callable[[], None]] = None
 
-    def _query(self, after: Optional[str] = None) -> Dict:
-        if self._doc_id is not None:
-            return self._query_doc_id(self._doc_id, after)
-        else:
-            assert self._query_hash is not None
-            return self._query_query_hash(self._query_hash, after)
+    def _checkpoint(self) -> None:
+        if self._checkpoint_hook is not None:
+            self._checkpoint_hook()
 
-    def _query_doc_id(self, doc_id: str, after: Optional[str] = None) -> Dict:
-        pagination_variables: Dict[str, Any] = {'__relay_internal__pv__PolarisFeedShareMenurelayprovider': False}
-        if after is not None:
-            pagination_variables['after'] = after
-            pagination_variables['before'] = None
-            pagination_variables['first'] = 12
-            pagination_variables['last'] = None
-        data = self._edge_extractor(
-            self._context.doc_id_graphql_query(
-                doc_id, {**self._query_variables, **pagination_variables}, self._query_referer
-            )
-        )
-        self._best_before = datetime.now() + NodeIterator._shelf_life
-        return data
+    def _page_length(self, query_id: str) -> int:
+        page_lengths = self._context.page_lengths
+        return page_lengths.length(query_id) if page_lengths is not None else _BaseNodeIterator._graphql_page_length
 
-    def _query_query_hash(self, query_hash: str, after: Optional[str] = None) -> Dict:
-        pagination_variables: Dict[str, Any] = {'first': NodeIterator._graphql_page_length}
+    def _query_arguments(self, after: Optional[str] = None,
+                         page_length: Optional[int] = None) -> Tuple[str, Dict[str, Any]]:
+        """Returns ``(doc_id, variables)`` or ``(query_hash, variables)`` of the query for the page after *after*,
+        with given page length or otherwise the adaptive one."""
+        if self._doc_id is not None:
+            pagination_variables: Dict[str, Any] = {'__relay_internal__pv__PolarisFeedShareMenurelayprovider': False}
+            if after is not None:
+                pagination_variables['after'] = after
+                pagination_variables['before'] = None
+                pagination_variables['first'] = page_length or self._page_length(self._doc_id)
+                pagination_variables['last'] = None
+            return self._doc_id, {**self._query_variables, **pagination_variables}
+        assert self._query_hash is not None
+        pagination_variables = {'first': page_length or self._page_length(self._query_hash)}
         if after is not None:
             pagination_variables['after'] = after
-        data = self._edge_extractor(
-            self._context.graphql_query(
-                query_hash, {**self._query_variables, **pagination_variables}, self._query_referer
-            )
-        )
-        self._best_before = datetime.now() + NodeIterator._shelf_life
+        return self._query_hash, {**self._query_variables, **pagination_variables}
+
+    def _shorten_page(self, query_id: str, variables: Dict[str, Any]) -> bool:
+        """Reports a 400 Bad Request response to the :attr:`InstaloaderContext.page_lengths`. Returns True if the page
+        is to be queried again with a shorter length."""
+        page_lengths = self._context.page_lengths
+        if page_lengths is None or 'first' not in variables:
+            return False
+        if not page_lengths.failed(query_id, variables['first']):
+            return False
+        self._context.error("HTTP Error 400 (Bad Request) on GraphQL Query. Retrying with shorter page length.",
+                            repeat_at_end=False)
+        return True
+
+    def _page_served(self, query_id: str, variables: Dict[str, Any], response: Dict[str, Any]) -> bool:
+        """Reports the number of served items to the :attr:`InstaloaderContext.page_lengths`. Returns True if the
+        page is empty although there are more items, and it is to be queried again with a shorter length."""
+        page_lengths = self._context.page_lengths
+        if page_lengths is None or 'first' not in variables:
+            return False
+        data = self._edge_extractor(response)
+        has_next_page = bool(data.get('page_info', {}).get('has_next_page'))
+        if not data['edges'] and has_next_page:
+            return page_lengths.failed(query_id, variables['first'])
+        page_lengths.served(query_id, variables['first'], len(data['edges']), has_next_page)
+        return False
+
+    def _extract_page(self, response: Dict[str, Any]) -> Dict:
+        data = self._edge_extractor(response)
+        self._best_before = datetime.now() + _BaseNodeIterator._shelf_life
         return data
 
-    def __iter__(self):
-        return self
+    def _next_cursor(self) -> Optional[str]:
+        """Returns the cursor of the next page if the current page is exhausted and there is a next page."""
+        assert self._data is not None
+        if self._data.get('page_info', {}).get('has_next_page'):
+            return self._data['page_info']['end_cursor']
+        return None
 
-    def __next__(self) -> T:
+    def _take_node(self) -> Tuple[bool, Optional[T]]:
+        """Returns ``(True, item)`` for the next item of the current page, or ``(False, None)`` if it is exhausted."""
+        assert self._data is not None
         if self._page_index < len(self._data['edges']):
             node = self._data['edges'][self._page_index]['node']
             page_index, total_index = self._page_index, self._total_index
             try:
                 self._page_index += 1
                 self._total_index += 1
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, AbortDownloadException):
                 self._page_index, self._total_index = page_index, total_index
                 raise
             item = self._node_wrapper(node)
@@ -155,19 +185,65 @@ class NodeIterator(Iterator[T]):
             else:
                 if self._first_node is None:
                     self._first_node = node
-            return item
-        if self._data.get('page_info', {}).get('has_next_page'):
-            query_response = self._query(self._data['page_info']['end_cursor'])
-            if self._data['edges'] != query_response['edges'] and len(query_response['edges']) > 0:
-                page_index, data = self._page_index, self._data
-                try:
-                    self._page_index = 0
-                    self._data = query_response
-                except KeyboardInterrupt:
-                    self._page_index, self._data = page_index, data
-                    raise
-                return self.__next__()
-        raise StopIteration()
+            return True, item
+        return False, None
+
+    def _turn_page(self, query_response: Dict, cursor: str, page_length: Optional[int]) -> bool:
+        """Switches to the given next page, queried with given cursor and page length, and returns True, unless it is
+        empty or a repetition of the current one."""
+        assert self._data is not None
+        if self._data['edges'] != query_response['edges'] and len(query_response['edges']) > 0:
+            page_index, data, page_cursor, page_cursor_known, current_page_length = (
+                self._page_index, self._data, self._page_cursor, self._page_cursor_known, self._current_page_length
+            )
+            try:
+                self._page_index = 0
+                self._data = query_response
+                self._page_cursor = cursor
+                self._page_cursor_known = True
+                self._current_page_length = page_length
+            except (KeyboardInterrupt, AbortDownloadException):
+                (self._page_index, self._data, self._page_cursor, self._page_cursor_known,
+                 self._current_page_length) = (page_index, data, page_cursor, page_cursor_known, current_page_length)
+                raise
+            return True
+        return False
+
+    def _thawn_page_query(self) -> Optional[Tuple[Optional[str], int]]:
+        """Cursor and page length to query the page of the thawn iterator again with, or None if the current page is
+        that page, i.e. the first page, queried with the same length."""
+        assert self._thawn_page is not None
+        page_cursor, _, page_length = self._thawn_page
+        if page_cursor is None and self._data is not None and self._current_page_length == page_length:
+            return None
+        # pages of compact FrozenNodeIterators without page length have been queried with the default length
+        return page_cursor, page_length or _BaseNodeIterator._graphql_page_length
+
+    def _restore_thawn_page(self, page: Dict, page_length: Optional[int]) -> None:
+        """Continues with the nodes of the given page that were remaining when the thawn iterator was frozen. The
+        page has been queried again with the cursor and the page length of the frozen page, as a page of another
+        length would end elsewhere."""
+        assert self._thawn_page is not None
+        self._page_cursor, remaining_ids, _ = self._thawn_page
+        self._current_page_length = page_length
+        remaining = set(remaining_ids)
+        self._data = {**page, 'edges': [edge for edge in page['edges'] if edge['node'].get('id') in remaining]}
+        self._thawn_page = None
+
+    def _project_first_node(self) -> Optional[Dict]:
+        """The scalar fields of the first node, if they suffice to produce the :attr:`first_item`, or else the whole
+        node."""
+        if self._first_node is None:
+            return None
+        projection = {key: value for key, value in self._first_node.items()
+                      if value is None or isinstance(value, (str, int, float, bool))}
+        try:
+            item = self._node_wrapper(projection)
+            if self._is_first is not None:
+                self._is_first(item, item)
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return self._first_node
+        return projection
 
     @property
     def count(self) -> Optional[int]:
@@ -205,14 +281,28 @@ class NodeIterator(Iterator[T]):
 
     @staticmethod
     def page_length() -> int:
-        return NodeIterator._graphql_page_length
+        return _BaseNodeIterator._graphql_page_length
 
     def freeze(self) -> FrozenNodeIterator:
-        """Freeze the iterator for later resuming."""
+        """Freeze the iterator for later resuming.
+
+        .. versionchanged:: 4.15
+           Rather than the data of the remaining nodes, only their ids are stored if possible, see
+           :attr:`FrozenNodeIterator.remaining_ids`."""
         remaining_data = None
-        if self._data is not None:
-            remaining_data = {**self._data,
-                              'edges': (self._data['edges'][(max(self._page_index - 1, 0)):])}
+        remaining_ids = None
+        page_cursor = None
+        page_length = None
+        if self._thawn_page is not None:
+            page_cursor, remaining_ids, page_length = self._thawn_page
+        elif self._data is not None:
+            remaining_edges = self._data['edges'][(max(self._page_index - 1, 0)):]
+            if self._page_cursor_known and all(edge['node'].get('id') is not None for edge in remaining_edges):
+                remaining_ids = [edge['node']['id'] for edge in remaining_edges]
+                page_cursor = self._page_cursor
+                page_length = self._current_page_length
+            else:
+                remaining_data = {**self._data, 'edges': remaining_edges}
         return FrozenNodeIterator(
             query_hash=self._query_hash,
             query_variables=self._query_variables,
@@ -221,8 +311,11 @@ class NodeIterator(Iterator[T]):
             total_index=max(self.total_index - 1, 0),
             best_before=self._best_before.timestamp() if self._best_before else None,
             remaining_data=remaining_data,
-            first_node=self._first_node,
+            first_node=self._project_first_node(),
             doc_id=self._doc_id,
+            remaining_ids=remaining_ids,
+            page_cursor=page_cursor,
+            page_length=page_length,
         )
 
     def thaw(self, frozen: FrozenNodeIterator) -> None:
@@ -245,23 +338,234 @@ class NodeIterator(Iterator[T]):
             raise InvalidArgumentException("Mismatching resume information.")
         if not frozen.best_before:
             raise InvalidArgumentException("\"best before\" date missing.")
-        if frozen.remaining_data is None:
+        if frozen.remaining_data is None and frozen.remaining_ids is None:
             raise InvalidArgumentException("\"remaining_data\" missing.")
         self._total_index = frozen.total_index
         self._best_before = datetime.fromtimestamp(frozen.best_before)
-        self._data = frozen.remaining_data
+        if frozen.remaining_ids is not None:
+            # the remaining nodes are restored when the page is queried again, when the next item is requested
+            self._thawn_page = (frozen.page_cursor, frozen.remaining_ids, frozen.page_length)
+        else:
+            self._data = frozen.remaining_data
+            self._page_cursor_known = False
         if frozen.first_node is not None:
             self._first_node = frozen.first_node
 
 
+class NodeIterator(_BaseNodeIterator[T], Iterator[T]):
+    """
+    Iterate the nodes within edges in a GraphQL pagination. Instances of this class are returned by many (but not all)
+    of Instaloader's :class:`Post`-returning functions (such as :meth:`Profile.get_posts` etc.).
+
+    What makes this iterator special is its ability to freeze/store its current state, e.g. to interrupt an iteration,
+    and later thaw/resume from where it left off.
+
+    You can freeze a NodeIterator with :meth:`NodeIterator.freeze`::
+
+       post_iterator = profile.get_posts()
+       try:
+           for post in post_iterator:
+               do_something_with(post)
+       except KeyboardInterrupt:
+           save("resume_information.json", post_iterator.freeze())
+
+    and later reuse it with :meth:`NodeIterator.thaw` on an equally-constructed NodeIterator::
+
+       post_iterator = profile.get_posts()
+       post_iterator.thaw(load("resume_information.json"))
+
+    (an appropriate method to load and save the :class:`FrozenNodeIterator` is e.g.
+    :func:`load_structure_from_file` and :func:`save_structure_to_file`.)
+
+    A :class:`FrozenNodeIterator` can only be thawn with a matching NodeIterator, i.e. a NodeIterator instance that has
+    been constructed with the same parameters as the instance that is represented by the :class:`FrozenNodeIterator` in
+    question. This is to ensure that an iteration cannot be resumed in a wrong, unmatching loop. As a quick way to
+    distinguish iterators that are saved e.g. in files, there is the :attr:`NodeIterator.magic` string: Two
+    NodeIterators are matching if and only if they have the same magic.
+
+    See also :func:`resumable_iteration` for a high-level context manager that handles a resumable iteration.
+
+    .. versionchanged: 4.13
+       Included support for `doc_id`-based queries (using POST method).
+
+    .. versionchanged:: 4.15
+       :class:`AsyncNodeIterator` is the asynchronous counterpart of this class. The next page is queried in the
+       background if :attr:`InstaloaderContext.prefetch_pages` is enabled.
+    """
+
+    def __init__(self,
+                 context: InstaloaderContext,
+                 query_hash: Optional[str],
+                 edge_extractor: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 node_wrapper: Callable[[Dict], T],
+                 query_variables: Optional[Dict[str, Any]] = None,
+                 query_referer: Optional[str] = None,
+                 first_data: Optional[Dict[str, Any]] = None,
+                 is_first: Optional[Callable[[T, Optional[T]], bool]] = None,
+                 doc_id: Optional[str] = None):
+        super().__init__(context, query_hash, edge_extractor, node_wrapper, query_variables, query_referer,
+                         first_data, is_first, doc_id)
+        # cursor and future of the response of the page that is queried in the background
+        self._prefetched: Optional[Tuple[str, Future]] = None
+        if self._data is None:
+            self._data, self._current_page_length = self._query()
+
+    def _query_response(self, after: Optional[str] = None,
+                        page_length: Optional[int] = None) -> Tuple[Dict[str, Any], Optional[int]]:
+        """Returns the response to the query for the page after *after* and the page length it has been queried
+        with. Given a page length, the page is queried with exactly that length."""
+        while True:
+            query_id, variables = self._query_arguments(after, page_length)
+            try:
+                if self._doc_id is not None:
+                    response = self._context.doc_id_graphql_query(query_id, variables, self._query_referer)
+                else:
+                    response = self._context.graphql_query(query_id, variables, self._query_referer)
+            except QueryReturnedBadRequestException:
+                if page_length is None and self._shorten_page(query_id, variables):
+                    continue
+                raise
+            if page_length is not None or not self._page_served(query_id, variables, response):
+                return response, variables.get('first')
+
+    def _query(self, after: Optional[str] = None, page_length: Optional[int] = None) -> Tuple[Dict, Optional[int]]:
+        # Uses the prefetched page if it is the requested one. As the prefetched page only becomes the current one
+        # here, freeze() never sees it, and a thawn iterator queries the page it needs itself.
+        prefetched, self._prefetched = self._prefetched, None
+        if prefetched is not None and prefetched[0] == after and page_length is None:
+            response, queried_page_length = prefetched[1].result()
+        else:
+            response, queried_page_length = self._query_response(after, page_length)
+        return self._extract_page(response), queried_page_length
+
+    def _cancel_prefetched(self) -> None:
+        # Cancels querying the prefetched page if it has not been started yet. A page that is already being queried is
+        # not waited for, e.g. when interrupted, as it is not part of the frozen state; it is used if the iteration
+        # goes on, and abandoned otherwise.
+        if self._prefetched is not None and self._prefetched[1].cancel():
+            self._prefetched = None
+
+    def _prefetch_next_page(self) -> None:
+        # pylint:disable=protected-access
+        cursor = self._next_cursor()
+        if cursor is None or (self._prefetched is not None and self._prefetched[0] == cursor):
+            return
+        query_id, _ = self._query_arguments(cursor)
+        future = self._context._prefetch(query_id, lambda: self._query_response(cursor))
+        if future is not None:
+            self._prefetched = (cursor, future)
+
+    def freeze(self) -> FrozenNodeIterator:
+        self._cancel_prefetched()
+        return super().freeze()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> T:
+        if self._thawn_page is not None:
+            thawn_page_query = self._thawn_page_query()
+            if thawn_page_query is not None:
+                self._restore_thawn_page(*self._query(*thawn_page_query))
+            else:
+                self._restore_thawn_page(cast(Dict, self._data), self._current_page_length)
+        self._checkpoint()
+        while True:
+            has_item, item = self._take_node()
+            if has_item:
+                if self._page_index == 1:
+                    self._prefetch_next_page()
+                return cast(T, item)
+            cursor = self._next_cursor()
+            if cursor is None:
+                raise StopIteration()
+            page, page_length = self._query(cursor)
+            if not self._turn_page(page, cursor, page_length):
+                raise StopIteration()
+
+
+class AsyncNodeIterator(_BaseNodeIterator[T], AsyncIterator[T]):
+    """
+    Asynchronous counterpart of :class:`NodeIterator`, querying the pages with an :class:`AsyncInstaloaderContext`::
+
+       async for post in AsyncNodeIterator(actx, ...):
+           do_something_with(post)
+
+    It takes the same arguments as :class:`NodeIterator`, except that *context* is an
+    :class:`AsyncInstaloaderContext`. Unless *first_data* is given, the first page is queried when the first item is
+    awaited. It can be frozen and thawn like a :class:`NodeIterator`, and both are matching if they have the same
+    :attr:`magic`.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self,
+                 context: 'AsyncInstaloaderContext',
+                 query_hash: Optional[str],
+                 edge_extractor: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 node_wrapper: Callable[[Dict], T],
+                 query_variables: Optional[Dict[str, Any]] = None,
+                 query_referer: Optional[str] = None,
+                 first_data: Optional[Dict[str, Any]] = None,
+                 is_first: Optional[Callable[[T, Optional[T]], bool]] = None,
+                 doc_id: Optional[str] = None):
+        super().__init__(context.context, query_hash, edge_extractor, node_wrapper, query_variables, query_referer,
+                         first_data, is_first, doc_id)
+        self._async_context = context
+
+    async def _query(self, after: Optional[str] = None,
+                     page_length: Optional[int] = None) -> Tuple[Dict, Optional[int]]:
+        while True:
+            query_id, variables = self._query_arguments(after, page_length)
+            try:
+                if self._doc_id is not None:
+                    response = await self._async_context.doc_id_graphql_query(query_id, variables,
+                                                                              self._query_referer)
+                else:
+                    response = await self._async_context.graphql_query(query_id, variables, self._query_referer)
+            except QueryReturnedBadRequestException:
+                if page_length is None and self._shorten_page(query_id, variables):
+                    continue
+                raise
+            if page_length is not None or not self._page_served(query_id, variables, response):
+                return self._extract_page(response), variables.get('first')
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> T:
+        if self._thawn_page is not None:
+            thawn_page_query = self._thawn_page_query()
+            if thawn_page_query is not None:
+                self._restore_thawn_page(*(await self._query(*thawn_page_query)))
+            else:
+                self._restore_thawn_page(cast(Dict, self._data), self._current_page_length)
+        if self._data is None:
+            self._data, self._current_page_length = await self._query()
+        self._checkpoint()
+        while True:
+            has_item, item = self._take_node()
+            if has_item:
+                return cast(T, item)
+            cursor = self._next_cursor()
+            if cursor is None:
+                raise StopAsyncIteration()
+            page, page_length = await self._query(cursor)
+            if not self._turn_page(page, cursor, page_length):
+                raise StopAsyncIteration()
+
+
 @contextmanager
 def resumable_iteration(context: InstaloaderContext,
-                        iterator: Iterable,
+                        iterator: Union[Iterable, AsyncIterable],
                         load: Callable[[InstaloaderContext, str], Any],
-                        save: Callable[[FrozenNodeIterator, str], None],
+                        save: Callable[[Union[FrozenNodeIterator, FrozenSectionIterator], str], None],
                         format_path: Callable[[str], str],
                         check_bbd: bool = True,
-                        enabled: bool = True) -> Iterator[Tuple[bool, int]]:
+                        enabled: bool = True,
+                        checkpoint_every: Optional[int] = None,
+                        checkpoint_interval: Optional[float] = None,
+                        before_checkpoint: Optional[Callable[[], None]] = None) -> Iterator[Tuple[bool, int]]:
     """
     High-level context manager to handle a resumable iteration that can be interrupted
     with a :class:`KeyboardInterrupt` or an :class:`AbortDownloadException`.
@@ -282,23 +586,39 @@ def resumable_iteration(context: InstaloaderContext,
 
     It yields a tuple (is_resuming, start_index).
 
-    When the passed iterator is not a :class:`NodeIterator`, it behaves as if ``resumable_iteration`` was not used,
-    just executing the inner body.
+    With `checkpoint_every` or `checkpoint_interval`, the iterator's state is also saved while iterating, so that the
+    iteration can be resumed even if the process is killed without being able to save it. The resume file is always
+    replaced atomically, so it is never left half-written.
+
+    A :class:`SectionIterator` or :class:`AsyncSectionIterator` is handled likewise, with a
+    :class:`FrozenSectionIterator`. When the passed iterator is none of these, it behaves as if
+    ``resumable_iteration`` was not used, just executing the inner body.
 
     :param context: The :class:`InstaloaderContext`.
-    :param iterator: The fresh :class:`NodeIterator`.
-    :param load: Loads a FrozenNodeIterator from given path. The object is ignored if it has a different type.
-    :param save: Saves the given FrozenNodeIterator to the given path.
+    :param iterator: The fresh :class:`NodeIterator`, :class:`AsyncNodeIterator`, :class:`SectionIterator` or
+       :class:`AsyncSectionIterator`.
+    :param load: Loads a FrozenNodeIterator (or FrozenSectionIterator) from given path. The object is ignored if it
+       has a different type.
+    :param save: Saves the given FrozenNodeIterator (or FrozenSectionIterator) to the given path.
     :param format_path: Returns the path to the resume file for the given magic.
     :param check_bbd: Whether to check the best before date and reject an expired FrozenNodeIterator.
     :param enabled: Set to False to disable all functionality and simply execute the inner body.
+    :param checkpoint_every: Save the iterator's state every that many items.
+    :param checkpoint_interval: Save the iterator's state when an item is produced at least that many seconds after
+       the last time it was saved.
+    :param before_checkpoint: Called before saving the iterator's state while iterating, to complete the work on the
+       items produced so far, e.g. pending downloads.
 
     .. versionchanged:: 4.7
        Also interrupt on :class:`AbortDownloadException`.
+    .. versionchanged:: 4.15
+       Also handle :class:`AsyncNodeIterator`, :class:`SectionIterator` and :class:`AsyncSectionIterator`. Added
+       `checkpoint_every`, `checkpoint_interval` and `before_checkpoint`.
     """
-    if not enabled or not isinstance(iterator, NodeIterator):
+    if not enabled or not isinstance(iterator, (NodeIterator, AsyncNodeIterator, _BaseSectionIterator)):
         yield False, 0
         return
+    frozen_type = FrozenSectionIterator if isinstance(iterator, _BaseSectionIterator) else FrozenNodeIterator
     is_resuming = False
     start_index = 0
     resume_file_path = format_path(iterator.magic)
@@ -306,7 +626,7 @@ def resumable_iteration(context: InstaloaderContext,
     if resume_file_exists:
         try:
             fni = load(context, resume_file_path)
-            if not isinstance(fni, FrozenNodeIterator):
+            if not isinstance(fni, frozen_type):
                 raise InvalidArgumentException("Invalid type.")
             if check_bbd and fni.best_before and datetime.fromtimestamp(fni.best_before) < datetime.now():
                 raise InvalidArgumentException("\"Best before\" date exceeded.")
@@ -316,14 +636,43 @@ def resumable_iteration(context: InstaloaderContext,
             context.log("Resuming from {}.".format(resume_file_path))
         except (InvalidArgumentException, LZMAError, json.decoder.JSONDecodeError, EOFError) as exc:
             context.error("Warning: Not resuming from {}: {}".format(resume_file_path, exc))
+    if checkpoint_every is not None or checkpoint_interval is not None:
+        last_checkpoint = (iterator.total_index, time.monotonic())
+
+        def checkpoint() -> None:
+            nonlocal last_checkpoint, resume_file_exists
+            last_index, last_time = last_checkpoint
+            if iterator.total_index == last_index or not (
+                    (checkpoint_every is not None and iterator.total_index - last_index >= checkpoint_every) or
+                    (checkpoint_interval is not None and time.monotonic() - last_time >= checkpoint_interval)):
+                return
+            if before_checkpoint is not None:
+                before_checkpoint()
+            _save_atomically(save, iterator.freeze(), resume_file_path)
+            resume_file_exists = True
+            last_checkpoint = (iterator.total_index, time.monotonic())
+
+        iterator._checkpoint_hook = checkpoint  # pylint:disable=protected-access
     try:
         yield is_resuming, start_index
     except (KeyboardInterrupt, AbortDownloadException):
-        if os.path.dirname(resume_file_path):
-            os.makedirs(os.path.dirname(resume_file_path), exist_ok=True)
-        save(iterator.freeze(), resume_file_path)
+        _save_atomically(save, iterator.freeze(), resume_file_path)
         context.log("\nSaved resume information to {}.".format(resume_file_path))
         raise
+    finally:
+        iterator._checkpoint_hook = None  # pylint:disable=protected-access
     if resume_file_exists:
         os.unlink(resume_file_path)
         context.log("Iteration complete, deleted resume information file {}.".format(resume_file_path))
+
+
+def _save_atomically(save: Callable[[Union[FrozenNodeIterator, FrozenSectionIterator], str], None],
+                     frozen: Union[FrozenNodeIterator, FrozenSectionIterator], path: str) -> None:
+    # Save into a temporary file next to the resume file, keeping its extension for save(), and replace the resume
+    # file with it, so that it is complete even if the process is killed meanwhile.
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    root, ext = os.path.splitext(path)
+    temp_path = root + '.temp' + ext
+    save(frozen, temp_path)
+    os.replace(temp_path, path)
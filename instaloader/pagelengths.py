@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict
+
+
+class PageLengths:
+    """
+    Page lengths of the GraphQL queries of :class:`NodeIterator`, adapted per ``query_hash`` or ``doc_id`` to obtain
+    as many items per query as Instagram serves. As every page costs a rate-limited query, longer pages speed up
+    iterating over many items.
+
+    Starting with *min_length*, the page length of a query is doubled after each full page, up to *max_length*. When
+    Instagram serves fewer items than requested while there are more, that number is kept as the page length of the
+    query. When it responds with 400 Bad Request or with an empty page, the page is queried again with half the
+    length, but not shorter than *min_length*. Such a learned page length is kept for *probe_after* seconds; after
+    that, longer pages are probed again, as one short page may have been a fluke. The page lengths are saved into a
+    JSON file when the context is closed and loaded from it when starting, so later runs start with the learned page
+    lengths.
+
+    To use it, assign it to :attr:`InstaloaderContext.page_lengths`, or pass the path of the file as `page_lengths` to
+    :class:`Instaloader`::
+
+       L = instaloader.Instaloader(page_lengths='page-lengths.json')
+
+    :param path: Path of the JSON file; it is created if it does not exist.
+    :param min_length: Page length to start with, and to fall back to.
+    :param max_length: Page length to not exceed.
+    :param probe_after: Seconds after which a page length learned from a short or failed page is probed again.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, path: str, min_length: int = 12, max_length: int = 50, probe_after: float = 24 * 3600):
+        self.path = path
+        self.min_length = min_length
+        self.max_length = max_length
+        self.probe_after = probe_after
+        self._lock = threading.Lock()
+        # page length per query, and since when it is final, i.e. no longer probed
+        self._lengths: Dict[str, Dict[str, Any]] = dict()
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                self._lengths = {query_id: {'length': int(entry['length']),
+                                            'final_since': float(entry.get('final_since', 0.0))}
+                                 for query_id, entry in json.load(file)['queries'].items()}
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self._lengths = dict()
+
+    def length(self, query_id: str) -> int:
+        """Page length to query the next page of given ``query_hash`` or ``doc_id`` with."""
+        with self._lock:
+            entry = self._lengths.get(query_id)
+            if entry is None:
+                return self.min_length
+            return max(self.min_length, min(self.max_length, entry['length']))
+
+    def served(self, query_id: str, requested: int, served: int, has_next_page: bool) -> None:
+        """Reports that *served* items have been served for a page of *requested* length."""
+        if not has_next_page:
+            # the last page tells nothing about the page length
+            return
+        with self._lock:
+            entry = self._lengths.setdefault(query_id, {'length': self.min_length, 'final_since': 0.0})
+            if served < requested:
+                entry['length'], entry['final_since'] = max(self.min_length, served), time.time()
+            elif entry['final_since'] + self.probe_after <= time.time():
+                entry['length'] = min(self.max_length, max(entry['length'], 2 * requested))
+
+    def failed(self, query_id: str, requested: int) -> bool:
+        """Reports that a page of *requested* length failed with 400 Bad Request or was empty. Returns whether to
+        query it again with a shorter page length."""
+        if requested <= self.min_length:
+            return False
+        with self._lock:
+            self._lengths[query_id] = {'length': max(self.min_length, requested // 2),
+                                       'final_since': time.time()}
+        return True
+
+    def save(self) -> None:
+        """Save the page lengths into the file."""
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._lock:
+            lengths = dict(self._lengths)
+        temp_path = self.path + '.temp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'queries': lengths}, file)
+        os.replace(temp_path, self.path)
+
+    def close(self) -> None:
+        """Save the page lengths. Called when the context is closed."""
+        self.save()
@@ -0,0 +1,121 @@
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from .instaloader import get_default_rate_controller_state_filename
+from .instaloadercontext import InstaloaderContext, RateController, _SlidingWindows
+
+
+class PersistentRateController(RateController):
+    """
+    :class:`RateController` that saves its state, i.e. the timestamps of the queries of the last hour and the waiting
+    times imposed by 429 Too Many Requests responses, to a state file and loads it on start, so that a restarted
+    Instaloader does not start with a full budget that Instagram does not grant::
+
+       L = instaloader.Instaloader(rate_controller=lambda ctx: instaloader.PersistentRateController(ctx))
+
+    The state is kept per logged-in account (or for anonymous queries), and is loaded before the first query of that
+    account. It is saved every *save_interval* queries, after a 429 response, and when the context is closed if queries
+    have been made since it was saved.
+
+    :param context: The :class:`InstaloaderContext` whose queries to control.
+    :param path: Path of the state file, by default ``rate-controller-state.json`` in the configuration directory.
+    :param save_interval: Number of queries after which the state is saved.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, context: InstaloaderContext, path: Optional[str] = None, save_interval: int = 50):
+        super().__init__(context)
+        self.path = path if path is not None else get_default_rate_controller_state_filename()
+        self.save_interval = save_interval
+        self._account: Optional[str] = None
+        self._unsaved_queries = 0
+
+    def _read_states(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                return json.load(file)['accounts']
+        except FileNotFoundError:
+            return dict()
+        except (ValueError, KeyError, TypeError) as err:
+            self._context.error("Ignoring invalid rate controller state file {}: {}".format(self.path, err))
+            return dict()
+
+    def _switch_account(self) -> None:
+        # Load the state of the current account, saving the state of the previous one.
+        with self._lock:
+            account = self._context.username or ''
+            if account == self._account:
+                return
+            if self._account is not None:
+                self.save()
+            self._account = account
+            self._query_timestamps = dict()
+            self._graphql_query_timestamps = _SlidingWindows()
+            state = self._read_states().get(account, {})
+            # The state file holds wall-clock times, which are converted to and from the monotonic clock.
+            wall_time, current_time = time.time(), self._clock()
+            offset = current_time - wall_time
+            for query_type, timestamps in state.get('query_timestamps', {}).items():
+                for timestamp in sorted(timestamps):
+                    if timestamp + offset > current_time - 60 * 60:
+                        super()._track_query(query_type, timestamp + offset)
+            self._earliest_next_request_time = max(0.0, state.get('earliest_next_request_time', 0.0) + offset)
+            self._iphone_earliest_next_request_time = max(0.0,
+                                                          state.get('iphone_earliest_next_request_time', 0.0) + offset)
+            self._unsaved_queries = 0
+
+    def save(self) -> None:
+        """Save the state of the current account into the state file."""
+        with self._lock:
+            if self._account is None:
+                return
+            wall_time, current_time = time.time(), self._clock()
+            offset = wall_time - current_time
+            state: Dict[str, Any] = {
+                'query_timestamps': {query_type: [t + offset for t in times.timestamps(60 * 60, current_time)]
+                                     for query_type, times in self._query_timestamps.items()},
+            }
+            if self._earliest_next_request_time > current_time:
+                state['earliest_next_request_time'] = self._earliest_next_request_time + offset
+            if self._iphone_earliest_next_request_time > current_time:
+                state['iphone_earliest_next_request_time'] = self._iphone_earliest_next_request_time + offset
+            states = self._read_states()
+            states[self._account] = state
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            # write atomically, as concurrent processes may read it
+            temp_path = self.path + '.temp'
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'accounts': states}, file)
+            os.replace(temp_path, self.path)
+            self._unsaved_queries = 0
+
+    def wait_before_query(self, query_type: str) -> None:
+        self._switch_account()
+        super().wait_before_query(query_type)
+
+    def _load_state(self, current_time: float) -> None:
+        self._switch_account()
+
+    def _track_query(self, query_type: str, timestamp: float) -> None:
+        with self._lock:
+            super()._track_query(query_type, timestamp)
+            self._unsaved_queries += 1
+            if self._unsaved_queries >= self.save_interval:
+                self.save()
+
+    def _report_429(self, query_type: str) -> float:
+        self._switch_account()
+        waittime = super()._report_429(query_type)
+        self.save()
+        return waittime
+
+    def close(self) -> None:
+        """Save the state, if queries have been made since it was saved."""
+        with self._lock:
+            if self._unsaved_queries:
+                self.save()
@@ -0,0 +1,73 @@
+import math
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from .instaloadercontext import RateController
+
+MEAN_SLEEP = (1 - math.exp(-0.6 * 15.0)) / 0.6
+"""Mean duration in seconds of :meth:`InstaloaderContext.do_sleep`, i.e. of ``min(random.expovariate(0.6), 15.0)``."""
+
+
+class QueryEstimate:
+    """
+    Expected queries of a download, by query type, and the time that they take when waiting as imposed by a
+    :class:`RateController`.
+
+    Queries are added with :meth:`add` in the order they would be done. :meth:`simulate` then lets a
+    :class:`RateController` decide the waiting times with a simulated clock, so no time passes while estimating::
+
+       estimate = instaloader.QueryEstimate()
+       estimate.add('7898261790222653', 10)
+       print(estimate.counts, estimate.simulate(instaloader.RateController(L.context)))
+
+    Any kind of :class:`RateController` can be used, e.g. an :class:`AdaptiveRateController` with its learned budgets,
+    or a :class:`PersistentRateController` or :class:`SharedRateController`, whose recorded queries are taken into
+    account.
+
+    :param request_time: Assumed duration of a query in seconds.
+    :param sleep: Whether queries are delayed by :meth:`InstaloaderContext.do_sleep`.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, request_time: float = 1.0, sleep: bool = True):
+        self.request_time = request_time
+        self.sleep = sleep
+        # runs of queries of the same type, in order
+        self._queries: List[Tuple[str, int]] = []
+
+    def add(self, query_type: str, count: int = 1) -> None:
+        """Add *count* queries of given type."""
+        if count > 0:
+            self._queries.append((query_type, count))
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """Number of queries per query type."""
+        counts: Counter = Counter()
+        for query_type, count in self._queries:
+            counts[query_type] += count
+        return dict(counts)
+
+    @property
+    def total(self) -> int:
+        """Total number of queries."""
+        return sum(count for _, count in self._queries)
+
+    def simulate(self, rate_controller: RateController) -> float:
+        """Simulated time in seconds that the queries take, starting from the current state of the given rate
+        controller. It should be a fresh instance that is not used otherwise, as the simulated queries are tracked by
+        it, in memory only; its :meth:`RateController.sleep` is not called. Close it afterwards, which does not save
+        the simulated queries, e.g. of a :class:`PersistentRateController`."""
+        # pylint:disable=protected-access
+        current_time = start_time = rate_controller._clock()
+        rate_controller._load_state(current_time)
+        for query_type, count in self._queries:
+            for _ in range(count):
+                if self.sleep:
+                    current_time += MEAN_SLEEP
+                current_time += rate_controller.query_waittime(query_type, current_time)
+                # rather than the subclass' _track_query(), which might record it, e.g. into a file
+                RateController._track_query(rate_controller, query_type, current_time)
+                current_time += self.request_time
+        return current_time - start_time
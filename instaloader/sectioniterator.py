@@ -1,46 +1,270 @@
-from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+import base64
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import (TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Generic, Iterator, List, NamedTuple, Optional,
+                    Tuple, TypeVar)
 
+from .exceptions import AbortDownloadException, InvalidArgumentException
 from .instaloadercontext import InstaloaderContext
 
+if TYPE_CHECKING:
+    from .asynccontext import AsyncInstaloaderContext
+
 T = TypeVar('T')
 
 
-class SectionIterator(Iterator[T]):
-    """Iterator for the new 'sections'-style responses.
+class FrozenSectionIterator(NamedTuple):
+    query_path: str
+    context_username: Optional[str]
+    total_index: int
+    best_before: Optional[float]
+    max_id: Optional[str]
+    page_index: int
+    section_index: int
+FrozenSectionIterator.query_path.__doc__ = """The path that the pages are queried from."""
+FrozenSectionIterator.context_username.__doc__ = """The username who created the iterator, or ``None``."""
+FrozenSectionIterator.total_index.__doc__ = """Number of items that have already been returned."""
+FrozenSectionIterator.best_before.__doc__ = """Date when the stored cursor might have expired."""
+FrozenSectionIterator.max_id.__doc__ = \
+    """The ``next_max_id`` cursor that the current page has been queried with, or ``None`` for the first page."""
+FrozenSectionIterator.page_index.__doc__ = """Index of the section within the current page to continue with."""
+FrozenSectionIterator.section_index.__doc__ = """Index of the media within that section to continue with."""
+
+
+class _BaseSectionIterator(Generic[T]):
+    # Pagination state and freezing shared by SectionIterator and AsyncSectionIterator.
+
+    _shelf_life = timedelta(days=29)
 
-    .. versionadded:: 4.9"""
     def __init__(self,
-                 context: InstaloaderContext,
                  sections_extractor: Callable[[Dict[str, Any]], Dict[str, Any]],
                  media_wrapper: Callable[[Dict], T],
                  query_path: str,
                  first_data: Optional[Dict[str, Any]] = None):
-        self._context = context
         self._sections_extractor = sections_extractor
         self._media_wrapper = media_wrapper
         self._query_path = query_path
-        self._data = first_data or self._query()
+        self._data = first_data
         self._page_index = 0
         self._section_index = 0
+        self._total_index = 0
+        # cursor that the current page has been queried with
+        self._max_id: Optional[str] = None
+        self._best_before: Optional[datetime] = None
+        if first_data is not None:
+            self._best_before = datetime.now() + _BaseSectionIterator._shelf_life
+        # cursor and position of a thawn FrozenSectionIterator, until its page is queried again
+        self._thawn_position: Optional[Tuple[Optional[str], int, int]] = None
+        # called before producing each item, e.g. to save a checkpoint, see resumable_iteration()
+        self._checkpoint_hook: Optional[Callable[[], None]] = None
+
+    def _context_username(self) -> Optional[str]:
+        raise NotImplementedError
+
+    @staticmethod
+    def _query_params(max_id: Optional[str] = None) -> Dict[str, Any]:
+        pagination_variables = {"max_id": max_id} if max_id is not None else {}
+        return {"__a": 1, "__d": "dis", **pagination_variables}
+
+    def _extract_page(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        data = self._sections_extractor(response)
+        self._best_before = datetime.now() + _BaseSectionIterator._shelf_life
+        return data
+
+    def _checkpoint(self) -> None:
+        if self._checkpoint_hook is not None:
+            self._checkpoint_hook()
+
+    def _medias(self, page_index: int) -> List[Dict[str, Any]]:
+        assert self._data is not None
+        return self._data['sections'][page_index]['layout_content']['medias']
+
+    def _take_media(self) -> Optional[Dict[str, Any]]:
+        """Returns the next media of the current page, or None if it is exhausted."""
+        assert self._data is not None
+        if self._page_index < len(self._data['sections']):
+            media = self._medias(self._page_index)[self._section_index]
+            page_index, section_index, total_index = self._page_index, self._section_index, self._total_index
+            try:
+                self._section_index += 1
+                if self._section_index >= len(self._medias(self._page_index)):
+                    self._section_index = 0
+                    self._page_index += 1
+                self._total_index += 1
+            except (KeyboardInterrupt, AbortDownloadException):
+                self._page_index, self._section_index, self._total_index = page_index, section_index, total_index
+                raise
+            return media['media']
+        return None
+
+    def _next_max_id(self) -> Optional[str]:
+        assert self._data is not None
+        return self._data["next_max_id"] if self._data['more_available'] else None
+
+    def _turn_page(self, data: Dict[str, Any], max_id: Optional[str]) -> None:
+        self._page_index, self._section_index, self._data, self._max_id = 0, 0, data, max_id
+
+    def _restore_thawn_position(self, data: Dict[str, Any]) -> None:
+        """Continues at the position of the thawn iterator within the given page, which has been queried again with
+        the cursor of the frozen page."""
+        assert self._thawn_position is not None
+        max_id, page_index, section_index = self._thawn_position
+        self._turn_page(data, max_id)
+        # skip positions that do not exist anymore in the queried page
+        while page_index < len(data['sections']) and section_index >= len(self._medias(page_index)):
+            page_index, section_index = page_index + 1, 0
+        self._page_index, self._section_index = page_index, section_index
+        self._thawn_position = None
+
+    @property
+    def total_index(self) -> int:
+        """Number of items that have already been returned.
+
+        .. versionadded:: 4.15"""
+        return self._total_index
+
+    @property
+    def magic(self) -> str:
+        """Magic string for easily identifying a matching iterator file for resuming (hash of some parameters).
+
+        .. versionadded:: 4.15"""
+        magic_hash = hashlib.blake2b(digest_size=6)
+        magic_hash.update(json.dumps([self._query_path, self._context_username()]).encode())
+        return base64.urlsafe_b64encode(magic_hash.digest()).decode()
+
+    def freeze(self) -> FrozenSectionIterator:
+        """Freeze the iterator for later resuming. As with :meth:`NodeIterator.freeze`, the resumed iterator returns
+        the last returned item again.
+
+        .. versionadded:: 4.15"""
+        if self._thawn_position is not None:
+            max_id, page_index, section_index = self._thawn_position
+        else:
+            max_id, page_index, section_index = self._max_id, self._page_index, self._section_index
+            if section_index > 0:
+                section_index -= 1
+            elif page_index > 0:
+                page_index -= 1
+                section_index = len(self._medias(page_index)) - 1
+        return FrozenSectionIterator(
+            query_path=self._query_path,
+            context_username=self._context_username(),
+            total_index=max(self._total_index - 1, 0),
+            best_before=self._best_before.timestamp() if self._best_before else None,
+            max_id=max_id,
+            page_index=page_index,
+            section_index=section_index,
+        )
+
+    def thaw(self, frozen: FrozenSectionIterator) -> None:
+        """
+        Use this iterator for resuming from earlier iteration. The page of the frozen iterator is queried again when
+        the next item is requested.
+
+        :raises InvalidArgumentException:
+           If
+
+           - the iterator on which this method is called has already been used, or
+           - the given :class:`FrozenSectionIterator` does not match, i.e. belongs to a different iteration.
+
+        .. versionadded:: 4.15
+        """
+        if self._total_index or self._page_index or self._section_index:
+            raise InvalidArgumentException("thaw() called on already-used iterator.")
+        if self._query_path != frozen.query_path or self._context_username() != frozen.context_username:
+            raise InvalidArgumentException("Mismatching resume information.")
+        if not frozen.best_before:
+            raise InvalidArgumentException("\"best before\" date missing.")
+        self._total_index = frozen.total_index
+        self._best_before = datetime.fromtimestamp(frozen.best_before)
+        self._thawn_position = (frozen.max_id, frozen.page_index, frozen.section_index)
+
+
+class SectionIterator(_BaseSectionIterator[T], Iterator[T]):
+    """Iterator for the new 'sections'-style responses.
+
+    Like a :class:`NodeIterator`, it can be frozen with :meth:`freeze` and thawn with :meth:`thaw` on an
+    equally-constructed SectionIterator, and :func:`resumable_iteration` handles it.
+
+    .. versionadded:: 4.9
+
+    .. versionchanged:: 4.15
+       Added :meth:`freeze`, :meth:`thaw`, :attr:`magic` and :attr:`total_index`."""
+    def __init__(self,
+                 context: InstaloaderContext,
+                 sections_extractor: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 media_wrapper: Callable[[Dict], T],
+                 query_path: str,
+                 first_data: Optional[Dict[str, Any]] = None):
+        super().__init__(sections_extractor, media_wrapper, query_path, first_data)
+        self._context = context
+        if not self._data:
+            self._data = self._query()
 
     def __iter__(self):
         return self
 
+    def _context_username(self) -> Optional[str]:
+        return self._context.username
+
     def _query(self, max_id: Optional[str] = None) -> Dict[str, Any]:
-        pagination_variables = {"max_id": max_id} if max_id is not None else {}
-        return self._sections_extractor(
-            self._context.get_json(self._query_path, params={"__a": 1, "__d": "dis", **pagination_variables})
-        )
+        return self._extract_page(self._context.get_json(self._query_path, params=self._query_params(max_id)))
 
     def __next__(self) -> T:
-        if self._page_index < len(self._data['sections']):
-            media = self._data['sections'][self._page_index]['layout_content']['medias'][self._section_index]['media']
-            self._section_index += 1
-            if self._section_index >= len(self._data['sections'][self._page_index]['layout_content']['medias']):
-                self._section_index = 0
-                self._page_index += 1
-            return self._media_wrapper(media)
-        if self._data['more_available']:
-            self._page_index, self._section_index, self._data = 0, 0, self._query(self._data["next_max_id"])
-            return self.__next__()
-        raise StopIteration()
+        if self._thawn_position is not None:
+            max_id = self._thawn_position[0]
+            assert self._data is not None
+            self._restore_thawn_position(self._query(max_id) if max_id is not None else self._data)
+        self._checkpoint()
+        while True:
+            media = self._take_media()
+            if media is not None:
+                return self._media_wrapper(media)
+            max_id = self._next_max_id()
+            if max_id is None:
+                raise StopIteration()
+            self._turn_page(self._query(max_id), max_id)
+
+
+class AsyncSectionIterator(_BaseSectionIterator[T], AsyncIterator[T]):
+    """Asynchronous counterpart of :class:`SectionIterator`, querying the pages with an
+    :class:`AsyncInstaloaderContext`. Unless *first_data* is given, the first page is queried when the first item is
+    awaited.
+
+    .. versionadded:: 4.15"""
+    def __init__(self,
+                 context: 'AsyncInstaloaderContext',
+                 sections_extractor: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 media_wrapper: Callable[[Dict], T],
+                 query_path: str,
+                 first_data: Optional[Dict[str, Any]] = None):
+        super().__init__(sections_extractor, media_wrapper, query_path, first_data)
+        self._context = context
+
+    def __aiter__(self):
+        return self
+
+    def _context_username(self) -> Optional[str]:
+        return self._context.username
+
+    async def _query(self, max_id: Optional[str] = None) -> Dict[str, Any]:
+        return self._extract_page(
+            await self._context.get_json(self._query_path, params=self._query_params(max_id))
+        )
+
+    async def __anext__(self) -> T:
+        if not self._data:
+            self._data = await self._query()
+        if self._thawn_position is not None:
+            max_id = self._thawn_position[0]
+            self._restore_thawn_position(await self._query(max_id) if max_id is not None else self._data)
+        self._checkpoint()
+        while True:
+            media = self._take_media()
+            if media is not None:
+                return self._media_wrapper(media)
+            max_id = self._next_max_id()
+            if max_id is None:
+                raise StopAsyncIteration()
+            self._turn_page(await self._query(max_id), max_id)
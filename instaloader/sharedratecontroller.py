@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .instaloader import get_default_rate_limits_filename
+from .instaloadercontext import InstaloaderContext, RateController, _SlidingWindows
+
+
+class SharedRateController(RateController):
+    """
+    :class:`RateController` that shares the rate limit budget with all other Instaloader processes on this machine
+    that use the same database file.
+
+    The queries are recorded in an SQLite database, per logged-in account (or as anonymous queries), so that all
+    processes that use the same account draw from one budget, rather than each of them assuming to have the full
+    budget, e.g. when running multiple Instaloader instances from cron::
+
+       L = instaloader.Instaloader(rate_controller=lambda ctx: instaloader.SharedRateController(ctx))
+
+    Since the timestamps are shared between processes, they refer to the wall clock rather than to a monotonic
+    clock. Waiting times imposed by a 429 Too Many Requests response are shared as well.
+
+    :param context: The :class:`InstaloaderContext` whose queries to control.
+    :param path: Path of the database file, by default ``rate-limits.sqlite3`` in the configuration directory.
+
+    .. versionadded:: 4.15
+    """
+
+    def __init__(self, context: InstaloaderContext, path: Optional[str] = None):
+        super().__init__(context)
+        self.path = path if path is not None else get_default_rate_limits_filename()
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # transactions are begun explicitly, see _transaction()
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._transaction():
+            self._db.execute("CREATE TABLE IF NOT EXISTS queries "
+                             "(id INTEGER PRIMARY KEY AUTOINCREMENT, account TEXT, query_type TEXT, timestamp REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS queries_account ON queries (account, timestamp)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS earliest_next_requests "
+                             "(account TEXT, iphone INTEGER, timestamp REAL, PRIMARY KEY (account, iphone))")
+        self._account: Optional[str] = None
+        self._last_id = 0
+
+    def _clock(self) -> float:
+        return time.time()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # Exclusive transaction, so that no other process queries between determining the waiting time and recording
+        # the query.
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _sync(self, current_time: float) -> None:
+        # Catch up with the queries that have been recorded since the last call, by any process.
+        account = self._context.username or ''
+        if account != self._account:
+            self._account = account
+            self._query_timestamps = dict()
+            self._graphql_query_timestamps = _SlidingWindows()
+            self._earliest_next_request_time = 0.0
+            self._iphone_earliest_next_request_time = 0.0
+            self._last_id = 0
+            rows = self._db.execute("SELECT id, query_type, timestamp FROM queries "
+                                    "WHERE account = ? AND timestamp > ? ORDER BY timestamp",
+                                    (account, current_time - 60 * 60))
+        else:
+            rows = self._db.execute("SELECT id, query_type, timestamp FROM queries WHERE account = ? AND id > ? "
+                                    "ORDER BY id", (account, self._last_id))
+        for query_id, query_type, timestamp in rows:
+            super()._track_query(query_type, timestamp)
+            self._last_id = max(self._last_id, query_id)
+        for iphone, timestamp in self._db.execute("SELECT iphone, timestamp FROM earliest_next_requests "
+                                                  "WHERE account = ?", (account,)):
+            if iphone:
+                self._iphone_earliest_next_request_time = max(self._iphone_earliest_next_request_time, timestamp)
+            else:
+                self._earliest_next_request_time = max(self._earliest_next_request_time, timestamp)
+
+    def _load_state(self, current_time: float) -> None:
+        with self._lock:
+            self._sync(current_time)
+
+    def _track_query(self, query_type: str, timestamp: float) -> None:
+        assert self._account is not None
+        cursor = self._db.execute("INSERT INTO queries (account, query_type, timestamp) VALUES (?, ?, ?)",
+                                  (self._account, query_type, timestamp))
+        assert cursor.lastrowid is not None
+        # no other process can have recorded a query meanwhile, as we are within a transaction
+        self._last_id = cursor.lastrowid
+        super()._track_query(query_type, timestamp)
+        if self._last_id % 1000 == 0:
+            self._db.execute("DELETE FROM queries WHERE timestamp <= ?", (timestamp - 60 * 60,))
+
+    def wait_before_query(self, query_type: str) -> None:
+        """Waits until the query can be made and records it.
+
+        As other processes may have queried meanwhile, the waiting time is recalculated after waiting, until the
+        query can be made."""
+        start = time.monotonic()
+        while True:
+            with self._transaction():
+                current_time = self._clock()
+                self._sync(current_time)
+                waittime = self.query_waittime(query_type, current_time, False)
+                assert waittime >= 0
+                if waittime == 0:
+                    self._track_query(query_type, current_time)
+                    break
+            self._log_waittime(waittime)
+            self._wait(waittime)
+        self._record_query(query_type, time.monotonic() - start)
+
+    def _report_429(self, query_type: str) -> float:
+        with self._transaction():
+            self._sync(self._clock())
+            waittime = super()._report_429(query_type)
+            self._db.executemany("INSERT OR REPLACE INTO earliest_next_requests VALUES (?, ?, ?)",
+                                 [(self._account, 1, self._iphone_earliest_next_request_time),
+                                  (self._account, 0, self._earliest_next_request_time)])
+        return waittime
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            self._db.close()
@@ -9,11 +9,28 @@ from pathlib import Path
 from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 from unicodedata import normalize
 
-from . import __version__
+from . import __version__, jsoncodec
 from .exceptions import *
-from .instaloadercontext import InstaloaderContext
+from .instaloadercontext import InstaloaderContext, QueryPriority
 from .nodeiterator import FrozenNodeIterator, NodeIterator
-from .sectioniterator import SectionIterator
+from .sectioniterator import FrozenSectionIterator, SectionIterator
+
+# Query hashes and doc ids of GraphQL queries, which are also their query types as tracked by the RateController. The
+# ones of the queries done when downloading targets are also used to estimate the queries of a download (--estimate).
+_POST_DOC_ID = '8845758582119845'
+_COMMENTS_QUERY_HASH = '97b41c52301f77ce508f55e66d17620e'
+_PROFILE_POSTS_DOC_ID = '7898261790222653'
+_SAVED_POSTS_QUERY_HASH = 'f883d95537fbcd400f466f63d42bd8a1'
+_TAGGED_POSTS_QUERY_HASH = 'e31a871f7301132ceaab56507a66bbb7'
+_REELS_DOC_ID = '7845543455542541'
+_IGTV_POSTS_QUERY_HASH = 'bc78b344a68ed16dd5d7f264681c4c76'
+_FOLLOWEES_QUERY_HASH = '58712303d941c6855d4e888c5f0cd22f'
+_HASHTAG_POSTS_QUERY_HASH = '9b498c08113f1e09617a1703c22b2f32'
+_USER_REEL_QUERY_HASH = '7c16654f22c819fb63d1183034a5162f'
+_HIGHLIGHT_ITEMS_QUERY_HASH = '45246d3fe16ccc6577e0bd297a5db1ab'
+_FEED_QUERY_HASH = 'd6f4427fbe92d846298cf93df0b937d3'
+_REELS_TRAY_QUERY_HASH = 'd15efd8c0c5b23f0ef71f18bf363c704'
+_STORIES_QUERY_HASH = '303a4ae99711322310f25250d988f3b7'
 
 
 class PostSidecarNode(NamedTuple):
@@ -162,6 +179,26 @@ def _optional_normalize(string: Optional[str]) -> Optional[str]:
         return None
 
 
+def _largest_video_url(context: InstaloaderContext, owner: Any, version_urls: List[str]) -> Optional[str]:
+    """Of the given video version URLs, return the one with the largest Content-Length."""
+    version_urls = list(dict.fromkeys(version_urls))
+    if len(version_urls) == 0:
+        return None
+    if len(version_urls) == 1:
+        return version_urls[0]
+    url_candidates: List[Tuple[int, str]] = []
+    for idx, (version_url, content_length) in enumerate(zip(version_urls, context.get_content_lengths(version_urls))):
+        if isinstance(content_length, InstaloaderException):
+            context.error(f"Video URL candidate {idx+1}/{len(version_urls)} for {owner}: {content_length}")
+        else:
+            url_candidates.append((content_length, version_url))
+    if not url_candidates:
+        # All candidates fail: Fallback to default URL and handle errors later at the actual download attempt
+        return version_urls[0]
+    url_candidates.sort()
+    return url_candidates[-1][1]
+
+
 class Post:
     """
     Structure containing information about an Instagram post.
@@ -320,7 +357,7 @@ class Post:
     def _obtain_metadata(self):
         if not self._full_metadata_dict:
             pic_json = self._context.doc_id_graphql_query(
-                "8845758582119845", {"shortcode": self.shortcode}
+                _POST_DOC_ID, {"shortcode": self.shortcode}
             )["data"]["xdt_shortcode_media"]
             if pic_json is None:
                 raise BadResponseException("Fetching Post metadata failed.")
@@ -572,25 +609,7 @@ class Post:
                     version_urls.extend(version['url'] for version in self._iphone_struct['video_versions'])
                 except (InstaloaderException, KeyError, IndexError) as err:
                     self._context.error(f"Unable to fetch high-quality video version of {self}: {err}")
-            version_urls = list(dict.fromkeys(version_urls))
-            if len(version_urls) == 0:
-                return None
-            if len(version_urls) == 1:
-                return version_urls[0]
-            url_candidates: List[Tuple[int, str]] = []
-            for idx, version_url in enumerate(version_urls):
-                try:
-                    url_candidates.append((
-                        int(self._context.head(version_url, allow_redirects=True).headers.get('Content-Length', 0)),
-                        version_url
-                    ))
-                except (InstaloaderException, KeyError, IndexError) as err:
-                    self._context.error(f"Video URL candidate {idx+1}/{len(version_urls)} for {self}: {err}")
-            if not url_candidates:
-                # All candidates fail: Fallback to default URL and handle errors later at the actual download attempt
-                return version_urls[0]
-            url_candidates.sort()
-            return url_candidates[-1][1]
+            return _largest_video_url(self._context, self, version_urls)
         return None
 
     @property
@@ -647,14 +666,15 @@ class Post:
         """
         def _query(min_id=None):
             pagination_params = {"min_id": min_id} if min_id is not None else {}
-            return self._context.get_iphone_json(
-                f"api/v1/media/{self.mediaid}/comments/",
-                {
-                    "can_support_threading": "true",
-                    "permalink_enabled": "false",
-                    **pagination_params,
-                },
-            )
+            with self._context.query_priority(QueryPriority.COMMENTS):
+                return self._context.get_iphone_json(
+                    f"api/v1/media/{self.mediaid}/comments/",
+                    {
+                        "can_support_threading": "true",
+                        "permalink_enabled": "false",
+                        **pagination_params,
+                    },
+                )
 
         def _answers(comment_node):
             def _answer(child_comment):
@@ -676,10 +696,11 @@ class Post:
                 )
                 return
             pk = comment_node["pk"]
-            answers_json = self._context.get_iphone_json(
-                f"api/v1/media/{self.mediaid}/comments/{pk}/child_comments/",
-                {"max_id": ""},
-            )
+            with self._context.query_priority(QueryPriority.COMMENTS):
+                answers_json = self._context.get_iphone_json(
+                    f"api/v1/media/{self.mediaid}/comments/{pk}/child_comments/",
+                    {"max_id": ""},
+                )
             yield from (
                 _answer(child_comment) for child_comment in answers_json["child_comments"]
             )
@@ -755,20 +776,25 @@ class Post:
             # If the Post's metadata already contains all parent comments, don't do GraphQL requests to obtain them
             return [_postcomment(comment['node']) for comment in comment_edges]
 
-        if self.comments > NodeIterator.page_length():
-            # comments pagination via our graphql query does not work reliably anymore (issue #2125), fallback to an
-            # iphone endpoint if needed.
+        if Post._comments_query_type(self.comments) == 'iphone':
             return self._get_comments_via_iphone_endpoint()
 
         return NodeIterator(
             self._context,
-            '97b41c52301f77ce508f55e66d17620e',
+            _COMMENTS_QUERY_HASH,
             lambda d: d['data']['shortcode_media']['edge_media_to_parent_comment'],
             _postcomment,
             {'shortcode': self.shortcode},
             'https://www.instagram.com/p/{0}/'.format(self.shortcode),
         )
 
+    @staticmethod
+    def _comments_query_type(comments: int) -> str:
+        # Query type of the queries for the comments of a post with given number of comments.
+        # Comments pagination via our graphql query does not work reliably anymore (issue #2125), fallback to an
+        # iphone endpoint if needed.
+        return 'iphone' if comments > NodeIterator.page_length() else _COMMENTS_QUERY_HASH
+
     def get_likes(self) -> Iterator['Profile']:
         """
         Iterate over all likes of the post. A :class:`Profile` instance of each likee is yielded.
@@ -916,7 +942,7 @@ class Profile:
         """
         if profile_id in context.profile_id_cache:
             return context.profile_id_cache[profile_id]
-        data = context.graphql_query('7c16654f22c819fb63d1183034a5162f',
+        data = context.graphql_query(_USER_REEL_QUERY_HASH,
                                      {'user_id': str(profile_id),
                                       'include_chaining': False,
                                       'include_reel': True,
@@ -1002,6 +1028,11 @@ class Profile:
                 d = d[key]
             return d
 
+    def _first_post_ids(self) -> Optional[List[int]]:
+        # Media IDs of the newest posts (including pinned ones) that come with the profile metadata, if any.
+        edges = self._node.get('edge_owner_to_timeline_media', {}).get('edges')
+        return [int(edge['node']['id']) for edge in edges] if edges else None
+
     @property
     def _iphone_struct(self) -> Dict[str, Any]:
         if not self._context.iphone_support:
@@ -1207,7 +1238,7 @@ class Profile:
              'username': self.username},
             query_referer = 'https://www.instagram.com/{0}/'.format(self.username),
             is_first = Profile._make_is_newest_checker(),
-            doc_id = '7898261790222653',
+            doc_id = _PROFILE_POSTS_DOC_ID,
             query_hash = None,
         )
 
@@ -1221,7 +1252,7 @@ class Profile:
 
         return NodeIterator(
             self._context,
-            'f883d95537fbcd400f466f63d42bd8a1',
+            _SAVED_POSTS_QUERY_HASH,
             lambda d: d['data']['user']['edge_saved_media'],
             lambda n: Post(self._context, n),
             {'id': self.userid},
@@ -1237,7 +1268,7 @@ class Profile:
         self._obtain_metadata()
         return NodeIterator(
             self._context,
-            'e31a871f7301132ceaab56507a66bbb7',
+            _TAGGED_POSTS_QUERY_HASH,
             lambda d: d['data']['user']['edge_user_to_photos_of_you'],
             lambda n: Post(self._context, n, self if int(n['owner']['id']) == self.userid else None),
             {'id': self.userid},
@@ -1265,7 +1296,7 @@ class Profile:
             query_referer = 'https://www.instagram.com/{0}/'.format(self.username),
             is_first = Profile._make_is_newest_checker(),
             # fb_api_req_friendly_name=PolarisProfileReelsTabContentQuery_connection
-            doc_id = '7845543455542541',
+            doc_id = _REELS_DOC_ID,
             query_hash = None,
         )
 
@@ -1278,7 +1309,7 @@ class Profile:
         self._obtain_metadata()
         return NodeIterator(
             self._context,
-            'bc78b344a68ed16dd5d7f264681c4c76',
+            _IGTV_POSTS_QUERY_HASH,
             lambda d: d['data']['user']['edge_felix_video_timeline'],
             lambda n: Post(self._context, n, self),
             {'id': self.userid},
@@ -1343,7 +1374,7 @@ class Profile:
         self._obtain_metadata()
         return NodeIterator(
             self._context,
-            '58712303d941c6855d4e888c5f0cd22f',
+            _FOLLOWEES_QUERY_HASH,
             lambda d: d['data']['user']['edge_follow'],
             lambda n: Profile(self._context, n),
             {'id': str(self.userid)},
@@ -1439,9 +1470,10 @@ class StoryItem:
         if not self._context.is_logged_in:
             raise LoginRequiredException("Login required to access iPhone media info endpoint.")
         if not self._iphone_struct_:
-            data = self._context.get_iphone_json(
-                path='api/v1/feed/reels_media/?reel_ids={}'.format(self.owner_id), params={}
-            )
+            with self._context.query_priority(QueryPriority.STORY):
+                data = self._context.get_iphone_json(
+                    path='api/v1/feed/reels_media/?reel_ids={}'.format(self.owner_id), params={}
+                )
             self._iphone_struct_ = {}
             for item in data['reels'][str(self.owner_id)]['items']:
                 if item['pk'] == self.mediaid:
@@ -1584,25 +1616,7 @@ class StoryItem:
                     version_urls.extend(version['url'] for version in self._iphone_struct['video_versions'])
                 except (InstaloaderException, KeyError, IndexError) as err:
                     self._context.error(f"Unable to fetch high-quality video version of {self}: {err}")
-            version_urls = list(dict.fromkeys(version_urls))
-            if len(version_urls) == 0:
-                return None
-            if len(version_urls) == 1:
-                return version_urls[0]
-            url_candidates: List[Tuple[int, str]] = []
-            for idx, version_url in enumerate(version_urls):
-                try:
-                    url_candidates.append((
-                        int(self._context.head(version_url, allow_redirects=True).headers.get('Content-Length', 0)),
-                        version_url
-                    ))
-                except (InstaloaderException, KeyError, IndexError) as err:
-                    self._context.error(f"Video URL candidate {idx+1}/{len(version_urls)} for {self}: {err}")
-            if not url_candidates:
-                # All candidates fail: Fallback to default URL and handle errors later at the actual download attempt
-                return version_urls[0]
-            url_candidates.sort()
-            return url_candidates[-1][1]
+            return _largest_video_url(self._context, self, version_urls)
         return None
 
 
@@ -1705,9 +1719,10 @@ class Story:
 
     def _fetch_iphone_struct(self) -> None:
         if self._context.iphone_support and self._context.is_logged_in and not self._iphone_struct_:
-            data = self._context.get_iphone_json(
-                path='api/v1/feed/reels_media/?reel_ids={}'.format(self.owner_id), params={}
-            )
+            with self._context.query_priority(QueryPriority.STORY):
+                data = self._context.get_iphone_json(
+                    path='api/v1/feed/reels_media/?reel_ids={}'.format(self.owner_id), params={}
+                )
             self._iphone_struct_ = data['reels'][str(self.owner_id)]
 
     def get_items(self) -> Iterator[StoryItem]:
@@ -1783,16 +1798,17 @@ class Highlight(Story):
 
     def _fetch_items(self):
         if not self._items:
-            self._items = self._context.graphql_query("45246d3fe16ccc6577e0bd297a5db1ab",
+            self._items = self._context.graphql_query(_HIGHLIGHT_ITEMS_QUERY_HASH,
                                                       {"reel_ids": [], "tag_names": [], "location_ids": [],
                                                        "highlight_reel_ids": [str(self.unique_id)],
                                                        "precomposed_overlay": False})['data']['reels_media'][0]['items']
 
     def _fetch_iphone_struct(self) -> None:
         if self._context.iphone_support and self._context.is_logged_in and not self._iphone_struct_:
-            data = self._context.get_iphone_json(
-                path='api/v1/feed/reels_media/?reel_ids=highlight:{}'.format(self.unique_id), params={}
-            )
+            with self._context.query_priority(QueryPriority.STORY):
+                data = self._context.get_iphone_json(
+                    path='api/v1/feed/reels_media/?reel_ids=highlight:{}'.format(self.unique_id), params={}
+                )
             self._iphone_struct_ = data['reels']['highlight:{}'.format(self.unique_id)]
 
     @property
@@ -1929,18 +1945,21 @@ class Hashtag:
             return bool(self._metadata("following"))
 
     def get_top_posts(self) -> Iterator[Post]:
-        """Yields the top posts of the hashtag."""
+        """Yields the top posts of the hashtag.
+
+        .. versionchanged:: 4.15
+           Returns a resumable :class:`SectionIterator` if the hashtag's metadata is in the 'sections' style."""
         try:
-            yield from (Post(self._context, edge["node"])
-                        for edge in self._metadata("edge_hashtag_to_top_posts", "edges"))
+            edges = self._metadata("edge_hashtag_to_top_posts", "edges")
         except KeyError:
-            yield from SectionIterator(
+            return SectionIterator(
                 self._context,
                 lambda d: d["data"]["top"],
                 lambda m: Post.from_iphone_struct(self._context, m),
                 f"explore/tags/{self.name}/",
                 self._metadata("top"),
             )
+        return (Post(self._context, edge["node"]) for edge in edges)
 
     @property
     def mediacount(self) -> int:
@@ -1959,10 +1978,28 @@ class Hashtag:
         """Yields the recent posts associated with this hashtag.
 
         .. deprecated:: 4.9
-           Use :meth:`Hashtag.get_posts_resumable` as this method may return incorrect results (:issue:`1457`)"""
+           Use :meth:`Hashtag.get_posts_resumable` as this method may return incorrect results (:issue:`1457`)
+
+        .. versionchanged:: 4.15
+           Returns a resumable :class:`SectionIterator` if the hashtag's metadata is in the 'sections' style."""
         try:
             self._metadata("edge_hashtag_to_media", "edges")
             self._metadata("edge_hashtag_to_media", "page_info")
+        except KeyError:
+            return self._get_recent_sections()
+        return self._get_recent_edges()
+
+    def _get_recent_sections(self) -> SectionIterator[Post]:
+        return SectionIterator(
+            self._context,
+            lambda d: d["data"]["recent"],
+            lambda m: Post.from_iphone_struct(self._context, m),
+            f"explore/tags/{self.name}/",
+            self._metadata("recent"),
+        )
+
+    def _get_recent_edges(self) -> Iterator[Post]:
+        try:
             conn = self._metadata("edge_hashtag_to_media")
             yield from (Post(self._context, edge["node"]) for edge in conn["edges"])
             while conn["page_info"]["has_next_page"]:
@@ -1970,13 +2007,7 @@ class Hashtag:
                 conn = data["edge_hashtag_to_media"]
                 yield from (Post(self._context, edge["node"]) for edge in conn["edges"])
         except KeyError:
-            yield from SectionIterator(
-                self._context,
-                lambda d: d["data"]["recent"],
-                lambda m: Post.from_iphone_struct(self._context, m),
-                f"explore/tags/{self.name}/",
-                self._metadata("recent"),
-            )
+            yield from self._get_recent_sections()
 
     def get_all_posts(self) -> Iterator[Post]:
         """Yields all posts, i.e. all most recent posts and the top posts, in almost-chronological order."""
@@ -2014,7 +2045,7 @@ class Hashtag:
 
         .. versionadded:: 4.9"""
         return NodeIterator(
-            self._context, "9b498c08113f1e09617a1703c22b2f32",
+            self._context, _HASHTAG_POSTS_QUERY_HASH,
             lambda d: d['data']['hashtag']['edge_hashtag_to_media'],
             lambda n: Post(self._context, n),
             {'tag_name': self.name},
@@ -2146,7 +2177,7 @@ class TitlePic:
         return self._date_utc.astimezone() if self._date_utc is not None else None
 
 
-JsonExportable = Union[Post, Profile, StoryItem, Hashtag, FrozenNodeIterator]
+JsonExportable = Union[Post, Profile, StoryItem, Hashtag, FrozenNodeIterator, FrozenSectionIterator]
 
 
 def get_json_structure(structure: JsonExportable) -> dict:
@@ -2176,8 +2207,8 @@ def save_structure_to_file(structure: JsonExportable, filename: str) -> None:
     json_structure = get_json_structure(structure)
     compress = filename.endswith('.xz')
     if compress:
-        with lzma.open(filename, 'wt', check=lzma.CHECK_NONE) as fp:
-            json.dump(json_structure, fp=fp, separators=(',', ':'))
+        with lzma.open(filename, 'wb', check=lzma.CHECK_NONE) as fp:
+            fp.write(jsoncodec.dumps(json_structure))
     else:
         with open(filename, 'wt') as fp:
             json.dump(json_structure, fp=fp, indent=4, sort_keys=True)
@@ -2192,6 +2223,7 @@ def load_structure(context: InstaloaderContext, json_structure: dict) -> JsonExp
 
     .. versionadded:: 4.8
     """
+    # pylint:disable=too-many-return-statements
     if 'node' in json_structure and 'instaloader' in json_structure and \
             'node_type' in json_structure['instaloader']:
         node_type = json_structure['instaloader']['node_type']
@@ -2207,6 +2239,8 @@ def load_structure(context: InstaloaderContext, json_structure: dict) -> JsonExp
             if not 'first_node' in json_structure['node']:
                 json_structure['node']['first_node'] = None
             return FrozenNodeIterator(**json_structure['node'])
+        elif node_type == "FrozenSectionIterator":
+            return FrozenSectionIterator(**json_structure['node'])
     elif 'shortcode' in json_structure:
         # Post JSON created with Instaloader v3
         return Post.from_shortcode(context, json_structure['shortcode'])
@@ -2222,10 +2256,10 @@ def load_structure_from_file(context: InstaloaderContext, filename: str) -> Json
     """
     compressed = filename.endswith('.xz')
     if compressed:
-        fp = lzma.open(filename, 'rt')
+        with lzma.open(filename, 'rb') as fp:
+            data = fp.read()
     else:
-        # pylint:disable=consider-using-with
-        fp = open(filename, 'rt')
-    json_structure = json.load(fp)
-    fp.close()
+        with open(filename, 'rb') as file:
+            data = file.read()
+    json_structure = jsoncodec.loads(data)
     return load_structure(context, json_structure)
@@ -1,12 +1,27 @@
 """Unit Tests for Instaloader"""
 
+import asyncio
+import contextlib
+import io
+import json
 import os
+import random
 import shutil
+import subprocess
+import sys
 import tempfile
+import textwrap
+import threading
+import time
 import unittest
+import urllib.parse
+from datetime import datetime
 from itertools import islice
+from types import SimpleNamespace
 from typing import Optional
 
+import requests
+
 import instaloader
 
 PROFILE_WITH_HIGHLIGHTS = 325732271
@@ -210,5 +225,717 @@ class TestInstaloaderLoggedIn(TestInstaloaderAnonymously):
                 break
 
 
+class TestRateController(unittest.TestCase):
+
+    @staticmethod
+    def reference_waittime(timestamps, query_type, current_time):
+        # straightforward implementation of RateController.query_waittime() for tracked queries
+        def window(times, secs):
+            return [t for t in times if t > current_time - secs]
+        per_type = window(timestamps.get(query_type, []), 660)
+        gql = window([t for qt, times in timestamps.items() if qt not in ['iphone', 'other'] for t in times], 600)
+        iphone = window(timestamps.get(query_type, []), 1800) if query_type == 'iphone' else []
+        return max(0.0,
+                   min(per_type) + 666 if len(per_type) >= (75 if query_type == 'other' else 200) else 0.0,
+                   min(gql) + 600 if query_type not in ['iphone', 'other'] and len(gql) >= 275 else 0.0,
+                   min(iphone) + 1818 if len(iphone) >= 199 else 0.0) - current_time
+
+    def test_sliding_windows(self):
+        # pylint:disable=protected-access
+        rng = random.Random(0)
+        query_types = ['iphone', 'other'] + ['hash{}'.format(i) for i in range(4)]
+        rc = instaloader.RateController(instaloader.InstaloaderContext())
+        timestamps = dict()
+        current_time = 0.0
+        for _ in range(3000):
+            query_type = rng.choice(query_types)
+            waittime = rc.query_waittime(query_type, current_time)
+            self.assertEqual(max(0.0, self.reference_waittime(timestamps, query_type, current_time)), waittime)
+            current_time += waittime + rng.random()
+            rc._track_query(query_type, current_time)
+            timestamps.setdefault(query_type, []).append(current_time)
+
+    def test_sliding_windows_counts(self):
+        # pylint:disable=protected-access
+        rng = random.Random(0)
+        windows = instaloader.instaloadercontext._SlidingWindows()
+        timestamps = []
+        current_time = 0.0
+        for _ in range(5000):
+            current_time += rng.random() * 10
+            # concurrent queries might be tracked slightly out of order
+            timestamp = current_time - (rng.random() * 5 if rng.random() < 0.1 else 0.0)
+            windows.append(timestamp)
+            timestamps.append(timestamp)
+            window = rng.choice([600, 660, 1800, 3600])
+            expected = sorted(t for t in timestamps if t > current_time - window)
+            self.assertEqual(len(expected), windows.count(window, current_time))
+            self.assertEqual(expected, windows.timestamps(window, current_time))
+            self.assertEqual(expected[0], windows.earliest(window, current_time))
+            if rng.random() < 0.5:
+                windows.expire(3600, current_time)
+                timestamps = [t for t in timestamps if t > current_time - 3600]
+
+    def test_statistics(self):
+        rc = instaloader.RateController(instaloader.InstaloaderContext(quiet=True))
+        rc.sleep = lambda secs: None
+        for _ in range(3):
+            rc.wait_before_query('other')
+        rc.wait_before_query('iphone')
+        rc.handle_429('iphone')
+        statistics = rc.statistics()
+        self.assertEqual({'other': 3, 'iphone': 1}, statistics.queries)
+        self.assertEqual({'iphone': 1}, statistics.too_many_requests)
+        self.assertGreaterEqual(statistics.wait_time, statistics.max_wait_time)
+
+    def test_statistics_report(self):
+        # pylint:disable=protected-access,import-outside-toplevel
+        from instaloader.__main__ import _report_rate_statistics
+        loader = instaloader.Instaloader(sleep=False)
+
+        def use_waittime():
+            for _ in range(10000):
+                loader.context._use_waittime(0.5)
+        threads = [threading.Thread(target=use_waittime) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(20000.0, loader.context.rate_limit_waittime)
+        loader.context._rate_controller.wait_before_query('other')
+        # the report is only printed if the rate controller waited or if a statistics file is given
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            _report_rate_statistics(loader)
+        self.assertEqual('', output.getvalue())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'statistics.json')
+            with contextlib.redirect_stdout(output):
+                _report_rate_statistics(loader, path)
+            self.assertIn('Queries: 1, 0 of which', output.getvalue())
+            with open(path, encoding='utf-8') as file:
+                self.assertEqual(20000.0, json.load(file)['total_wait_time'])
+        loader.close()
+
+    def test_concurrent_queries(self):
+        # pylint:disable=protected-access
+        rc = instaloader.RateController(instaloader.InstaloaderContext(quiet=True))
+
+        def query(query_type):
+            for i in range(2000):
+                rc.query_waittime(query_type, float(i))
+                rc._track_query(query_type, float(i))
+        threads = [threading.Thread(target=query, args=('hash{}'.format(i),)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4 * 600, rc._graphql_query_timestamps.count(600, 1999.0))
+        self.assertEqual(660, rc._query_timestamps['hash0'].count(660, 1999.0))
+
+    def test_abort_waiting(self):
+        # pylint:disable=protected-access
+        context = instaloader.InstaloaderContext(quiet=True)
+        rc = instaloader.RateController(context)
+        threading.Timer(0.1, context._abort_waiting.set).start()
+        start = time.monotonic()
+        with self.assertRaises(instaloader.AbortDownloadException):
+            rc.sleep(60)
+        self.assertLess(time.monotonic() - start, 30)
+
+    def test_query_scheduler(self):
+        class Controller(instaloader.RateController):
+            def __init__(self, context):
+                super().__init__(context)
+                self.budget = 0
+                self.entered = []
+                self.done = []
+                self.condition = threading.Condition()
+
+            def query_waittime(self, query_type, current_time, untracked_queries=False):
+                return 0.0 if self.budget > 0 else 60.0
+
+            def wait_before_query(self, query_type):
+                with self.condition:
+                    self.entered.append(query_type)
+                    self.condition.wait_for(lambda: self.budget > 0)
+                    self.budget -= 1
+                    self.done.append(query_type)
+
+            def allow(self):
+                with self.condition:
+                    self.budget += 1
+                    self.condition.notify_all()
+
+        def wait_until(condition):
+            deadline = time.monotonic() + 10
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(condition())
+
+        rc = Controller(instaloader.InstaloaderContext(quiet=True))
+        scheduler = instaloader.QueryScheduler(rc)
+        threads = []
+
+        def query(query_type, priority):
+            threads.append(threading.Thread(target=scheduler.wait_before_query, args=(query_type, priority),
+                                            daemon=True))
+            threads[-1].start()
+
+        # the budget is exhausted, and a query is waiting for it within the rate controller
+        query('first', instaloader.QueryPriority.POSTS)
+        wait_until(lambda: rc.entered == ['first'])
+        query('posts', instaloader.QueryPriority.POSTS)
+        wait_until(lambda: scheduler.queue_depths() == {instaloader.QueryPriority.POSTS: 1})
+        query('story', instaloader.QueryPriority.STORY)
+        wait_until(lambda: len(scheduler.queue_depths()) == 2)
+        # when the allowed query is done, the waiting ones are woken, and the one with higher priority goes first
+        rc.allow()
+        wait_until(lambda: rc.entered == ['first', 'story'])
+        self.assertEqual({instaloader.QueryPriority.POSTS: 1}, scheduler.queue_depths())
+        rc.allow()
+        wait_until(lambda: rc.entered == ['first', 'story', 'posts'])
+        rc.allow()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(['first', 'story', 'posts'], rc.done)
+
+    def test_adaptive_budgets(self):
+        # pylint:disable=protected-access
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'budgets.json')
+            rc = instaloader.AdaptiveRateController(instaloader.InstaloaderContext(quiet=True), path)
+            rc._track_query('iphone', rc._clock())
+            rc._report_429('iphone')
+            self.assertEqual({'iphone': 100.0}, rc.budgets)
+            # the budgets grow back, but not beyond the limits of RateController
+            for _ in range(20000):
+                rc._track_query('iphone', rc._clock())
+            self.assertEqual({'iphone': 200.0}, rc.budgets)
+            rc._report_429('iphone')
+            self.assertEqual(['budgets.json'], os.listdir(os.path.dirname(path)))
+            rc = instaloader.AdaptiveRateController(instaloader.InstaloaderContext(quiet=True), path)
+            self.assertEqual({'iphone': 100.0}, rc.budgets)
+            self.assertEqual(100, rc.count_per_sliding_window('iphone'))
+            # invalid files are ignored
+            for content in ['{', '[]', '{"accounts": []}', '{"accounts": {"": {"iphone": "many"}}}']:
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(content)
+                rc = instaloader.AdaptiveRateController(instaloader.InstaloaderContext(quiet=True), path)
+                self.assertEqual({}, rc.budgets)
+                self.assertEqual(200, rc.count_per_sliding_window('iphone'))
+
+
+class TestNodeIterator(unittest.TestCase):
+
+    @staticmethod
+    def paged_iterator(context, pages, delay=0.0, threads=None):
+        def graphql_query(query_hash, variables, referer=None):
+            if threads is not None:
+                threads.append(threading.current_thread().name)
+            time.sleep(delay)
+            page = int(variables.get('after', 0))
+            return {'edges': [{'node': {'id': page * 12 + i}} for i in range(12)],
+                    'page_info': {'has_next_page': page + 1 < pages, 'end_cursor': str(page + 1)}}
+        context.graphql_query = graphql_query
+        return instaloader.NodeIterator(context, 'hash', lambda d: d, lambda n: n['id'])
+
+    def test_prefetch_pages(self):
+        for prefetch_pages in [False, True]:
+            context = instaloader.InstaloaderContext(sleep=False, quiet=True, prefetch_pages=prefetch_pages)
+            threads = []
+            self.assertEqual(list(range(48)), list(self.paged_iterator(context, 4, threads=threads)))
+            # all but the first page are queried in the background
+            self.assertEqual([False] + 3 * [prefetch_pages],
+                             [name.startswith('instaloader-prefetch') for name in threads])
+            context.close()
+
+    def test_prefetch_pages_freeze(self):
+        # pylint:disable=protected-access
+        context = instaloader.InstaloaderContext(sleep=False, quiet=True, prefetch_pages=True)
+        iterator = self.paged_iterator(context, 4, delay=0.5)
+        self.assertEqual(list(range(15)), list(islice(iterator, 15)))
+        while not iterator._prefetched[1].running():
+            time.sleep(0.01)
+        start = time.monotonic()
+        frozen = iterator.freeze()
+        # the page that is being queried in the background is not waited for
+        self.assertLess(time.monotonic() - start, 0.25)
+        self.assertFalse(iterator._prefetched[1].done())
+        resumed = self.paged_iterator(context, 4)
+        resumed.thaw(frozen)
+        self.assertEqual(list(range(14, 48)), list(resumed))
+        self.assertEqual(0, resumed.first_item)
+        context.close()
+
+    def test_compact_freeze(self):
+        context = instaloader.InstaloaderContext(sleep=False, quiet=True)
+        iterator = self.paged_iterator(context, 4)
+        self.assertEqual(list(range(15)), list(islice(iterator, 15)))
+        frozen = iterator.freeze()
+        self.assertIsNone(frozen.remaining_data)
+        self.assertEqual('1', frozen.page_cursor)
+        self.assertEqual(list(range(14, 24)), frozen.remaining_ids)
+        # resume files of earlier versions store the remaining data
+        legacy = frozen._replace(remaining_ids=None, page_cursor=None, remaining_data={
+            'edges': [{'node': {'id': i}} for i in range(14, 24)],
+            'page_info': {'has_next_page': True, 'end_cursor': '2'}})
+        for resume_from in [frozen, legacy]:
+            resumed = self.paged_iterator(context, 4)
+            resumed.thaw(resume_from)
+            self.assertEqual(list(range(14, 30)), list(islice(resumed, 16)))
+            refrozen = resumed.freeze()
+            self.assertEqual('2', refrozen.page_cursor)
+            self.assertEqual(list(range(29, 36)), refrozen.remaining_ids)
+
+    def test_adaptive_page_length(self):
+        requested = []
+
+        def graphql_query(query_hash, variables, referer=None):
+            requested.append(variables['first'])
+            if variables['first'] > 40:
+                raise instaloader.QueryReturnedBadRequestException("400 Bad Request")
+            offset = int(variables.get('after', 0))
+            end = min(offset + min(variables['first'], 30), 100)
+            return {'edges': [{'node': {'id': i}} for i in range(offset, end)],
+                    'page_info': {'has_next_page': end < 100, 'end_cursor': str(end)}}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'page-lengths.json')
+            context = instaloader.InstaloaderContext(sleep=False, quiet=True,
+                                                     page_lengths=instaloader.PageLengths(path))
+            context.graphql_query = graphql_query
+            self.assertEqual(list(range(100)),
+                             list(instaloader.NodeIterator(context, 'hash', lambda d: d, lambda n: n['id'])))
+            self.assertEqual([12, 24, 48, 24, 24, 24], requested)
+            context.close()
+            self.assertEqual(24, instaloader.PageLengths(path).length('hash'))
+
+    def test_adaptive_page_length_probe_again(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'page-lengths.json')
+            page_lengths = instaloader.PageLengths(path)
+            page_lengths.served('hash', 24, 20, True)
+            page_lengths.served('hash', 20, 20, True)
+            self.assertEqual(20, page_lengths.length('hash'))
+            page_lengths.save()
+            # one short page does not keep the page length forever
+            page_lengths = instaloader.PageLengths(path, probe_after=0)
+            self.assertEqual(20, page_lengths.length('hash'))
+            page_lengths.served('hash', 20, 20, True)
+            self.assertEqual(40, page_lengths.length('hash'))
+
+    def test_adaptive_page_length_freeze(self):
+        def graphql_query(query_hash, variables, referer=None):
+            offset = int(variables.get('after', 0))
+            end = min(offset + variables['first'], 100)
+            return {'edges': [{'node': {'id': i}} for i in range(offset, end)],
+                    'page_info': {'has_next_page': end < 100, 'end_cursor': str(end)}}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'page-lengths.json')
+            context = instaloader.InstaloaderContext(sleep=False, quiet=True,
+                                                     page_lengths=instaloader.PageLengths(path))
+            context.graphql_query = graphql_query
+            iterator = instaloader.NodeIterator(context, 'hash', lambda d: d, lambda n: n['id'])
+            self.assertEqual(list(range(15)), list(islice(iterator, 15)))
+            frozen = iterator.freeze()
+            self.assertEqual(24, frozen.page_length)
+            context.close()
+            # the learned page length is longer than the one of the frozen page now
+            context = instaloader.InstaloaderContext(sleep=False, quiet=True,
+                                                     page_lengths=instaloader.PageLengths(path))
+            context.graphql_query = graphql_query
+            resumed = instaloader.NodeIterator(context, 'hash', lambda d: d, lambda n: n['id'])
+            resumed.thaw(frozen)
+            self.assertEqual(list(range(14, 100)), list(resumed))
+            context.close()
+
+    def test_checkpoints(self):
+        context = instaloader.InstaloaderContext(sleep=False, quiet=True)
+        iterator = self.paged_iterator(context, 4)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'resume.json.xz')
+            completed = []
+            with instaloader.resumable_iteration(context, iterator, instaloader.load_structure_from_file,
+                                                 instaloader.save_structure_to_file, lambda magic: path,
+                                                 checkpoint_every=10, before_checkpoint=lambda: completed.append(1)):
+                for item in iterator:
+                    if item == 25:
+                        # as if the process was killed here
+                        frozen = instaloader.load_structure_from_file(context, path)
+                        self.assertEqual(['resume.json.xz'], os.listdir(tmpdir))
+                        break
+            self.assertEqual(2, len(completed))
+            self.assertFalse(os.path.exists(path))
+            resumed = self.paged_iterator(context, 4)
+            resumed.thaw(frozen)
+            self.assertEqual(19, next(resumed))
+
+
+class TestAsyncContext(unittest.TestCase):
+
+    def test_async_node_iterator(self):
+        # pylint:disable=protected-access
+        class Adapter(requests.adapters.BaseAdapter):
+            def send(self, request, **kwargs):
+                variables = json.loads(urllib.parse.parse_qs(request.body)['variables'][0])
+                page = int(variables.get('after', 0))
+                resp = requests.Response()
+                resp.status_code = 200
+                resp.headers['Content-Type'] = 'application/json'
+                resp._content = json.dumps({'status': 'ok', 'data': {
+                    'edges': [{'node': {'id': page * 12 + i}} for i in range(12)],
+                    'page_info': {'has_next_page': page < 2, 'end_cursor': str(page + 1)}}}).encode()
+                resp.request = request
+                return resp
+
+            def close(self):
+                pass
+
+        async def iterate(actx):
+            iterator = instaloader.AsyncNodeIterator(actx, None, lambda d: d['data'], lambda n: n['id'],
+                                                     {'first': 12}, doc_id='doc')
+            return [node async for node in iterator]
+
+        context = instaloader.InstaloaderContext(sleep=False, quiet=True)
+        context._get_query_session('doc_id').mount('https://', Adapter())
+        context.doc_id_graphql_query('doc', {})
+        self.assertEqual(list(range(36)), asyncio.run(iterate(instaloader.AsyncInstaloaderContext(context))))
+        # the queries of the async iteration are rate controlled together with the ones of the context
+        self.assertEqual({'doc': 4}, context.rate_controller_statistics().queries)
+        context.close()
+
+
+class TestSectionIterator(unittest.TestCase):
+
+    def test_freeze_thaw(self):
+        context = instaloader.InstaloaderContext(sleep=False, quiet=True)
+
+        def get_json(path, params):
+            # pages of 2 sections with 3 media each
+            page = int(params.get('max_id', 0))
+            return {'sections': [{'layout_content': {'medias': [{'media': page * 6 + section * 3 + i}
+                                                                for i in range(3)]}} for section in range(2)],
+                    'more_available': page < 3, 'next_max_id': str(page + 1)}
+        context.get_json = get_json
+
+        def section_iterator():
+            return instaloader.SectionIterator(context, lambda d: d, lambda m: m, 'explore/locations/1/')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'resume.json.xz')
+            iterator = section_iterator()
+            with self.assertRaises(KeyboardInterrupt):
+                with instaloader.resumable_iteration(context, iterator, instaloader.load_structure_from_file,
+                                                     instaloader.save_structure_to_file, lambda magic: path):
+                    for item in iterator:
+                        if item == 9:
+                            raise KeyboardInterrupt
+            resumed = section_iterator()
+            with instaloader.resumable_iteration(context, resumed, instaloader.load_structure_from_file,
+                                                 instaloader.save_structure_to_file,
+                                                 lambda magic: path) as (is_resuming, start_index):
+                self.assertTrue(is_resuming)
+                self.assertEqual(9, start_index)
+                self.assertEqual(list(range(9, 24)), list(resumed))
+
+
+class TestLatestStamps(unittest.TestCase):
+
+    def test_unchanged_posts(self):
+        context = instaloader.InstaloaderContext(quiet=True)
+
+        def profile(post_ids):
+            return instaloader.Profile(context, {'username': 'user', 'edge_owner_to_timeline_media': {
+                'count': len(post_ids), 'edges': [{'node': {'id': str(i)}} for i in post_ids]}})
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'latest-stamps.ini')
+            self.assertFalse(instaloader.Instaloader._posts_unchanged(profile([3, 2, 1]),
+                                                                      instaloader.LatestStamps(path)))
+            instaloader.LatestStamps(path).set_last_post('user', 3, 3)
+            stamps = instaloader.LatestStamps(path)
+            # with post 1 pinned
+            self.assertTrue(instaloader.Instaloader._posts_unchanged(profile([1, 3, 2]), stamps))
+            self.assertFalse(instaloader.Instaloader._posts_unchanged(profile([4, 3, 2, 1]), stamps))
+            # post 3 deleted, post 4 added
+            self.assertFalse(instaloader.Instaloader._posts_unchanged(profile([4, 2, 1]), stamps))
+
+
+class TestPostsDownloadLoop(unittest.TestCase):
+
+    def test_fast_update_with_download_workers(self):
+        # pylint:disable=protected-access
+        with instaloader.Instaloader(quiet=True, download_workers=2) as loader:
+            downloaded_posts = []
+
+            def download_post(post, target):
+                downloaded_posts.append(post)
+                # the first post's download takes long, the third one has been downloaded before
+                delay, downloaded = {0: (1.0, True), 2: (0.0, False)}.get(post, (0.0, True))
+                return loader._current_post.post.submit(loader.context,
+                                                        lambda: time.sleep(delay) or downloaded)
+            loader.download_post = download_post
+
+            def posts():
+                for post in range(10):
+                    yield post
+                    # obtaining the next post takes a while
+                    time.sleep(0.1)
+            loader.posts_download_loop(posts(), 'target', fast_update=True)
+            self.assertEqual([0, 1, 2], downloaded_posts)
+
+    def test_concurrent_targets(self):
+        # pylint:disable=protected-access
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                instaloader.Instaloader(target_workers=3, dirname_pattern=os.path.join(tmpdir, '{target}')) as loader:
+            def download_post(post, target):
+                loader.context.log('post {}'.format(post))
+                time.sleep(0.02)
+                return True
+            loader.download_post = download_post
+
+            def download(i, profile):
+                if profile.username == 'interrupted':
+                    # as if Ctrl+C was pressed while the other targets are being downloaded
+                    time.sleep(0.3)
+                    raise KeyboardInterrupt
+                loader.posts_download_loop(TestNodeIterator.paged_iterator(loader.context, 10), profile.username)
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output), self.assertRaises(KeyboardInterrupt):
+                loader._download_targets_concurrently(
+                    [(i, SimpleNamespace(username=username)) for i, username in enumerate(['a', 'b', 'interrupted'])],
+                    download)
+            tags = [line.split(' ', 1)[0] for line in output.getvalue().splitlines()]
+            self.assertEqual({'[a]', '[b]'}, set(tags))
+            # the output of the targets is printed while they are running
+            self.assertLess(tags.index('[b]'), len(tags) - 1 - tags[::-1].index('[a]'))
+            self.assertLess(tags.index('[a]'), len(tags) - 1 - tags[::-1].index('[b]'))
+            # the interrupted targets saved their resume information
+            for target in ['a', 'b']:
+                self.assertTrue(any(name.startswith('iterator_') for name in os.listdir(os.path.join(tmpdir, target))))
+
+
+class TestQueryEstimate(unittest.TestCase):
+
+    def test_simulate_from_recorded_queries(self):
+        context = instaloader.InstaloaderContext(quiet=True)
+        estimate = instaloader.QueryEstimate(sleep=False)
+        estimate.add('other')
+        self.assertEqual(1.0, estimate.simulate(instaloader.RateController(context)))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'rate-controller.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump({'accounts': {'': {'query_timestamps': {'other': [time.time() - 60] * 75}}}}, file)
+            with open(path, encoding='utf-8') as file:
+                state = file.read()
+            rc = instaloader.PersistentRateController(context, path)
+            seconds = estimate.simulate(rc)
+            # the 75 queries of the last minute exhaust the budget of the 11 minutes window
+            self.assertAlmostEqual(606 + 1, seconds, delta=1)
+            # closing the rate controller does not save the simulated queries
+            rc.close()
+            with open(path, encoding='utf-8') as file:
+                self.assertEqual(state, file.read())
+            budgets_path = os.path.join(tmpdir, 'budgets.json')
+            rc = instaloader.AdaptiveRateController(context, budgets_path)
+            estimate.simulate(rc)
+            rc.close()
+            self.assertFalse(os.path.exists(budgets_path))
+
+
+class TestWriteRaw(unittest.TestCase):
+
+    DATA = bytes(range(256)) * 400
+
+    @staticmethod
+    def response(data, status_code=200, content_range=None):
+        resp = requests.Response()
+        resp.status_code = status_code
+        resp.headers['Content-Length'] = str(len(data))
+        if content_range is not None:
+            resp.headers['Content-Range'] = content_range
+        resp.raw = io.BytesIO(data)
+        return resp
+
+    def test_resume_after_kill(self):
+        script = textwrap.dedent("""
+            import io, sys, time
+            import requests
+            import instaloader
+
+            class StallingBody(io.BytesIO):
+                def readinto(self, buffer):
+                    if self.tell() >= len(self.getvalue()) // 2:
+                        open(sys.argv[2], 'w').close()
+                        time.sleep(60)
+                    return super().readinto(memoryview(buffer)[:1000])
+
+            data = bytes(range(256)) * 400
+            resp = requests.Response()
+            resp.status_code = 200
+            resp.headers['Content-Length'] = str(len(data))
+            resp.raw = StallingBody(data)
+            instaloader.InstaloaderContext(quiet=True).write_raw(resp, sys.argv[1])
+        """)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'file.jpg')
+            stalled = os.path.join(tmpdir, 'stalled')
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            process = subprocess.Popen([sys.executable, '-c', script, filename, stalled], env=env)
+            try:
+                deadline = time.monotonic() + 30
+                while not os.path.exists(stalled) and process.poll() is None and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                self.assertTrue(os.path.exists(stalled))
+            finally:
+                process.kill()
+                process.wait()
+            # the size of the temporary file is the length of the data that has been written
+            offset = os.path.getsize(filename + '.temp')
+            self.assertLessEqual(offset, len(self.DATA) // 2)
+            with open(filename + '.temp', 'rb') as file:
+                self.assertEqual(self.DATA[:offset], file.read())
+            context = instaloader.InstaloaderContext(quiet=True)
+            context.write_raw(self.response(self.DATA[offset:], 206, 'bytes {}-{}/{}'.format(
+                offset, len(self.DATA) - 1, len(self.DATA))), filename)
+            with open(filename, 'rb') as file:
+                self.assertEqual(self.DATA, file.read())
+            self.assertFalse(os.path.exists(filename + '.temp'))
+
+
+class TestResumeDownload(unittest.TestCase):
+
+    @staticmethod
+    def media_adapter(data, etag, requested):
+        class Adapter(requests.adapters.BaseAdapter):
+            def send(self, request, **kwargs):
+                requested.append(dict(request.headers))
+                offset = 0
+                if 'Range' in request.headers and request.headers.get('If-Range', etag) == etag:
+                    offset = int(request.headers['Range'][len('bytes='):-1])
+                resp = TestWriteRaw.response(data[offset:], 206 if offset else 200,
+                                             'bytes {}-{}/{}'.format(offset, len(data) - 1, len(data))
+                                             if offset else None)
+                resp.headers['Content-Type'] = 'image/jpeg'
+                resp.headers['ETag'] = etag
+                resp.request = request
+                return resp
+
+            def close(self):
+                pass
+        return Adapter()
+
+    def test_if_range(self):
+        # pylint:disable=protected-access
+        data = TestWriteRaw.DATA
+        changed = data[::-1]
+        for current_data, current_etag in [(data, '"v1"'), (changed, '"v2"')]:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                filename = os.path.join(tmpdir, 'pic')
+                loader = instaloader.Instaloader(quiet=True)
+                # interrupted download of the original resource
+                resp = TestWriteRaw.response(data[:1000])
+                resp.headers['Content-Length'] = str(len(data))
+                resp.headers['ETag'] = '"v1"'
+                with self.assertRaises(instaloader.ConnectionException):
+                    loader.context.write_raw(resp, filename + '.jpg')
+                self.assertEqual('"v1"', loader.context.temp_validator(filename + '.jpg.temp'))
+                requested = []
+                loader.context._media_session.mount('https://', self.media_adapter(current_data, current_etag,
+                                                                                   requested))
+                self.assertTrue(loader.download_pic(filename, 'https://example.com/pic.jpg', datetime.now()))
+                self.assertEqual('"v1"', requested[0]['If-Range'])
+                self.assertEqual('bytes=1000-', requested[0]['Range'])
+                # a changed resource is downloaded completely rather than appended to the temporary file
+                with open(filename + '.jpg', 'rb') as file:
+                    self.assertEqual(current_data, file.read())
+                self.assertEqual(['pic.jpg'], os.listdir(tmpdir))
+                loader.close()
+
+
+class TestQuerySessions(unittest.TestCase):
+
+    def test_concurrent_iphone_cookies(self):
+        # pylint:disable=protected-access
+        sent_cookies = []
+
+        class Adapter(requests.adapters.BaseAdapter):
+            def send(self, request, **kwargs):
+                sent_cookies.append(request.headers.get('Cookie', ''))
+                time.sleep(0.05)
+                resp = requests.Response()
+                resp.status_code = 200
+                resp.headers['Content-Type'] = 'application/json'
+                resp._content = b'{"status": "ok"}'
+                resp.request = request
+                resp.url = request.url
+                resp.cookies.set('csrftoken', str(len(sent_cookies)))
+                return resp
+
+            def close(self):
+                pass
+
+        context = instaloader.InstaloaderContext(sleep=False, quiet=True)
+        context.update_cookies({'sessionid': 'session'})
+        session = context._get_query_session('iphone')
+        session.mount('https://', Adapter())
+        threads = [threading.Thread(target=context.get_iphone_json, args=('api/v1/feed/timeline/', {}))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every request got the cookies of the main session, which got the cookies of the responses
+        self.assertEqual(8, len(sent_cookies))
+        self.assertTrue(all('sessionid=session' in cookies for cookies in sent_cookies))
+        self.assertIn('csrftoken', context._session.cookies)
+        self.assertEqual(0, len(session.cookies))
+        context.close()
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def test_pages_not_cached(self):
+        # pylint:disable=protected-access
+        paths = []
+        newest = ['first']
+
+        def get_json_response(path, params, host, *args):
+            paths.append(path)
+            if path.startswith('api/v1/users/web_profile_info/'):
+                return {'data': {'user': {'username': 'profile', 'id': '1'}}}
+            return {'data': {'xdt_api__v1__feed__user_timeline_graphql_connection': {
+                'edges': [{'node': {'code': newest[0], 'pk': '1', 'media_type': 1, 'taken_at': 0,
+                                    'has_liked': False, 'like_count': 0}}],
+                'page_info': {'has_next_page': False, 'end_cursor': None}}}, 'status': 'ok'}
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shortcodes = []
+            for shortcode in ['first', 'second']:
+                newest[0] = shortcode
+                context = instaloader.InstaloaderContext(sleep=False, quiet=True,
+                                                         metadata_cache=instaloader.MetadataCache(tmpdir))
+                context._get_json_response = get_json_response
+                profile = instaloader.Profile.from_username(context, 'profile')
+                shortcodes.append([post.shortcode for post in profile.get_posts()])
+                context.close()
+            # the second run sees the new first page, but reuses the profile metadata
+            self.assertEqual([['first'], ['second']], shortcodes)
+            self.assertEqual(1, sum(path.startswith('api/v1/users/web_profile_info/') for path in paths))
+            self.assertEqual(3, len(paths))
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def test_lone_surrogates(self):
+        from instaloader import jsoncodec
+        data = jsoncodec.loads(b'{"text": "\\ud83d trimmed"}')
+        self.assertEqual({'text': '\ud83d trimmed'}, data)
+        self.assertEqual(data, jsoncodec.loads(jsoncodec.dumps(data)))
+        with self.assertRaises(ValueError):
+            jsoncodec.loads(b'{"text": ')
+
+
 if __name__ == '__main__':
     unittest.main()